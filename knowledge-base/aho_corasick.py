@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Aho–Corasick 多模式字串匹配
+一次掃描文本即可找出所有詞表中的詞，供各索引建立腳本共用
+"""
+from collections import deque
+
+
+class AhoCorasick:
+    """多模式匹配自動機
+
+    patterns 為 {詞: 值}，值通常是正規化後的概念 id；
+    值為 None 的詞只用來遮蔽較短的匹配（例如「紫微斗數」遮蔽「紫微」）
+    """
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]  # 每個狀態結束的 (詞長, 值)
+
+        for word, value in patterns.items():
+            state = 0
+            for ch in word:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = nxt
+            self.output[state].append((len(word), value))
+
+        # BFS 建立失敗指標，並把失敗狀態的輸出合併進來
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def iter_all(self, text):
+        """產生所有（可重疊）匹配 (起點, 終點, 值)"""
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, value in output[state]:
+                yield i + 1 - length, i + 1, value
+
+    def find(self, text):
+        """產生不重疊的最左最長匹配 (起點, 終點, 值)，略過遮蔽詞"""
+        matches = sorted(self.iter_all(text), key=lambda m: (m[0], m[0] - m[1]))
+        last_end = 0
+        for start, end, value in matches:
+            if start < last_end:
+                continue
+            last_end = end
+            if value is not None:
+                yield start, end, value
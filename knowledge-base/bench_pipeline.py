@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+處理流程各階段的基準測試
+以 synth_corpus 產生不同大小的合成書，分別量測每個階段的吞吐量（MB/s）與峰值記憶體，
+並由最小、最大兩種大小估計時間的成長指數（1 為線性），超線性的階段（例如二次方的字串串接）會被標出
+
+用法：
+    python bench_pipeline.py                              # 1MB、4MB、16MB
+    python bench_pipeline.py --sizes 1MB,8MB,64MB
+    python bench_pipeline.py --json bench.json            # 儲存結果
+    python bench_pipeline.py --baseline bench.json        # 與先前結果比較，吞吐量退步超過 30% 時結束碼為 1
+"""
+import gc
+import sys
+import json
+import math
+import time
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+from synth_corpus import SyntheticCorpus, parse_size
+from ocr_quality import score_book
+from ingest import read_source
+from process_books_v2 import (
+    clean_ocr_text, smart_split, split_by_paragraphs, extract_keywords, generate_rag_chunks,
+)
+from process_epub import parse_epub, merge_short_chapters
+
+# 成長指數超過此值視為超線性
+SUPERLINEAR_EXPONENT = 1.2
+# 吞吐量低於基準的此比例視為退步
+REGRESSION_RATIO = 0.7
+
+
+def _entries(sections):
+    return [{
+        "id": f"synth_{i + 1:03d}",
+        "source": "synth",
+        "category": "八字",
+        "chapter": section["chapter"],
+        "title": section["title"],
+        "content": section["content"],
+        "keywords": [],
+    } for i, section in enumerate(sections)]
+
+
+def _short_chapters(sections, piece=300):
+    """把章節切成約 piece 字的小章，模擬 ePub 中大量過短的 xhtml"""
+    chapters = []
+    for section in sections:
+        content = section["content"]
+        for start in range(0, len(content), piece):
+            chapters.append({"chapter": section["chapter"], "title": section["title"],
+                             "content": content[start:start + piece]})
+    return chapters
+
+
+def prepare(size_bytes, workdir, seed=0):
+    """產生各階段的輸入（不計時）"""
+    corpus = SyntheticCorpus(seed=seed)
+    raw = corpus.book_text(size_bytes)
+    txt_path = Path(workdir) / f"synth_{size_bytes}.txt"
+    txt_path.write_text(raw, encoding='utf-8')
+    cleaned = clean_ocr_text(raw)
+    sections = smart_split(cleaned, "synth")
+    epub_path = corpus.write_epub(Path(workdir) / f"synth_{size_bytes}.epub", size_bytes)
+    return {
+        "raw": raw,
+        "txt": txt_path,
+        "cleaned": cleaned,
+        "sections": sections,
+        "entries": _entries(sections),
+        "short_chapters": _short_chapters(sections),
+        "epub": epub_path,
+    }
+
+
+# (階段名稱, 函式)；函式只接收 prepare() 的輸入
+STAGES = [
+    ("read_source", lambda ctx: read_source(ctx["txt"])),
+    ("clean_ocr_text", lambda ctx: clean_ocr_text(ctx["raw"])),
+    ("score_book", lambda ctx: score_book(ctx["cleaned"])),
+    ("smart_split", lambda ctx: smart_split(ctx["cleaned"], "synth")),
+    ("split_by_paragraphs", lambda ctx: split_by_paragraphs(ctx["cleaned"])),
+    ("extract_keywords", lambda ctx: [extract_keywords(s["content"]) for s in ctx["sections"]]),
+    ("generate_rag_chunks", lambda ctx: generate_rag_chunks(ctx["entries"])),
+    ("merge_short_chapters", lambda ctx: merge_short_chapters([dict(c) for c in ctx["short_chapters"]])),
+    ("parse_epub", lambda ctx: parse_epub(ctx["epub"])),
+]
+
+
+def measure(fn, ctx):
+    """回傳 (秒數, 峰值記憶體位元組)；計時與量記憶體分兩次執行，避免 tracemalloc 拖慢計時"""
+    gc.collect()
+    t0 = time.perf_counter()
+    fn(ctx)
+    elapsed = time.perf_counter() - t0
+
+    gc.collect()
+    tracemalloc.start()
+    fn(ctx)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def run(sizes, seed=0):
+    """回傳 {階段: {大小: {"seconds", "mb_per_s", "peak_mb"}}}"""
+    results = {name: {} for name, _ in STAGES}
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in sizes:
+            ctx = prepare(size, workdir, seed)
+            mb = len(ctx["raw"].encode('utf-8')) / (1 << 20)
+            print(f"📦 {mb:,.1f} MB（{len(ctx['sections']):,} 個章節）")
+            for name, fn in STAGES:
+                elapsed, peak = measure(fn, ctx)
+                results[name][str(size)] = {
+                    "seconds": round(elapsed, 4),
+                    "mb_per_s": round(mb / elapsed, 2) if elapsed else None,
+                    "peak_mb": round(peak / (1 << 20), 2),
+                }
+                print(f"   - {name:<22} {mb / elapsed:8.2f} MB/s  峰值 {peak / (1 << 20):8.1f} MB")
+            del ctx
+    return results
+
+
+def growth_exponent(timings):
+    """由最小與最大輸入估計 時間 ∝ 大小^k 的 k"""
+    sizes = sorted(timings, key=int)
+    small, large = sizes[0], sizes[-1]
+    t_small, t_large = timings[small]["seconds"], timings[large]["seconds"]
+    if small == large or t_small <= 0:
+        return None
+    return math.log(t_large / t_small) / math.log(int(large) / int(small))
+
+
+def report(results):
+    print(f"\n📊 成長指數（1 為線性，> {SUPERLINEAR_EXPONENT} 標為超線性）")
+    flagged = []
+    for name, timings in results.items():
+        k = growth_exponent(timings)
+        if k is None:
+            continue
+        mark = "⚠️" if k > SUPERLINEAR_EXPONENT else "✅"
+        if k > SUPERLINEAR_EXPONENT:
+            flagged.append(name)
+        print(f"   {mark} {name:<22} k = {k:.2f}")
+    return flagged
+
+
+def compare(results, baseline):
+    """與基準結果比較相同大小的吞吐量，回傳退步的 (階段, 大小, 基準, 目前)"""
+    regressions = []
+    for name, timings in results.items():
+        for size, current in timings.items():
+            before = baseline.get(name, {}).get(size)
+            if before and before["mb_per_s"] and current["mb_per_s"] < before["mb_per_s"] * REGRESSION_RATIO:
+                regressions.append((name, size, before["mb_per_s"], current["mb_per_s"]))
+    return regressions
+
+
+def main():
+    args = sys.argv[1:]
+
+    def option(flag, default=None):
+        return args[args.index(flag) + 1] if flag in args else default
+
+    sizes = [parse_size(s) for s in option("--sizes", "1MB,4MB,16MB").split(",")]
+    results = run(sizes, seed=int(option("--seed", "0")))
+    report(results)
+
+    if option("--json"):
+        with open(option("--json"), 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"📄 結果: {option('--json')}")
+
+    if option("--baseline"):
+        with open(option("--baseline"), 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f))
+        for name, size, before, current in regressions:
+            print(f"   ❌ {name} @ {int(size) / (1 << 20):g} MB: {before:.2f} → {current:.2f} MB/s")
+        if regressions:
+            sys.exit(1)
+        print("✅ 沒有吞吐量退步")
+
+
+if __name__ == "__main__":
+    main()
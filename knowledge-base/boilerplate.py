@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+版面雜訊與書前資料過濾
+建置時辨識不含命理內容的分塊：目錄（大量短行、多為章節標題或頁碼）、
+版權頁（出版者、ISBN、責任編輯等版權用語）、封面（極短且沒有句子），
+移到冷資料 cold_chunks.json，不進入索引與每次請求的掃描；
+另外以跨頁的行頻率找出每頁重複的頁首／頁尾（書名、頁碼），在分段前刪除
+
+用法：
+    python boilerplate.py            # 過濾 rag_chunks.json 並重建各索引
+    python boilerplate.py --bench    # 比較過濾前後的索引大小與查詢延遲
+"""
+import re
+import sys
+import json
+import time
+import random
+from collections import Counter
+from pathlib import Path
+
+from ocr_quality import iter_pages
+
+KB_DIR = Path(__file__).resolve().parent
+
+# 版權頁用語：一個分塊出現 COPYRIGHT_MIN_TERMS 種以上即視為版權頁
+# （參考書目常同時出現「出版社」「有限公司」，所以門檻設為 3）
+COPYRIGHT_TERMS = [
+    "版權所有", "版权所有", "翻印必究", "侵權必究", "ISBN", "書號", "书号", "Copyright", "©",
+    "出版者", "出版社", "發行人", "发行人", "發行所", "有限公司", "責任編輯", "责任编辑",
+    "美術編輯", "美術設計", "封面設計", "封面设计", "排版", "印刷", "定價", "定价",
+    "開本", "开本", "印張", "印张", "初版", "版次", "郵政劃撥", "行銷企劃",
+]
+COPYRIGHT_MIN_TERMS = 3
+
+# 目錄：非空行數、短行比例、標題行比例、句末標點密度
+TOC_MIN_LINES = 8
+TOC_SHORT_LINE = 20
+TOC_MIN_SHORT_RATIO = 0.8
+TOC_MIN_HEADING_RATIO = 0.4
+TOC_MAX_SENTENCE_DENSITY = 0.005
+
+TOC_LINE_RE = re.compile(
+    r'^(第[一二三四五六七八九十百零〇\d]+[章節节篇回卷]'
+    r'|[一二三四五六七八九十\d]+[、.]'
+    r'|\d+\.\d+'
+    r'|目\s*[錄录]|自?序[言文]?$|前言|導論|导论|附[錄录]|後記|后记|跋$|凡例)'
+    r'|(?:[.…·．]{2,}|\s)\d{1,4}$'
+)
+SENTENCE_END_RE = re.compile(r'[。；！？]')
+
+# 封面：去除空白後少於此字數且沒有句末標點
+COVER_MAX_CHARS = 80
+
+# 頁首／頁尾：每頁前後各 EDGE_LINES 個非空行中，長度不超過 RUNNING_HEAD_MAX_CHARS、
+# 出現在至少 RUNNING_HEAD_MIN_RATIO 比例（且不少於 RUNNING_HEAD_MIN_PAGES）頁面的行
+EDGE_LINES = 2
+RUNNING_HEAD_MAX_CHARS = 40
+RUNNING_HEAD_MIN_RATIO = 0.3
+RUNNING_HEAD_MIN_PAGES = 4
+
+_NUMBER_RE = re.compile(r'[0-9〇零一二三四五六七八九十百]+')
+
+
+def classify_text(text):
+    """回傳雜訊類型（"copyright"、"toc"、"cover"），一般內容回傳 None"""
+    terms = sum(1 for term in COPYRIGHT_TERMS if term in text)
+    if terms >= COPYRIGHT_MIN_TERMS:
+        return "copyright"
+
+    sentences = len(SENTENCE_END_RE.findall(text))
+    compact = "".join(text.split())
+    if len(compact) < COVER_MAX_CHARS and not sentences:
+        return "cover"
+
+    lines = [line.strip() for line in text.split("\n") if line.strip()]
+    if len(lines) >= TOC_MIN_LINES:
+        short = sum(1 for line in lines if len(line) <= TOC_SHORT_LINE) / len(lines)
+        headings = sum(1 for line in lines if TOC_LINE_RE.search(line)) / len(lines)
+        if (short >= TOC_MIN_SHORT_RATIO and headings >= TOC_MIN_HEADING_RATIO
+                and sentences / len(compact) < TOC_MAX_SENTENCE_DENSITY):
+            return "toc"
+    return None
+
+
+def split_copyright_tail(text):
+    """正文後接版權頁的分塊：回傳 (正文, 版權頁)；整塊都是版權頁時回傳 None
+
+    從第一個含版權用語、且之後仍有 COPYRIGHT_MIN_TERMS 種用語的行起算，
+    再往前併入緊鄰的短行（書名、「作」「者」等拆行的欄位名）
+    """
+    lines = text.split("\n")
+    for i, line in enumerate(lines):
+        if not any(term in line for term in COPYRIGHT_TERMS):
+            continue
+        tail = "\n".join(lines[i:])
+        if sum(1 for term in COPYRIGHT_TERMS if term in tail) < COPYRIGHT_MIN_TERMS:
+            return None
+        start = i
+        while start > 0 and len(lines[start - 1].strip()) <= TOC_SHORT_LINE \
+                and not SENTENCE_END_RE.search(lines[start - 1]):
+            start -= 1
+        head = "\n".join(lines[:start]).strip()
+        if len(SENTENCE_END_RE.findall(head)) and len(head) >= COVER_MAX_CHARS:
+            return head, "\n".join(lines[start:]).strip()
+        return None
+    return None
+
+
+def filter_chunks(chunks):
+    """回傳 (保留的分塊, 冷資料分塊)；冷資料分塊附 boilerplate 欄位記錄類型
+
+    正文後接版權頁的分塊只切掉版權頁，正文保留
+    """
+    kept, cold = [], []
+    for chunk in chunks:
+        reason = classify_text(chunk["text"])
+        if reason == "copyright":
+            split = split_copyright_tail(chunk["text"])
+            if split:
+                head, tail = split
+                cold.append({**chunk, "text": tail, "boilerplate": reason})
+                chunk = {**chunk, "text": head}
+                reason = None
+        if reason:
+            cold.append({**chunk, "boilerplate": reason})
+        else:
+            kept.append(chunk)
+    return kept, cold
+
+
+def save_cold_chunks(cold, output_dir):
+    """把過濾掉的分塊寫入 cold_chunks.json（冷資料，不進入檢索）"""
+    cold_path = Path(output_dir) / "cold_chunks.json"
+    with open(cold_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "version": "1.0",
+            "total_chunks": len(cold),
+            "reasons": dict(Counter(chunk["boilerplate"] for chunk in cold)),
+            "chunks": cold
+        }, f, ensure_ascii=False, indent=2)
+    return cold_path
+
+
+def _normalize_line(line):
+    """頁碼等數字換成 #，讓「- 12 -」「- 13 -」視為同一行"""
+    return _NUMBER_RE.sub("#", "".join(line.split()))
+
+
+def _edge_lines(page):
+    lines = [line for line in page.split("\n") if line.strip()]
+    if len(lines) <= EDGE_LINES * 2:
+        return lines
+    return lines[:EDGE_LINES] + lines[-EDGE_LINES:]
+
+
+def running_heads(pages):
+    """找出各頁重複的頁首／頁尾，回傳正規化後的行集合（含句末標點的行不算）
+
+    pages 可為產生器，只逐頁讀過一次
+    """
+    counts = Counter()
+    total = 0
+    for page in pages:
+        total += 1
+        counts.update({
+            _normalize_line(line) for line in _edge_lines(page)
+            if len(line.strip()) <= RUNNING_HEAD_MAX_CHARS and not SENTENCE_END_RE.search(line)
+        })
+    min_pages = max(RUNNING_HEAD_MIN_PAGES, total * RUNNING_HEAD_MIN_RATIO)
+    return {line for line, count in counts.items() if line and count >= min_pages}
+
+
+def page_stripper(heads):
+    """回傳逐頁刪除頁首／頁尾行的函式（頁面中間的行不動）
+
+    以章節標題為頁首的書，標題第一次出現時保留，分段時仍找得到章節；
+    已見過的標題跨頁記錄，頁面須依序傳入
+    """
+    seen_headings = set()
+
+    def keep(line, edges):
+        if line not in edges or _normalize_line(line) not in heads:
+            return True
+        title = line.strip()
+        if TOC_LINE_RE.search(title) and title not in seen_headings:
+            seen_headings.add(title)
+            return True
+        return False
+
+    def strip(page):
+        if not heads:
+            return page
+        edges = set(_edge_lines(page))
+        return "\n".join(line for line in page.split("\n") if keep(line, edges))
+
+    return strip
+
+
+def strip_running_heads(pages):
+    """刪除各頁前後重複的頁首／頁尾行"""
+    pages = list(pages)
+    strip = page_stripper(running_heads(pages))
+    return [strip(page) for page in pages]
+
+
+def strip_page_furniture(text):
+    """OCR 全文：依換頁符號分頁後刪除頁首／頁尾；沒有換頁符號時原樣回傳"""
+    if "\f" not in text:
+        return text
+    pages = list(iter_pages(text.splitlines(keepends=True)))
+    return "\f".join(strip_running_heads(pages))
+
+
+def benchmark(chunks, kept, queries=200, seed=7):
+    """過濾前後的索引大小與查詢延遲（retrieval.Retriever 全掃描）"""
+    from retrieval import Retriever, _sample_queries
+
+    def size(items):
+        return len(json.dumps({"chunks": items}, ensure_ascii=False, indent=2).encode('utf-8'))
+
+    sample = _sample_queries(kept, queries, random.Random(seed))
+    print(f"📊 過濾前後（{queries} 筆模擬查詢）")
+    for label, items in (("過濾前", chunks), ("過濾後", kept)):
+        retriever = Retriever(items)
+        t0 = time.perf_counter()
+        for query in sample:
+            retriever.search(*query)
+        elapsed = time.perf_counter() - t0
+        print(f"   - {label}: {len(items):>5} 塊  {size(items) / (1 << 20):5.2f} MB"
+              f"  每筆 {elapsed / queries * 1000:6.2f} ms")
+
+
+def main():
+    from chunk_stream import ChunkFile
+    from rebuild import rebuild_outputs
+
+    chunks_path = KB_DIR / "rag_chunks.json"
+    with open(chunks_path, 'r', encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+
+    if "--bench" in sys.argv:
+        # 已過濾過時，把冷資料併回來當作過濾前
+        cold_path = KB_DIR / "cold_chunks.json"
+        if cold_path.exists():
+            with open(cold_path, 'r', encoding='utf-8') as f:
+                chunks += [{k: v for k, v in c.items() if k != "boilerplate"} for c in json.load(f)["chunks"]]
+        benchmark(chunks, filter_chunks(chunks)[0])
+        return
+
+    kept, cold = filter_chunks(chunks)
+    for chunk in cold:
+        print(f"   🗑️ {chunk['boilerplate']:<9} {chunk['id']}  {chunk['text'][:30]!r}")
+    # 之前已移到冷資料的分塊不在 rag_chunks.json 裡，保留下來（同 id 以這次的為準）
+    cold_path = KB_DIR / "cold_chunks.json"
+    if cold_path.exists():
+        new_ids = {chunk["id"] for chunk in cold}
+        with open(cold_path, 'r', encoding='utf-8') as f:
+            cold = [c for c in json.load(f)["chunks"] if c["id"] not in new_ids] + cold
+
+    # 切掉版權頁的分塊文字改變：concepts、prior、tokens、uid 與依賴分塊的產物全部重建
+    rebuild_outputs(kept, KB_DIR, ChunkFile(KB_DIR / "index.json", key="entries"))
+    cold_path = save_cold_chunks(cold, KB_DIR)
+
+    print(f"✅ 版面雜訊過濾完成")
+    print(f"   - 保留分塊: {len(kept)}")
+    print(f"   - 冷資料分塊: {len(cold)}（{dict(Counter(c['boilerplate'] for c in cold))}）")
+    print(f"📄 RAG 分塊: {chunks_path}")
+    print(f"📄 冷資料: {cold_path}")
+
+
+if __name__ == "__main__":
+    main()
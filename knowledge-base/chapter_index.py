@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+章節摘要索引：由粗到細的兩段式檢索
+每個章節條目（index.json 的 entry，分塊 id 去掉 _chunk_xxx 的前綴）彙整其下分塊的術語向量：
+術語表內每個術語記錄該章節分塊中的最高單詞分數（term_score），另記錄章節內最高的 prior；
+另記錄每個術語在全部分塊中有分數的分塊數（df，重排序的 idf 用）。
+
+查詢時先以倒排表加總各章節的分數上限（只做字典查找，不碰全文），依上限由高到低
+逐章對分塊計分；下一章的上限已低於第 limit 名時即停止，結果與全掃描相同。
+選出的分塊再以引用句索引（snippet_index.json，句子邊界與術語 → 句子）只取命中的句子，
+縮短放進 prompt 的內容
+
+用法：
+    python chapter_index.py            # 建立 chapter_index.json
+    python chapter_index.py --bench    # 與全掃描比較延遲、計分分塊數與 prompt 長度
+"""
+import sys
+import json
+import time
+import heapq
+import random
+from bisect import bisect_right
+from pathlib import Path
+
+from aho_corasick import AhoCorasick
+from hierarchy import entry_id_of
+from retrieval import Retriever, term_score
+from synonyms import CONCEPT_OF, concept_of, text_forms
+
+KB_DIR = Path(__file__).resolve().parent
+
+# 放進 prompt 的分塊文字上限（與 rag.ts formatChunksForPrompt 相同）
+PROMPT_MAX_CHARS = 800
+
+
+def chapter_vocabulary(chunks, expand=True):
+    """術語表：分塊的 keywords、concepts 與同義詞表的所有寫法（expand=False 時只有 keywords），依字典序"""
+    vocabulary = {kw for chunk in chunks for kw in chunk.get("keywords", [])}
+    if expand:
+        vocabulary.update(kw for chunk in chunks for kw in chunk.get("concepts", []))
+        vocabulary.update(CONCEPT_OF)
+    return sorted(vocabulary)
+
+
+def document_frequencies(chunks, vocabulary, expand=True):
+    """術語表每個詞有分數（term_score > 0）的分塊數，順序同 vocabulary：
+    文中出現，或 keywords 含該詞，或 concepts 含該詞在分塊類別的概念 id"""
+    matcher = AhoCorasick({term: term for term in vocabulary if term})
+    df = dict.fromkeys(vocabulary, 0)
+    # 分類 → 概念 id → 術語表中對應到它的詞
+    terms_of = {}
+    for chunk in chunks:
+        category = chunk["category"]
+        if expand and category not in terms_of:
+            terms_of[category] = {}
+            for term in vocabulary:
+                concept = concept_of(term, category)
+                if concept is not None:
+                    terms_of[category].setdefault(concept, []).append(term)
+        found = {term for _, _, term in matcher.iter_all(chunk["text"])}
+        found.update(kw for kw in chunk.get("keywords") or [] if kw in df)
+        if expand:
+            for concept in chunk.get("concepts") or []:
+                found.update(terms_of[category].get(concept, ()))
+        for term in found:
+            df[term] += 1
+    return [df[term] for term in vocabulary]
+
+
+def build_chapter_index(chunks, expand=True, previous=None):
+    """彙整每個章節的術語分數上限、最高 prior 與所屬分塊（依閱讀順序）
+
+    previous 為可沿用的舊章節（章節 id → 章節，分塊與術語表都未改變），不再計分
+    """
+    vocabulary = chapter_vocabulary(chunks, expand)
+    # 分類 → 術語表每個詞在該分類的概念 id（紫微的七殺 → 七殺星）
+    concepts = {}
+
+    previous = previous or {}
+    chapters = {}
+    for chunk in chunks:
+        chapter_id = entry_id_of(chunk["id"])
+        if chapter_id in previous:
+            chapters.setdefault(chapter_id, previous[chapter_id])
+            continue
+        chapter = chapters.get(chapter_id)
+        if chapter is None:
+            chapter = chapters[chapter_id] = {
+                "id": chapter_id,
+                "category": chunk["category"],
+                "prior": 0,
+                "chunks": [],
+                "terms": {},
+            }
+        chapter["chunks"].append(chunk["id"])
+        chapter["prior"] = max(chapter["prior"], chunk.get("prior", 1.0))
+
+        category = chunk["category"]
+        if category not in concepts:
+            concepts[category] = [concept_of(term, category) if expand else None for term in vocabulary]
+        text = chunk["text"]
+        keyword_set = frozenset(chunk.get("keywords") or [])
+        concept_set = frozenset(chunk.get("concepts") or [] if expand else [])
+        terms = chapter["terms"]
+        for term, concept in zip(vocabulary, concepts[category]):
+            score = term_score(text, keyword_set, term, concept, concept_set)
+            if score > terms.get(term, 0):
+                terms[term] = score
+
+    return {
+        "version": "1.0",
+        "vocabulary": vocabulary,
+        "df": document_frequencies(chunks, vocabulary, expand),
+        "chapters": list(chapters.values()),
+    }
+
+
+def save_chapter_index(chunks, output_dir, previous=None):
+    """建立並儲存 chapter_index.json"""
+    index = build_chapter_index(chunks, previous=previous)
+    index_path = Path(output_dir) / "chapter_index.json"
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+    return index_path, index
+
+
+class ChapterSearch:
+    """先選章節、再對章節內的分塊計分；評分與 Retriever.search 相同"""
+
+    def __init__(self, retriever, index, snippet_index=None):
+        self.retriever = retriever
+        self.vocabulary = frozenset(index["vocabulary"])
+        idx_of = {chunk["id"]: idx for idx, chunk in enumerate(retriever.chunks)}
+        self.chapters = index["chapters"]
+        self.chapter_chunks = [[idx_of[cid] for cid in chapter["chunks"] if cid in idx_of]
+                               for chapter in self.chapters]
+        # 術語 → [(章節編號, 該章最高分)]
+        self.postings = {}
+        for ci, chapter in enumerate(self.chapters):
+            for term, score in chapter["terms"].items():
+                self.postings.setdefault(term, []).append((ci, score))
+        self.sentences = snippet_index["chunks"] if snippet_index else {}
+        self.visited = 0
+
+    @classmethod
+    def load(cls, kb_dir=KB_DIR):
+        kb_dir = Path(kb_dir)
+        with open(kb_dir / "chapter_index.json", 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        snippet_path = kb_dir / "snippet_index.json"
+        snippet_index = None
+        if snippet_path.exists():
+            with open(snippet_path, 'r', encoding='utf-8') as f:
+                snippet_index = json.load(f)
+        return cls(Retriever.load(kb_dir), index, snippet_index)
+
+    def chapter_bounds(self, keywords, category=None):
+        """粗篩：各章節的分數上限（術語表內的詞查倒排表，其餘詞以 score_bound 估計），由高到低"""
+        oov_bound = self.retriever.score_bound([kw for kw in keywords if kw not in self.vocabulary])
+        totals = {}
+        for kw in keywords:
+            for ci, score in self.postings.get(kw, ()):
+                totals[ci] = totals.get(ci, 0) + score
+        if oov_bound > 0:
+            candidates = range(len(self.chapters))
+        else:
+            candidates = totals
+        bounds = [
+            ((totals.get(ci, 0) + oov_bound) * self.chapters[ci]["prior"], ci)
+            for ci in candidates
+            if not category or self.chapters[ci]["category"] == category
+        ]
+        bounds.sort(key=lambda item: (-item[0], item[1]))
+        return bounds
+
+    def search(self, keywords, category=None, limit=5):
+        """兩段式查詢，結果與 Retriever.search 相同"""
+        retriever = self.retriever
+        concepts = retriever.concepts(keywords, category)
+        heap = []
+        for bound, ci in self.chapter_bounds(keywords, category):
+            # 章節上限已低於第 limit 名，之後的章節都不可能進榜
+            if len(heap) == limit and bound < heap[0][0]:
+                break
+            for idx in self.chapter_chunks[ci]:
+                self.visited += 1
+                score = retriever.chunk_score(idx, keywords, concepts)
+                if score <= 0:
+                    continue
+                item = (score, -idx)
+                if len(heap) < limit:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+        return [retriever.chunks[-neg_idx] for _, neg_idx in sorted(heap, reverse=True)]
+
+    def focus_text(self, chunk, keywords, max_chars=PROMPT_MAX_CHARS):
+        """細篩：只保留命中關鍵字（含同義寫法）的句子（依原順序，不相鄰處以「……」相接）；
+        沒有句子索引或沒有命中時退回開頭 max_chars 字"""
+        text = chunk["text"]
+        entry = self.sentences.get(chunk["id"])
+        if not entry:
+            return text[:max_chars]
+        ends, terms = entry["ends"], entry["terms"]
+
+        hit = set()
+        for kw in {form for keyword in keywords for form in text_forms(keyword, chunk["category"])}:
+            sids = terms.get(kw)
+            if sids is None:
+                sids = set()
+                pos = text.find(kw)
+                while pos != -1:
+                    sids.add(bisect_right(ends, pos))
+                    pos = text.find(kw, pos + 1)
+            hit.update(sids)
+        if not hit:
+            return text[:max_chars]
+
+        parts, length, last = [], 0, None
+        for sid in sorted(hit):
+            start = ends[sid - 1] if sid else 0
+            sentence = text[start:ends[sid]].replace("\n", "").strip()
+            if not sentence:
+                continue
+            piece = sentence if last is None or sid == last + 1 else "……" + sentence
+            if length + len(piece) > max_chars:
+                if not parts:
+                    parts.append(piece[:max_chars])
+                break
+            parts.append(piece)
+            length += len(piece)
+            last = sid
+        return "".join(parts)
+
+    def search_passages(self, keywords, category=None, limit=5, max_chars=PROMPT_MAX_CHARS):
+        """查詢並只取命中的句子：回傳 [(分塊, 引用文字)]"""
+        return [(chunk, self.focus_text(chunk, keywords, max_chars))
+                for chunk in self.search(keywords, category, limit)]
+
+
+def benchmark(queries=200, seed=7):
+    """兩段式查詢 vs 逐塊計分的全掃描：延遲、計分分塊數、結果一致性與 prompt 長度"""
+    from retrieval import _sample_queries
+
+    search = ChapterSearch.load()
+    retriever = search.retriever
+    sample = _sample_queries(retriever.chunks, queries, random.Random(seed))
+
+    retriever.visited = 0
+    t0 = time.perf_counter()
+    full = [retriever.search(*q) for q in sample]
+    full_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    staged = [search.search(*q) for q in sample]
+    staged_time = time.perf_counter() - t0
+
+    same = all([c["id"] for c in a] == [c["id"] for c in b] for a, b in zip(full, staged))
+
+    whole = focused = 0
+    for (keywords, _, _), chunks in zip(sample, staged):
+        for chunk in chunks:
+            whole += len(chunk["text"][:PROMPT_MAX_CHARS])
+            focused += len(search.focus_text(chunk, keywords))
+
+    print(f"📊 {queries} 筆查詢（{len(retriever.chunks)} 個分塊、{len(search.chapters)} 個章節）")
+    print(f"   - 全掃描:   每筆 {full_time / queries * 1000:.2f} ms，計分 {retriever.visited / queries:.0f} 塊")
+    print(f"   - 兩段式:   每筆 {staged_time / queries * 1000:.2f} ms，計分 {search.visited / queries:.0f} 塊")
+    print(f"   - 結果{'一致' if same else '不一致'}")
+    print(f"   - prompt 內容: 整塊 {whole / queries:.0f} 字 → 命中句 {focused / queries:.0f} 字（每筆平均）")
+
+
+def main():
+    if "--bench" in sys.argv:
+        benchmark()
+        return
+
+    with open(KB_DIR / "rag_chunks.json", 'r', encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+    t0 = time.perf_counter()
+    index_path, index = save_chapter_index(chunks, KB_DIR)
+    terms = sum(len(chapter["terms"]) for chapter in index["chapters"])
+    print(f"✅ 章節摘要索引完成（{time.perf_counter() - t0:.1f} 秒）")
+    print(f"   - 章節: {len(index['chapters'])}，術語表: {len(index['vocabulary'])}")
+    print(f"   - 章節 × 術語項: {terms}")
+    print(f"📄 章節索引: {index_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+內容定址的分塊 id 與增量變更紀錄
+分塊的 id（子平真詮_001_chunk_003）依位置編號，書中插入一節就會讓後面全部重新編號。
+這裡以「書名 + 文字」的雜湊作為穩定的 uid（原 id 保留為可讀別名），
+每次建置與上一版的清單（chunk_manifest.json）比對，輸出新增／刪除／僅中繼資料變更的分塊
+（chunk_changes.json），下游的嵌入向量只需為新增的分塊重算（範例見 delta_consumer.py）
+
+用法：
+    python chunk_ids.py            # 為 rag_chunks.json 補上 uid 並輸出變更紀錄
+"""
+import json
+import hashlib
+from pathlib import Path
+
+KB_DIR = Path(__file__).resolve().parent
+
+# 不影響嵌入向量、變更時只需更新中繼資料的欄位
+META_FIELDS = ("id", "chapter", "title", "category", "keywords", "concepts", "ocr_quality", "prior", "tokens")
+
+
+def content_uid(chunk):
+    """書名 + 文字的雜湊（16 個十六進位字元）"""
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(chunk["source"].encode('utf-8'))
+    digest.update(b"\x00")
+    digest.update(chunk["text"].encode('utf-8'))
+    return digest.hexdigest()
+
+
+def meta_hash(chunk):
+    meta = {field: chunk.get(field) for field in META_FIELDS}
+    return hashlib.blake2b(json.dumps(meta, ensure_ascii=False, sort_keys=True).encode('utf-8'),
+                           digest_size=8).hexdigest()
+
+
+def assign_uids(chunks):
+    """為每個分塊加上 uid 欄位；同一本書內文字完全相同的分塊依出現順序加上 -2、-3……"""
+    seen = set()
+    for chunk in chunks:
+        uid = base = content_uid(chunk)
+        n = 1
+        while uid in seen:
+            n += 1
+            uid = f"{base}-{n}"
+        seen.add(uid)
+        chunk["uid"] = uid
+    return chunks
+
+
+def load_manifest(output_dir):
+    manifest_path = Path(output_dir) / "chunk_manifest.json"
+    if not manifest_path.exists():
+        return {"generation": 0, "chunks": {}}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def current_manifest(chunks):
+    """uid → [分塊 id, 中繼資料雜湊]（chunk_manifest.json 的格式）"""
+    return {chunk["uid"]: [chunk["id"], meta_hash(chunk)] for chunk in chunks}
+
+
+def diff_chunks(previous, current):
+    """比對上一版與這一版的清單（current_manifest 的格式）：回傳 (新增的 uid, 刪除的 uid, 中繼資料變更的 uid)"""
+    added = [uid for uid in current if uid not in previous]
+    removed = sorted(uid for uid in previous if uid not in current)
+    modified = [
+        uid for uid, (_, digest) in current.items()
+        if uid in previous and previous[uid][1] != digest
+    ]
+    return added, removed, modified
+
+
+def save_changes(chunks, output_dir):
+    """比對上一版清單，寫入 chunk_changes.json 與新的 chunk_manifest.json
+
+    chunks 須已有 uid；變更紀錄只列 uid，內容由 rag_chunks.json 取得。
+    回傳 (變更紀錄路徑, 變更紀錄)
+    """
+    manifest = load_manifest(output_dir)
+    current = current_manifest(chunks)
+    added, removed, modified = diff_chunks(manifest["chunks"], current)
+    generation = manifest["generation"] + 1
+
+    changes = {
+        "version": "1.0",
+        "base_generation": manifest["generation"],
+        "generation": generation,
+        "added": added,
+        "removed": removed,
+        "modified": modified,
+    }
+    changes_path = Path(output_dir) / "chunk_changes.json"
+    with open(changes_path, 'w', encoding='utf-8') as f:
+        json.dump(changes, f, ensure_ascii=False, indent=2)
+
+    with open(Path(output_dir) / "chunk_manifest.json", 'w', encoding='utf-8') as f:
+        json.dump({
+            "version": "1.0",
+            "generation": generation,
+            "chunks": current,
+        }, f, ensure_ascii=False, separators=(',', ':'))
+    return changes_path, changes
+
+
+def main():
+    chunks_path = KB_DIR / "rag_chunks.json"
+    with open(chunks_path, 'r', encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+
+    assign_uids(chunks)
+    with open(chunks_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "version": "1.0",
+            "total_chunks": len(chunks),
+            "chunks": chunks
+        }, f, ensure_ascii=False, indent=2)
+    changes_path, changes = save_changes(chunks, KB_DIR)
+
+    print(f"✅ 分塊 uid 與變更紀錄完成（第 {changes['generation']} 版）")
+    print(f"   - 新增: {len(changes['added'])}")
+    print(f"   - 刪除: {len(changes['removed'])}")
+    print(f"   - 中繼資料變更: {len(changes['modified'])}")
+    print(f"📄 變更紀錄: {changes_path}")
+
+
+if __name__ == "__main__":
+    main()
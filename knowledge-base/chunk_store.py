@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+精簡記憶體的分塊儲存（Python 端使用）
+以欄式結構取代每塊一個 dict：字串表去重並 intern，分類、書名、章節、標題存成整數代碼，
+關鍵字存成扁平的 array('H') 加上位移表，每個分塊以 __slots__ 的輕量檢視物件存取
+
+用法：
+    python chunk_store.py              # 比較目前語料 dict 載入與 ChunkStore 的記憶體
+    python chunk_store.py --scale 100  # 以 100 倍語料比較
+"""
+import sys
+import json
+import tracemalloc
+from array import array
+from pathlib import Path
+
+KB_DIR = Path(__file__).resolve().parent
+# ocr_quality、prior 存成 float32；建置時最多取到小數第 4 位，讀出時四捨五入還原原值
+FLOAT_DIGITS = 4
+
+
+class StringTable:
+    """去重字串表：字串 ↔ 整數代碼"""
+
+    __slots__ = ("strings", "codes")
+
+    def __init__(self):
+        self.strings = []
+        self.codes = {}
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.strings)
+            self.strings.append(sys.intern(value))
+        return code
+
+    def __getitem__(self, code):
+        return self.strings[code]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class ChunkView:
+    """單一分塊的唯讀檢視，欄位皆由 ChunkStore 的欄位即時取出"""
+
+    __slots__ = ("_store", "_idx")
+
+    def __init__(self, store, idx):
+        self._store = store
+        self._idx = idx
+
+    @property
+    def id(self):
+        return self._store.ids[self._idx]
+
+    @property
+    def uid(self):
+        return self._store.uids[self._idx]
+
+    @property
+    def text(self):
+        return self._store.texts[self._idx]
+
+    @property
+    def source(self):
+        return self._store.sources[self._store.source_codes[self._idx]]
+
+    @property
+    def category(self):
+        return self._store.categories[self._store.category_codes[self._idx]]
+
+    @property
+    def chapter(self):
+        return self._store.chapters[self._store.chapter_codes[self._idx]]
+
+    @property
+    def title(self):
+        return self._store.titles[self._store.title_codes[self._idx]]
+
+    @property
+    def keywords(self):
+        return self._store.keywords_of(self._idx)
+
+    @property
+    def concepts(self):
+        return self._store.concepts_of(self._idx)
+
+    @property
+    def ocr_quality(self):
+        return round(self._store.ocr_quality[self._idx], FLOAT_DIGITS)
+
+    @property
+    def prior(self):
+        return round(self._store.priors[self._idx], FLOAT_DIGITS)
+
+    @property
+    def tokens(self):
+        return self._store.tokens[self._idx]
+
+    def to_dict(self):
+        """還原成 rag_chunks.json 的 dict 格式"""
+        return {
+            "id": self.id,
+            "text": self.text,
+            "source": self.source,
+            "chapter": self.chapter,
+            "title": self.title,
+            "category": self.category,
+            "keywords": self.keywords,
+            "concepts": self.concepts,
+            "ocr_quality": self.ocr_quality,
+            "prior": self.prior,
+            "tokens": self.tokens,
+            "uid": self.uid,
+        }
+
+    def __repr__(self):
+        return f"ChunkView({self.id!r})"
+
+
+class ChunkStore:
+    """欄式分塊儲存"""
+
+    def __init__(self):
+        self.ids = []
+        self.uids = []
+        self.texts = []
+        self.sources = StringTable()
+        self.categories = StringTable()
+        self.chapters = StringTable()
+        self.titles = StringTable()
+        self.vocabulary = StringTable()
+        self.source_codes = array('H')
+        self.category_codes = array('B')
+        self.chapter_codes = array('I')
+        self.title_codes = array('I')
+        self.keyword_ids = array('H')
+        self.keyword_offsets = array('I', [0])
+        self.concept_ids = array('H')       # 概念 id 與關鍵字共用字串表
+        self.concept_offsets = array('I', [0])
+        self.ocr_quality = array('f')
+        self.priors = array('f')
+        self.tokens = array('I')
+        self.id_to_idx = {}
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        """由 dict 分塊（可為產生器）建立，逐塊轉存後即可釋放原 dict"""
+        store = cls()
+        for chunk in chunks:
+            store.append(chunk)
+        return store
+
+    @classmethod
+    def load(cls, path=KB_DIR / "rag_chunks.json"):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_chunks(json.load(f)["chunks"])
+
+    def append(self, chunk):
+        """加入一個 dict 格式的分塊"""
+        idx = len(self.ids)
+        self.ids.append(chunk["id"])
+        self.uids.append(chunk.get("uid", ""))
+        self.texts.append(chunk["text"])
+        self.source_codes.append(self.sources.code(chunk["source"]))
+        self.category_codes.append(self.categories.code(chunk["category"]))
+        self.chapter_codes.append(self.chapters.code(chunk.get("chapter", "")))
+        self.title_codes.append(self.titles.code(chunk.get("title", "")))
+        self.keyword_ids.extend(self.vocabulary.code(kw) for kw in chunk.get("keywords", []))
+        self.keyword_offsets.append(len(self.keyword_ids))
+        self.concept_ids.extend(self.vocabulary.code(c) for c in chunk.get("concepts", []))
+        self.concept_offsets.append(len(self.concept_ids))
+        self.ocr_quality.append(chunk.get("ocr_quality", 1.0))
+        self.priors.append(chunk.get("prior", 1.0))
+        self.tokens.append(chunk.get("tokens", 0))
+        self.id_to_idx[chunk["id"]] = idx
+
+    def keywords_of(self, idx):
+        start, end = self.keyword_offsets[idx], self.keyword_offsets[idx + 1]
+        return [self.vocabulary[k] for k in self.keyword_ids[start:end]]
+
+    def concepts_of(self, idx):
+        start, end = self.concept_offsets[idx], self.concept_offsets[idx + 1]
+        return [self.vocabulary[c] for c in self.concept_ids[start:end]]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, idx):
+        return ChunkView(self, idx)
+
+    def __iter__(self):
+        return (ChunkView(self, idx) for idx in range(len(self.ids)))
+
+    def get(self, chunk_id):
+        """依分塊 id 取得檢視物件"""
+        idx = self.id_to_idx.get(chunk_id)
+        return None if idx is None else ChunkView(self, idx)
+
+
+def _replicas(raw, scale):
+    """產生 scale 份語料的 dict 分塊（每份重新解析，模擬真正不同的字串）"""
+    for rep in range(scale):
+        for chunk in json.loads(raw)["chunks"]:
+            if rep:
+                chunk["id"] = f"{chunk['id']}_r{rep}"
+            yield chunk
+
+
+def _measure(build):
+    """回傳 (結果, tracemalloc 量到的常駐位元組數)"""
+    tracemalloc.start()
+    result = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current
+
+
+def benchmark(scale=1):
+    """比較 json.load 的 dict 分塊與 ChunkStore 的記憶體用量"""
+    raw = (KB_DIR / "rag_chunks.json").read_text(encoding='utf-8')
+
+    dicts, dict_bytes = _measure(lambda: list(_replicas(raw, scale)))
+    n = len(dicts)
+    text_bytes = sum(sys.getsizeof(c["text"]) for c in dicts)
+    del dicts
+
+    store, store_bytes = _measure(lambda: ChunkStore.from_chunks(_replicas(raw, scale)))
+
+    print(f"📊 {scale}× 語料，{n:,} 個分塊（其中文字本身約 {text_bytes / n:,.0f} bytes/塊）")
+    print(f"   - dict 載入:  {dict_bytes / 2**20:8.1f} MiB  {dict_bytes / n:8,.0f} bytes/塊")
+    print(f"   - ChunkStore: {store_bytes / 2**20:8.1f} MiB  {store_bytes / n:8,.0f} bytes/塊")
+    print(f"   - 文字以外的額外開銷: {(dict_bytes - text_bytes) / n:,.0f} → "
+          f"{(store_bytes - text_bytes) / n:,.0f} bytes/塊")
+    print(f"   - 比例: {store_bytes / dict_bytes:.0%}")
+    return store
+
+
+def main():
+    scale = 1
+    if "--scale" in sys.argv:
+        scale = int(sys.argv[sys.argv.index("--scale") + 1])
+    benchmark(scale)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+串流讀取 rag_chunks.json / index.json
+不必整份 json.load：以位元組掃描找出陣列中每個物件的位置，逐一解碼並支援條件下推
+（分類、書名、id 前綴）；另存一份位移索引（*.offsets.json）可直接 seek 到符合條件的分塊。
+追加資料時只修補檔頭並接在陣列尾端，不必整份解析再重寫
+
+用法：
+    python chunk_stream.py                       # 重建 rag_chunks.offsets.json
+    python chunk_stream.py --category 紫微        # 串流列出符合條件的分塊 id
+"""
+import os
+import re
+import sys
+import json
+from pathlib import Path
+
+KB_DIR = Path(__file__).resolve().parent
+
+BLOCK_SIZE = 1 << 20
+# 1.2：指紋改為檔案大小與修改時間（st_mtime_ns）
+OFFSETS_VERSION = "1.2"
+
+# JSON 結構字元；UTF-8 多位元組字元的每個位元組都 >= 0x80，不會被誤判
+_TOKEN_RE = re.compile(rb'[{}\[\]"]')
+# 完整的 JSON 字串（含跳脫字元），整段略過
+_STRING_RE = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+
+
+def iter_object_spans(f, key, block_size=BLOCK_SIZE):
+    """掃描最上層物件中 key 對應的陣列，產生每個元素物件的 (起點, 終點, 位元組)"""
+    buf = b""
+    base = 0          # buf[0] 在檔案中的位置
+    pos = 0           # 下一個要掃描的位置（相對 buf）
+    depth = 0
+    armed = False     # 剛讀到目標 key
+    array_depth = None
+    obj_start = None
+    key_token = b'"' + key.encode('utf-8') + b'"'
+
+    while True:
+        block = f.read(block_size)
+        if not block:
+            return
+        buf += block
+
+        while True:
+            m = _TOKEN_RE.search(buf, pos)
+            if not m:
+                pos = len(buf)
+                break
+            ch = m.group()
+            i = m.start()
+            if ch == b'"':
+                s = _STRING_RE.match(buf, i)
+                if not s:
+                    pos = i
+                    break  # 字串跨越區塊尾端，等下一個區塊
+                if depth == 1 and array_depth is None and s.group() == key_token:
+                    armed = True
+                pos = s.end()
+                continue
+            if ch in b"{[":
+                if depth == array_depth and ch == b"{":
+                    obj_start = i
+                if armed and ch == b"[":
+                    array_depth = depth + 1
+                    armed = False
+                depth += 1
+            else:
+                depth -= 1
+                if depth == array_depth and ch == b"}" and obj_start is not None:
+                    yield base + obj_start, base + i + 1, buf[obj_start:i + 1]
+                    obj_start = None
+                elif array_depth is not None and depth < array_depth:
+                    return
+            pos = i + 1
+
+        # 丟掉已處理、且不屬於進行中物件的位元組
+        keep = pos if obj_start is None else min(obj_start, pos)
+        buf = buf[keep:]
+        base += keep
+        pos -= keep
+        if obj_start is not None:
+            obj_start -= keep
+
+
+def _matches(chunk, category, source, id_prefix):
+    return (
+        (category is None or chunk.get("category") == category)
+        and (source is None or chunk.get("source") == source)
+        and (id_prefix is None or chunk.get("id", "").startswith(id_prefix))
+    )
+
+
+def _fingerprint(path):
+    """以檔案大小與修改時間判斷位移索引是否過期（中段改寫而大小不變時修改時間仍會改變），只需 stat"""
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def offsets_path(path):
+    path = Path(path)
+    return path.with_name(path.stem + ".offsets.json")
+
+
+def build_offsets(path, key="chunks"):
+    """掃描一次檔案，建立並儲存位移索引"""
+    rows = []
+    with open(path, 'rb') as f:
+        for start, end, raw in iter_object_spans(f, key):
+            obj = json.loads(raw)
+            rows.append([obj.get("id"), obj.get("category"), obj.get("source"), start, end - start])
+    return save_offsets(path, key, rows)
+
+
+def save_offsets(path, key, rows):
+    index = {"version": OFFSETS_VERSION, "key": key, **_fingerprint(path), "entries": rows}
+    with open(offsets_path(path), 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+    return index
+
+
+def load_offsets(path, key="chunks", rebuild=True):
+    """讀取位移索引；不存在或過期時重建（rebuild=False 則回傳 None）"""
+    sidecar = offsets_path(path)
+    if sidecar.exists():
+        with open(sidecar, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if (index.get("version") == OFFSETS_VERSION and index.get("key") == key
+                and {k: index.get(k) for k in ("size", "mtime_ns")} == _fingerprint(path)):
+            return index
+    return build_offsets(path, key) if rebuild else None
+
+
+def iter_chunks(path=KB_DIR / "rag_chunks.json", category=None, source=None, id_prefix=None,
+                key="chunks", use_offsets=True):
+    """逐一產生符合條件的分塊 dict
+
+    有最新的位移索引時只 seek 讀取符合條件的分塊；否則串流掃描，
+    並先以原始位元組過濾分類、書名再解碼
+    """
+    index = load_offsets(path, key, rebuild=False) if use_offsets else None
+    with open(path, 'rb') as f:
+        if index:
+            for chunk_id, cat, src, offset, length in index["entries"]:
+                if not _matches({"id": chunk_id or "", "category": cat, "source": src},
+                                category, source, id_prefix):
+                    continue
+                f.seek(offset)
+                yield json.loads(f.read(length))
+            return
+
+        needles = [json.dumps(v, ensure_ascii=False).encode('utf-8')
+                   for v in (category, source) if v is not None]
+        for _, _, raw in iter_object_spans(f, key):
+            if any(n not in raw for n in needles):
+                continue
+            chunk = json.loads(raw)
+            if _matches(chunk, category, source, id_prefix):
+                yield chunk
+
+
+class ChunkFile:
+    """可重複迭代的分塊來源：每次迭代都從檔案重新串流（走位移索引），記憶體中同時只有一個分塊
+
+    給需要掃描多次的索引建置使用，不必先把整份 rag_chunks.json 載入成列表
+    """
+
+    def __init__(self, path=KB_DIR / "rag_chunks.json", key="chunks"):
+        self.path = Path(path)
+        self.key = key
+
+    def __iter__(self):
+        return iter_chunks(self.path, key=self.key)
+
+    def __len__(self):
+        return len(load_offsets(self.path, self.key)["entries"])
+
+
+def read_header(path, key):
+    """只解析 key 陣列之前的檔頭（版本、統計等），回傳 (檔頭 dict, 陣列 '[' 的位置)"""
+    with open(path, 'rb') as f:
+        spans = iter_object_spans(f, key)
+        first = next(spans, None)
+    with open(path, 'rb') as f:
+        head = f.read(first[0] if first else os.path.getsize(path))
+    token = b'"' + key.encode('utf-8') + b'"'
+    key_pos = head.rindex(token)
+    bracket = head.index(b"[", key_pos)
+    header = json.loads(head[:key_pos].rstrip().rstrip(b",") + b"}")
+    return header, bracket
+
+
+def _format_items(items):
+    """格式與 json.dump(indent=2) 中第二層陣列元素相同"""
+    return ",\n".join(
+        "\n".join("    " + line for line in json.dumps(item, ensure_ascii=False, indent=2).split("\n"))
+        for item in items
+    ).encode('utf-8')
+
+
+def append_items(path, key, items, update_header=None):
+    """把 items 追加到 key 陣列尾端（key 須為最後一個欄位），並修補檔頭
+
+    檔頭長度不變時原地覆寫；長度改變時才以串流複製方式重寫（仍不解析內容）。
+    回傳新元素的 (位移, 長度) 列表
+    """
+    return _append(path, key, items, update_header)[0]
+
+
+def _append(path, key, items, update_header):
+    """append_items 的實作；另回傳檔頭長度的變化量（原有元素的位移都要加上它）"""
+    if not items:
+        return [], 0
+    header, bracket = read_header(path, key)
+    if update_header:
+        update_header(header)
+
+    new_head = json.dumps({**header, key: []}, ensure_ascii=False, indent=2).encode('utf-8')
+    new_head = new_head[:new_head.rindex(b"[")]
+    with open(path, 'rb') as f:
+        old_head = f.read(bracket)
+
+    if len(new_head) != len(old_head):
+        tmp = Path(str(path) + ".tmp")
+        with open(path, 'rb') as src, open(tmp, 'wb') as dst:
+            dst.write(new_head)
+            src.seek(bracket)
+            while True:
+                block = src.read(BLOCK_SIZE)
+                if not block:
+                    break
+                dst.write(block)
+        os.replace(tmp, path)
+    elif new_head != old_head:
+        with open(path, 'r+b') as f:
+            f.write(new_head)
+
+    with open(path, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - 64))
+        tail = f.read()
+        # 從陣列的 ']' 往前略過空白，退到最後一個元素的 '}'（或空陣列的 '['）
+        cut = size - len(tail) + tail.rindex(b"]")
+        f.seek(cut - 1)
+        while f.read(1) in b" \n\r\t":
+            cut -= 1
+            f.seek(cut - 1)
+        f.seek(cut - 1)
+        empty = f.read(1) == b"["
+        f.seek(cut)
+        f.truncate()
+        prefix = b"\n" if empty else b",\n"
+        body = _format_items(items)
+        f.write(prefix + body + b"\n  ]\n}")
+
+    # 計算每個新元素的位移（每個元素以 ",\n" 分隔）
+    spans = []
+    offset = cut + len(prefix)
+    for item in items:
+        length = len(_format_items([item])) - 4  # 去掉第一行的縮排
+        spans.append((offset + 4, length))
+        offset += length + 4 + len(b",\n")
+    return spans, len(new_head) - len(old_head)
+
+
+def append_chunks(path, chunks, key="chunks", update_header=None):
+    """追加分塊並同步更新位移索引（檔頭長度改變時原有分塊的位移一併平移）"""
+    index = load_offsets(path, key)
+    spans, shift = _append(path, key, chunks, update_header)
+    rows = [[chunk_id, cat, src, offset + shift, length]
+            for chunk_id, cat, src, offset, length in index["entries"]] + [
+        [c.get("id"), c.get("category"), c.get("source"), offset, length]
+        for c, (offset, length) in zip(chunks, spans)
+    ]
+    save_offsets(path, key, rows)
+    return spans
+
+
+def main():
+    path = KB_DIR / "rag_chunks.json"
+    args = sys.argv[1:]
+    filters = {}
+    for flag, name in (("--category", "category"), ("--source", "source"), ("--id-prefix", "id_prefix")):
+        if flag in args:
+            filters[name] = args[args.index(flag) + 1]
+
+    if filters:
+        count = 0
+        for chunk in iter_chunks(path, **filters):
+            print(chunk["id"])
+            count += 1
+        print(f"✅ 符合條件: {count} 個分塊")
+        return
+
+    index = build_offsets(path)
+    print(f"✅ 位移索引完成: {len(index['entries'])} 個分塊")
+    print(f"📄 索引檔案: {offsets_path(path)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+以 token 預算組 prompt 的古書參考段落
+原本取前 limit 個分塊各放最多 800 字，prompt 長短隨分塊長度大幅變動，
+同一段口訣在不同書中重複出現時也會重複放進 prompt。
+
+這裡把候選分塊切成段落（連續命中關鍵字的句子，每段最多 PASSAGE_MAX_TOKENS），
+以貪婪背包選段：每一步選「價值 ÷ token 數」最高、放得進剩餘預算的段落，
+價值 = 分塊排名權重 ×（新涵蓋的關鍵字數 + 已涵蓋關鍵字數 × 0.25）；
+第一次選到某分塊的段落時，出處標題的 token 也算進成本。
+與已選文字的字元二元組重疊達一半以上的段落（跨書引文、重複的口訣）直接捨棄。
+句子的 token 數取自引用句索引（snippet_index.json），不必在請求時重算
+
+用法：
+    python context_pack.py --bench    # 與固定取 3 塊比較 prompt token 數的分布、關鍵字涵蓋與重複
+"""
+import re
+import sys
+import json
+import time
+import random
+import statistics
+from pathlib import Path
+
+from snippets import sentence_ends
+from synonyms import text_forms
+from tokens import count_tokens
+
+KB_DIR = Path(__file__).resolve().parent
+
+PROMPT_HEADER = "【古書參考】\n"
+PASSAGE_MAX_TOKENS = 160
+# 已涵蓋的關鍵字再次出現時的價值
+REPEAT_VALUE = 0.25
+# 沒有命中任何關鍵字時以開頭句子代替的段落價值
+LEAD_VALUE = 0.5
+# 與已選文字的二元組重疊比例達此值即視為重複
+REDUNDANT_OVERLAP = 0.5
+SEPARATOR = "……"
+NON_TEXT_RE = re.compile(r"[\W_]+")
+
+
+def _bigrams(text):
+    text = NON_TEXT_RE.sub("", text)
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def source_line(chunk):
+    return f"📚 《{chunk['source']}》{chunk['chapter']}〈{chunk['title']}〉"
+
+
+class ContextPacker:
+    """以句子 token 數把候選分塊的段落裝進 token 預算"""
+
+    def __init__(self, snippet_index=None):
+        self.entries = snippet_index["chunks"] if snippet_index else {}
+
+    @classmethod
+    def load(cls, kb_dir=KB_DIR):
+        with open(Path(kb_dir) / "snippet_index.json", 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def _sentences(self, chunk):
+        """(句子結束位置, 每句 token 數)；索引中沒有的分塊、或索引與分塊文字／tokens 對不上（舊版索引）時當場計算"""
+        entry = self.entries.get(chunk["id"])
+        text = chunk["text"]
+        if (entry and "tokens" in entry and entry["ends"] and entry["ends"][-1] == len(text)
+                and chunk.get("tokens", sum(entry["tokens"])) == sum(entry["tokens"])):
+            return entry["ends"], entry["tokens"]
+        ends = sentence_ends(text)
+        return ends, [count_tokens(text[start:end]) for start, end in zip([0] + ends[:-1], ends)]
+
+    def passages(self, chunk, keywords):
+        """分塊中的候選段落：連續命中關鍵字的句子（沒有命中時取開頭幾句）"""
+        text = chunk["text"]
+        ends, tokens = self._sentences(chunk)
+        forms = {keyword: text_forms(keyword, chunk["category"]) for keyword in keywords}
+        sentence_terms = []
+        for sid, end in enumerate(ends):
+            sentence = text[ends[sid - 1] if sid else 0:end]
+            sentence_terms.append({kw for kw, kw_forms in forms.items() if any(f in sentence for f in kw_forms)})
+        hit = [sid for sid, terms in enumerate(sentence_terms) if terms]
+        lead = not hit
+        if lead:
+            hit = list(range(len(ends)))
+
+        passages, run = [], []
+
+        def flush():
+            if run:
+                body = "".join(text[ends[sid - 1] if sid else 0:ends[sid]].replace("\n", "").strip()
+                               for sid in run)
+                if body:
+                    passages.append({
+                        "chunk": chunk,
+                        "first": run[0],
+                        "last": run[-1],
+                        "text": body,
+                        "tokens": sum(tokens[sid] for sid in run),
+                        "terms": set().union(*(sentence_terms[sid] for sid in run)),
+                        "lead": lead,
+                    })
+                run.clear()
+
+        for sid in hit:
+            if run and (sid != run[-1] + 1 or sum(tokens[s] for s in run) + tokens[sid] > PASSAGE_MAX_TOKENS):
+                flush()
+                if lead:
+                    break
+            if tokens[sid] > PASSAGE_MAX_TOKENS:
+                # 超長的句子：截斷到上限
+                start = ends[sid - 1] if sid else 0
+                sentence = text[start:ends[sid]].replace("\n", "").strip()
+                cut = sentence
+                while cut and count_tokens(cut) > PASSAGE_MAX_TOKENS:
+                    cut = cut[:len(cut) * PASSAGE_MAX_TOKENS // count_tokens(cut)]
+                passages.append({"chunk": chunk, "first": sid, "last": sid, "text": cut,
+                                 "tokens": count_tokens(cut), "terms": sentence_terms[sid], "lead": lead})
+                if lead:
+                    break
+                continue
+            run.append(sid)
+        flush()
+        return passages[:1] if lead else passages
+
+    def pack(self, chunks, keywords, budget):
+        """從依排名排列的 chunks 中選段落裝進 budget 個 token；回傳 (prompt 文字, 選到的段落)"""
+        candidates = []
+        for rank, chunk in enumerate(chunks):
+            for passage in self.passages(chunk, keywords):
+                passage["rank"] = rank
+                passage["bigrams"] = _bigrams(passage["text"])
+                candidates.append(passage)
+        header_tokens = {id(chunk): count_tokens(source_line(chunk)) for chunk in chunks}
+        separator_tokens = count_tokens(SEPARATOR)
+
+        remaining = budget - count_tokens(PROMPT_HEADER)
+        covered, seen, used = set(), set(), set()
+        selected = []
+        while candidates:
+            best, best_ratio = None, 0.0
+            for passage in candidates:
+                cost = passage["tokens"] + (separator_tokens if id(passage["chunk"]) in used
+                                            else header_tokens[id(passage["chunk"])])
+                if cost > remaining:
+                    continue
+                if passage["lead"]:
+                    value = LEAD_VALUE
+                else:
+                    new = len(passage["terms"] - covered)
+                    value = new + REPEAT_VALUE * (len(passage["terms"]) - new)
+                ratio = value / (1 + passage["rank"]) / max(cost, 1)
+                if ratio > best_ratio:
+                    best, best_ratio, best_cost = passage, ratio, cost
+            if best is None:
+                break
+            candidates.remove(best)
+            selected.append(best)
+            remaining -= best_cost
+            used.add(id(best["chunk"]))
+            covered |= best["terms"]
+            seen |= best["bigrams"]
+            # 與已選文字大幅重疊的段落不再考慮
+            candidates = [p for p in candidates
+                          if not p["bigrams"] or len(p["bigrams"] & seen) / len(p["bigrams"]) < REDUNDANT_OVERLAP]
+        return self.format(selected), selected
+
+    @staticmethod
+    def format(selected):
+        """依分塊排名、段落位置輸出；同一分塊不相鄰的段落以「……」相接"""
+        if not selected:
+            return ""
+        lines = [PROMPT_HEADER]
+        by_chunk = {}
+        for passage in sorted(selected, key=lambda p: (p["rank"], p["first"])):
+            by_chunk.setdefault(passage["rank"], []).append(passage)
+        for group in by_chunk.values():
+            lines.append(source_line(group[0]["chunk"]))
+            parts, last = [], None
+            for passage in group:
+                parts.append(passage["text"] if last is None or passage["first"] == last + 1
+                             else SEPARATOR + passage["text"])
+                last = passage["last"]
+            lines.append("".join(parts))
+            lines.append("")
+        return "\n".join(lines)
+
+
+def _fixed_prompt(search, chunks, keywords):
+    """對照組：前 3 塊各取命中句（最多 800 字），與 rag.ts formatChunksForPrompt 相同"""
+    lines = [PROMPT_HEADER]
+    for chunk in chunks:
+        lines.append(source_line(chunk))
+        lines.append(search.focus_text(chunk, keywords))
+        lines.append("")
+    return "\n".join(lines)
+
+
+def benchmark(queries=200, limit=3, budget=600, seed=7):
+    """固定取 limit 塊 vs 以 token 預算選段：prompt token 數分布、關鍵字涵蓋、重複段落比例與耗時"""
+    from chapter_index import ChapterSearch
+    from retrieval import _sample_queries
+
+    search = ChapterSearch.load()
+    packer = ContextPacker.load()
+    sample = _sample_queries(search.retriever.chunks, queries, random.Random(seed))
+
+    def redundancy(texts):
+        """與前面段落的二元組重疊達 REDUNDANT_OVERLAP 的段落比例"""
+        seen, duplicates, total = set(), 0, 0
+        for text in texts:
+            grams = _bigrams(text)
+            if not grams:
+                continue
+            total += 1
+            duplicates += len(grams & seen) / len(grams) >= REDUNDANT_OVERLAP
+            seen |= grams
+        return duplicates / max(total, 1)
+
+    rows = {"fixed": [], "packed": []}
+    pack_time = 0.0
+    for keywords, category, _ in sample:
+        fixed_chunks = search.search(keywords, category, limit)
+        fixed = _fixed_prompt(search, fixed_chunks, keywords)
+        rows["fixed"].append((count_tokens(fixed), sum(1 for kw in keywords if kw in fixed) / len(keywords),
+                              redundancy(search.focus_text(c, keywords) for c in fixed_chunks)))
+
+        candidates = search.search(keywords, category, limit * 3)
+        t0 = time.perf_counter()
+        packed, selected = packer.pack(candidates, keywords, budget)
+        pack_time += time.perf_counter() - t0
+        rows["packed"].append((count_tokens(packed), sum(1 for kw in keywords if kw in packed) / len(keywords),
+                               redundancy(p["text"] for p in selected)))
+
+    print(f"📊 {queries} 筆查詢（token 預算 {budget}，候選 {limit * 3} 塊）")
+    for label, name in (("fixed", f"固定 {limit} 塊"), ("packed", "預算選段")):
+        tokens = sorted(r[0] for r in rows[label])
+        print(f"   - {name:<8} tokens 平均 {statistics.mean(tokens):6.0f}  標準差 {statistics.pstdev(tokens):5.0f}"
+              f"  p95 {tokens[int(len(tokens) * 0.95)]:5d}  最大 {tokens[-1]:5d}"
+              f"  關鍵字涵蓋 {statistics.mean(r[1] for r in rows[label]):.1%}"
+              f"  重複段落 {statistics.mean(r[2] for r in rows[label]):.1%}")
+    print(f"   - 選段耗時: 每筆 {pack_time / queries * 1000:.2f} ms")
+
+
+def main():
+    if "--bench" in sys.argv:
+        benchmark()
+        return
+    print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+增量變更的下游範例：把 chunk_changes.json 套用到本機 SQLite 向量庫
+以 uid 為主鍵：刪除的分塊刪除、新增的分塊計算嵌入向量後寫入、
+僅中繼資料變更的分塊只更新欄位（不重算向量）。
+版本不連續（漏套某一版）時，改以 rag_chunks.json 全量比對同步，仍只為缺少的 uid 計算向量
+
+嵌入模型以雜湊向量代替（embed），實際使用時換成真正的 embedding API
+
+用法：
+    python delta_consumer.py                  # 套用到 vectors.db
+    python delta_consumer.py --db 路徑.db
+"""
+import sys
+import json
+import struct
+import sqlite3
+import hashlib
+from pathlib import Path
+
+from chunk_stream import iter_chunks
+
+KB_DIR = Path(__file__).resolve().parent
+
+EMBED_DIM = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    uid TEXT PRIMARY KEY,
+    alias TEXT NOT NULL,
+    source TEXT NOT NULL,
+    chapter TEXT,
+    title TEXT,
+    category TEXT,
+    keywords TEXT,
+    ocr_quality REAL,
+    embedding BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def embed(text):
+    """嵌入向量的替身：以雜湊產生固定維度向量"""
+    digest = hashlib.shake_256(text.encode('utf-8')).digest(EMBED_DIM)
+    return struct.pack(f"{EMBED_DIM}f", *(b / 255.0 for b in digest))
+
+
+def _row(chunk):
+    return (
+        chunk["id"], chunk["source"], chunk.get("chapter"), chunk.get("title"),
+        chunk.get("category"), json.dumps(chunk.get("keywords", []), ensure_ascii=False),
+        chunk.get("ocr_quality"), chunk["uid"],
+    )
+
+
+class VectorStore:
+    """以 SQLite 模擬的向量庫"""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(str(path))
+        self.conn.executescript(SCHEMA)
+        self.embedded = 0
+
+    @property
+    def generation(self):
+        row = self.conn.execute("SELECT value FROM state WHERE key = 'generation'").fetchone()
+        return row[0] if row else 0
+
+    def uids(self):
+        return {uid for (uid,) in self.conn.execute("SELECT uid FROM chunks")}
+
+    def insert(self, chunk):
+        self.embedded += 1
+        self.conn.execute(
+            "INSERT OR REPLACE INTO chunks (alias, source, chapter, title, category, keywords, "
+            "ocr_quality, uid, embedding) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            _row(chunk) + (embed(chunk["text"]),),
+        )
+
+    def update_meta(self, chunk):
+        self.conn.execute(
+            "UPDATE chunks SET alias = ?, source = ?, chapter = ?, title = ?, category = ?, "
+            "keywords = ?, ocr_quality = ? WHERE uid = ?",
+            _row(chunk),
+        )
+
+    def delete(self, uids):
+        self.conn.executemany("DELETE FROM chunks WHERE uid = ?", [(uid,) for uid in uids])
+
+    def set_generation(self, generation):
+        self.conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('generation', ?)",
+                          (generation,))
+
+    def apply(self, changes, chunks_path=KB_DIR / "rag_chunks.json"):
+        """套用一份變更紀錄；回傳本次計算的向量數"""
+        before = self.embedded
+        with self.conn:
+            if changes["base_generation"] == self.generation:
+                added, modified = set(changes["added"]), set(changes["modified"])
+                self.delete(changes["removed"])
+                if added or modified:
+                    for chunk in iter_chunks(chunks_path):
+                        if chunk["uid"] in added:
+                            self.insert(chunk)
+                        elif chunk["uid"] in modified:
+                            self.update_meta(chunk)
+            else:
+                self.resync(chunks_path)
+            self.set_generation(changes["generation"])
+        return self.embedded - before
+
+    def resync(self, chunks_path):
+        """全量比對：刪除多餘的 uid，只為缺少的 uid 計算向量，其餘更新中繼資料"""
+        stored = self.uids()
+        current = set()
+        for chunk in iter_chunks(chunks_path):
+            current.add(chunk["uid"])
+            if chunk["uid"] in stored:
+                self.update_meta(chunk)
+            else:
+                self.insert(chunk)
+        self.delete(stored - current)
+
+
+def main():
+    db_path = KB_DIR / "vectors.db"
+    if "--db" in sys.argv:
+        db_path = Path(sys.argv[sys.argv.index("--db") + 1])
+
+    with open(KB_DIR / "chunk_changes.json", 'r', encoding='utf-8') as f:
+        changes = json.load(f)
+
+    store = VectorStore(db_path)
+    if store.generation >= changes["generation"]:
+        print(f"✅ 已是最新（第 {store.generation} 版）")
+        return
+
+    mode = "增量" if changes["base_generation"] == store.generation else "全量比對"
+    embedded = store.apply(changes)
+    total = store.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+    print(f"✅ 已套用第 {changes['generation']} 版（{mode}）")
+    print(f"   - 新增: {len(changes['added'])}  刪除: {len(changes['removed'])}"
+          f"  中繼資料變更: {len(changes['modified'])}")
+    print(f"   - 計算向量: {embedded}")
+    print(f"   - 向量庫分塊: {total}")
+    print(f"📄 向量庫: {db_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+容錯模糊檢索（OCR 錯字、異體字、簡繁混用）
+建索引時先以混淆表把常見 OCR 誤認字、簡體字統一成同一個字，再建立三字組倒排表；
+查詢時以三字組計數篩出候選分塊，只對候選分塊做有上限的編輯距離驗證（Myers 位元平行演算法）
+
+用法：
+    python fuzzy_search.py 天地之閒一氣而己                # 容許 1 個編輯
+    python fuzzy_search.py 天地之閒一氣而己 --max-edits 2  # 容許 2 個編輯
+    python fuzzy_search.py --bench              # 候選集大小與延遲 vs 全掃描
+"""
+import sys
+import json
+import time
+import random
+from array import array
+from pathlib import Path
+
+KB_DIR = Path(__file__).resolve().parent
+
+GRAM = 3
+
+# 已知 OCR 誤認與簡繁混用：左邊的字在建索引與查詢時都換成右邊的字
+# 只收一對一的字元替換，分塊內的位置因此不變；乾／干／幹、己／已／巳 等在命理中各有意義，不收
+OCR_CONFUSIONS = {
+    # OCR 誤認
+    "輿": "與", "閒": "間", "戍": "戌", "曰": "日", "末": "未", "士": "土", "兑": "兌", "説": "說", "爲": "為",
+    # 簡體 → 繁體（三命通會、子平真詮為簡體本）
+    "与": "與", "间": "間", "于": "於", "为": "為", "论": "論", "阴": "陰", "阳": "陽", "财": "財", "杀": "殺",
+    "伤": "傷", "祸": "禍", "禄": "祿", "运": "運", "岁": "歲", "时": "時", "气": "氣", "贵": "貴", "库": "庫",
+    "冲": "沖", "会": "會", "顺": "順", "诀": "訣", "体": "體", "长": "長", "亲": "親", "马": "馬",
+    "寿": "壽", "灾": "災", "贫": "貧", "发": "發", "败": "敗", "见": "見", "无": "無", "个": "個",
+    "书": "書", "说": "說", "兴": "興", "经": "經", "数": "數", "宫": "宮", "权": "權", "机": "機",
+    "门": "門", "军": "軍", "贞": "貞", "乡": "鄉", "从": "從", "归": "歸", "还": "還", "进": "進",
+    "过": "過", "这": "這", "们": "們",
+}
+
+# 建索引時刪除的空白與標點（OCR 斷行常把詞切開，標點也常漏認或多認；查詢通常不帶標點）
+STRIP_CHARS = " \t\n\r\f　，。、；：？！「」『』（）《》〈〉…·,.;:?!()"
+
+
+def make_table(confusions=OCR_CONFUSIONS):
+    """混淆表 → str.translate 對照表（同時刪除空白與標點）"""
+    table = {ord(src): dst for src, dst in confusions.items() if src != dst}
+    table.update({ord(ch): None for ch in STRIP_CHARS})
+    return str.maketrans(table)
+
+
+def edit_distance(a, b):
+    """兩個字串的編輯距離（插入、刪除、替換各算 1）"""
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+def best_match_end(pattern, text):
+    """Myers 位元平行近似比對：回傳 (最小編輯距離, 結束位置)，比對可從 text 任一處開始"""
+    m = len(pattern)
+    mask = (1 << m) - 1
+    high = 1 << (m - 1)
+    peq = {}
+    for i, ch in enumerate(pattern):
+        peq[ch] = peq.get(ch, 0) | (1 << i)
+
+    pv, mv, score = mask, 0, m
+    best, best_end = m, 0
+    for j, ch in enumerate(text):
+        eq = peq.get(ch, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = (mv | ~(xh | pv)) & mask
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        ph = (ph << 1) & mask
+        mh = (mh << 1) & mask
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv
+        # 同分時往後延伸（替換與刪除同分時取較完整的片段）
+        if score < best or (score == best and j == best_end):
+            best, best_end = score, j + 1
+    return best, best_end
+
+
+class FuzzyIndex:
+    """正規化文字 + 三字組倒排表"""
+
+    def __init__(self, chunks, confusions=OCR_CONFUSIONS):
+        self.chunks = chunks
+        self.table = make_table(confusions)
+        self.texts = [chunk["text"].translate(self.table) for chunk in chunks]
+        postings = {}
+        for idx, text in enumerate(self.texts):
+            for gram in {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}:
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array('I')
+                posting.append(idx)
+        self.postings = postings
+
+    @classmethod
+    def load(cls, kb_dir=KB_DIR, confusions=OCR_CONFUSIONS):
+        with open(Path(kb_dir) / "rag_chunks.json", 'r', encoding='utf-8') as f:
+            return cls(json.load(f)["chunks"], confusions)
+
+    def normalize(self, text):
+        return text.translate(self.table)
+
+    def candidates(self, query, max_edits=1, category=None):
+        """三字組計數篩選：回傳候選分塊編號
+
+        每個編輯最多破壞 GRAM 個三字組，因此編輯距離 ≤ max_edits 的分塊
+        至少含有 (不同三字組數 - max_edits × GRAM) 個查詢的三字組。
+        查詢太短、下限 ≤ 0 時無法篩選，退回所有分塊；
+        查詢長度約為 GRAM × (max_edits + 1) 以上時篩選才有效
+        """
+        grams = {query[i:i + GRAM] for i in range(len(query) - GRAM + 1)}
+        need = len(grams) - max_edits * GRAM
+        if need <= 0:
+            found = range(len(self.chunks))
+        else:
+            counts = {}
+            for gram in grams:
+                for idx in self.postings.get(gram, ()):
+                    counts[idx] = counts.get(idx, 0) + 1
+            found = sorted(idx for idx, n in counts.items() if n >= need)
+        if category:
+            return [idx for idx in found if self.chunks[idx]["category"] == category]
+        return list(found)
+
+    def match(self, idx, query, max_edits):
+        """驗證單一分塊，回傳 (編輯距離, 原文中的命中片段)；超過上限回傳 None"""
+        text = self.texts[idx]
+        distance, end = best_match_end(query, text)
+        if distance > max_edits:
+            return None
+        # 在結束位置附近找出距離最小、最長的起點
+        m = len(query)
+        start = min(
+            range(max(0, end - m - max_edits), max(0, end - m + max_edits) + 1),
+            key=lambda s: (edit_distance(query, text[s:end]), s),
+        )
+        # 正規化文字的位置 → 原文位置（正規化只刪除空白與標點）
+        original = self.chunks[idx]["text"]
+        kept = [i for i, ch in enumerate(original) if ch not in STRIP_CHARS]
+        return distance, original[kept[start]:kept[end - 1] + 1]
+
+    def search(self, query, max_edits=1, category=None, limit=5):
+        """模糊查詢：回傳 [{"chunk", "distance", "match"}]，依編輯距離排序"""
+        query = self.normalize(query)
+        if not query:
+            return []
+        max_edits = min(max_edits, len(query) - 1)
+        hits = []
+        for idx in self.candidates(query, max_edits, category):
+            result = self.match(idx, query, max_edits)
+            if result:
+                hits.append((result[0], idx, result[1]))
+        hits.sort(key=lambda h: (h[0], h[1]))
+        return [
+            {"chunk": self.chunks[idx], "distance": distance, "match": text}
+            for distance, idx, text in hits[:limit]
+        ]
+
+    def brute_force(self, query, max_edits=1, category=None):
+        """對照組：每個分塊都做編輯距離比對，回傳命中的分塊編號"""
+        query = self.normalize(query)
+        return [
+            idx for idx, text in enumerate(self.texts)
+            if (not category or self.chunks[idx]["category"] == category)
+            and best_match_end(query, text)[0] <= max_edits
+        ]
+
+
+_default_index = None
+
+
+def fuzzy_search(query, max_edits=1, category=None, limit=5):
+    """以預設知識庫做容錯查詢"""
+    global _default_index
+    if _default_index is None:
+        _default_index = FuzzyIndex.load()
+    return _default_index.search(query, max_edits, category, limit)
+
+
+def _corrupt(text, rng, edits):
+    """模擬 OCR 錯誤：混淆字替換、缺字、多字"""
+    reverse = {}
+    for src, dst in OCR_CONFUSIONS.items():
+        reverse.setdefault(dst, []).append(src)
+    chars = list(text)
+    for _ in range(edits):
+        i = rng.randrange(len(chars))
+        op = rng.choice(["swap", "drop", "insert"])
+        if op == "swap" and chars[i] in reverse:
+            chars[i] = rng.choice(reverse[chars[i]])  # 混淆字不計入編輯距離
+        elif op == "drop" and len(chars) > 1:
+            del chars[i]
+        else:
+            chars.insert(i, rng.choice("之而也者其"))
+    return "".join(chars)
+
+
+def benchmark(queries=30, max_edits=1, seed=11):
+    """比較三字組篩選 + 驗證與全掃描編輯距離的候選數與延遲，並確認結果一致"""
+    t0 = time.perf_counter()
+    index = FuzzyIndex.load()
+    build = time.perf_counter() - t0
+
+    rng = random.Random(seed)
+    samples = []
+    while len(samples) < queries:
+        chunk = rng.choice(index.chunks)
+        text = "".join(ch for ch in chunk["text"] if ch not in STRIP_CHARS)
+        if len(text) < 40:
+            continue
+        start = rng.randrange(len(text) - 12)
+        samples.append(_corrupt(text[start:start + rng.randint(8, 12)], rng, max_edits))
+
+    total_candidates = 0
+    indexed = brute = 0.0
+    same = True
+    for query in samples:
+        t0 = time.perf_counter()
+        normalized = index.normalize(query)
+        candidates = index.candidates(normalized, max_edits)
+        found = [idx for idx in candidates if index.match(idx, normalized, max_edits)]
+        indexed += time.perf_counter() - t0
+        total_candidates += len(candidates)
+
+        t0 = time.perf_counter()
+        expected = index.brute_force(query, max_edits)
+        brute += time.perf_counter() - t0
+        same = same and found == expected
+
+    n = len(index.chunks)
+    print(f"📊 容錯查詢 {queries} 筆（最多 {max_edits} 個編輯，{n} 個分塊，建索引 {build * 1000:.0f} ms，"
+          f"三字組 {len(index.postings):,} 種）")
+    print(f"   - 平均候選分塊: {total_candidates / queries:.1f}（全掃描 {n}）")
+    print(f"   - 三字組篩選 + 驗證: 每筆 {indexed / queries * 1000:.2f} ms")
+    print(f"   - 全掃描編輯距離:   每筆 {brute / queries * 1000:.2f} ms")
+    print(f"   - 加速: {brute / indexed:.0f}×  結果{'一致' if same else '不一致'}")
+
+
+def main():
+    args = sys.argv[1:]
+    max_edits = 1
+    if "--max-edits" in args:
+        i = args.index("--max-edits")
+        max_edits = int(args[i + 1])
+        del args[i:i + 2]
+    if "--bench" in args:
+        benchmark(max_edits=max_edits)
+        return
+    if not args:
+        print(__doc__)
+        return
+
+    for hit in fuzzy_search(args[0], max_edits):
+        chunk = hit["chunk"]
+        print(f"  [{hit['distance']}] {chunk['id']}  {hit['match']}")
+
+
+if __name__ == "__main__":
+    main()
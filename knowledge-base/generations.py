@@ -0,0 +1,554 @@
+#!/usr/bin/env python3
+"""
+知識庫建置世代：整批發佈與讀取端熱重載
+原本建置腳本直接覆寫 index.json、rag_chunks.json 與各索引，建置途中啟動的讀取端
+可能讀到寫到一半的檔案，或新的 rag_chunks.json 配上舊的索引。
+
+每次建置寫進新的世代目錄 generations/<id>.building（先複製目前世代的產物，
+增量建置與變更紀錄照常比對上一版），寫完後：
+  1. 為每個檔案計算 sha256 與大小，寫入 generation.json 並 fsync
+  2. 目錄更名為 generations/<id>
+  3. 建立指向新世代的暫存符號連結，以 os.replace 原子地蓋掉 generations/current
+     （不支援符號連結的系統改寫內容為世代 id 的指標檔）
+讀取端只經由 current 取得世代目錄，任何時刻看到的都是完整且互相一致的一組檔案。
+
+LiveGeneration 讓常駐的讀取端在背景執行緒輪詢 current：切換後先驗證校驗和、
+在背景載入並預熱新世代，再一次替換參照；查詢中的請求繼續使用原本的物件，不必等待載入。
+讀取端以租約檔（generations/.leases）標記使用中的世代，清理舊世代時跳過，
+租約的行程已結束則視為失效。
+
+Next.js 在建置時直接 import knowledge-base/ 下的 JSON，發佈後以 export_generation
+逐檔原子替換到扁平目錄（內容相同的檔案不動）。扁平目錄的 .exported.json 記錄上次匯出的檔案清單，
+上次匯出過、新世代已不含的產物才從扁平目錄刪除，其他檔案一律不動。
+
+chunk_text.*（壓縮文字）只有 process_books_v2.py --compress 會重建，開新世代時不複製，
+沒有重建的世代就不帶壓縮文字，不會發佈與 rag_chunks.json 對不上的舊版。
+
+用法：
+    python generations.py               # 列出世代與 current
+    python generations.py --publish     # 以目前的扁平目錄建立一個世代並發佈
+    python generations.py --verify      # 驗證 current 的校驗和
+    python generations.py --gc          # 清理舊世代（保留最近 KEEP_GENERATIONS 個與有租約者）
+    python generations.py --bench       # 熱重載期間的查詢延遲與發佈耗時
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import hashlib
+import itertools
+import statistics
+import tempfile
+import threading
+import multiprocessing
+from datetime import datetime, timezone
+from pathlib import Path
+
+KB_DIR = Path(__file__).resolve().parent
+
+GENERATIONS = "generations"
+CURRENT = "current"
+MANIFEST = "generation.json"
+BUILDING_SUFFIX = ".building"
+LEASES = ".leases"
+KEEP_GENERATIONS = 3
+# 超過此時間仍未發佈的 .building 目錄視為中斷的建置
+STALE_BUILD_SECONDS = 3600
+# 不屬於建置產物：原始碼與說明、可重建的快取、持續寫入的向量庫
+EXCLUDE_NAMES = {GENERATIONS, "__pycache__", "README.md", "corpus.bin", "vectors.db"}
+EXCLUDE_SUFFIXES = {".py", ".pyc"}
+# 只在指定時重建的產物：開新世代時不複製上一版
+NOT_SEEDED = {"chunk_text.bin", "chunk_text.dict", "chunk_text.idx.json"}
+# 扁平目錄中記錄上次匯出檔案清單的檔案
+EXPORTED = ".exported.json"
+HASH_BLOCK = 1 << 20
+
+_lease_ids = itertools.count()
+
+
+def generations_root(kb_dir=KB_DIR):
+    return Path(kb_dir) / GENERATIONS
+
+
+def artifact_files(base, markdown=True):
+    """base 下屬於建置產物的檔案（相對路徑，已排序）"""
+    base = Path(base)
+    files = []
+    for path in base.rglob("*"):
+        rel = path.relative_to(base)
+        if any(part in EXCLUDE_NAMES or part.startswith(".") for part in rel.parts):
+            continue
+        if not path.is_file() or path.suffix in EXCLUDE_SUFFIXES or rel.as_posix() == MANIFEST:
+            continue
+        if not markdown and path.suffix == ".md":
+            continue
+        files.append(rel)
+    return sorted(files)
+
+
+def file_digest(path):
+    """(大小, sha256)；順便 fsync，發佈前確保內容已落盤"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+        os.fsync(f.fileno())
+    return os.path.getsize(path), digest.hexdigest()
+
+
+def _fsync_dir(path):
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def current_generation(kb_dir=KB_DIR):
+    """目前發佈的世代 id；尚未使用世代時為 None"""
+    pointer = generations_root(kb_dir) / CURRENT
+    try:
+        return os.readlink(pointer)
+    except FileNotFoundError:
+        return None
+    except OSError:
+        # 指標檔（不支援符號連結的系統）
+        return pointer.read_text(encoding='utf-8').strip() or None
+
+
+def resolve(kb_dir=KB_DIR):
+    """讀取端該使用的目錄：current 指向的世代，尚未使用世代時為扁平目錄本身"""
+    generation = current_generation(kb_dir)
+    return generations_root(kb_dir) / generation if generation else Path(kb_dir)
+
+
+def list_generations(kb_dir=KB_DIR):
+    """已發佈的世代 id（由舊到新）"""
+    root = generations_root(kb_dir)
+    if not root.exists():
+        return []
+    return sorted(p.name for p in root.iterdir()
+                  if p.is_dir() and not p.is_symlink() and p.name.isdigit())
+
+
+def begin_generation(kb_dir=KB_DIR, markdown=True, seed_from=None):
+    """建立 generations/<id>.building 並複製目前世代（或 seed_from）的產物，回傳暫存目錄
+
+    markdown=False 時不複製章節 Markdown（全量重建會重新輸出）；NOT_SEEDED 的產物一律不複製
+    """
+    root = generations_root(kb_dir)
+    root.mkdir(parents=True, exist_ok=True)
+    used = [int(p.name.split(".")[0]) for p in root.iterdir() if p.name.split(".")[0].isdigit()]
+    number = max(used, default=0) + 1
+    while True:
+        staging = root / f"{number:06d}{BUILDING_SUFFIX}"
+        try:
+            staging.mkdir()
+            break
+        except FileExistsError:
+            # 另一個建置同時取得了這個編號
+            number += 1
+
+    source = Path(seed_from) if seed_from else resolve(kb_dir)
+    for rel in artifact_files(source, markdown):
+        if rel.as_posix() in NOT_SEEDED:
+            continue
+        target = staging / rel
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(source / rel, target)
+    return staging
+
+
+def abort_generation(staging):
+    """放棄尚未發佈的暫存目錄"""
+    shutil.rmtree(staging, ignore_errors=True)
+
+
+def write_manifest(staging, parent=None):
+    files = {}
+    for rel in artifact_files(staging):
+        size, sha256 = file_digest(staging / rel)
+        files[rel.as_posix()] = {"size": size, "sha256": sha256}
+    manifest = {
+        "generation": Path(staging).name[:-len(BUILDING_SUFFIX)],
+        "parent": parent,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "files": files,
+    }
+    path = Path(staging) / MANIFEST
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    return manifest
+
+
+def _flip(root, generation):
+    """原子地把 current 指向 generation"""
+    tmp = root / f".{CURRENT}.{os.getpid()}"
+    if tmp.is_symlink() or tmp.exists():
+        tmp.unlink()
+    try:
+        os.symlink(generation, tmp, target_is_directory=True)
+    except (OSError, NotImplementedError):
+        tmp.write_text(generation, encoding='utf-8')
+    os.replace(tmp, root / CURRENT)
+    _fsync_dir(root)
+
+
+def publish(staging, kb_dir=KB_DIR, keep=KEEP_GENERATIONS):
+    """寫入 generation.json、更名為正式世代並切換 current；回傳世代目錄"""
+    staging = Path(staging)
+    root = generations_root(kb_dir)
+    manifest = write_manifest(staging, parent=current_generation(kb_dir))
+    final = root / manifest["generation"]
+    os.rename(staging, final)
+    _fsync_dir(root)
+    _flip(root, final.name)
+    collect_garbage(kb_dir, keep)
+    return final
+
+
+def verify(generation_dir):
+    """與 generation.json 比對大小與 sha256，回傳有問題的檔案（空列表表示完整）"""
+    generation_dir = Path(generation_dir)
+    try:
+        with open(generation_dir / MANIFEST, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return [MANIFEST]
+    problems = []
+    for rel, expected in manifest["files"].items():
+        path = generation_dir / rel
+        if not path.is_file() or path.stat().st_size != expected["size"]:
+            problems.append(rel)
+            continue
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b""):
+                digest.update(block)
+        if digest.hexdigest() != expected["sha256"]:
+            problems.append(rel)
+    return problems
+
+
+def _exported_files(generation_dir, kb_dir):
+    """扁平目錄上次匯出的檔案清單；尚未記錄時以新世代的上一代（parent）的清單代替"""
+    record = Path(kb_dir) / EXPORTED
+    try:
+        with open(record, 'r', encoding='utf-8') as f:
+            return set(json.load(f)["files"])
+    except (OSError, ValueError, KeyError):
+        pass
+    with open(Path(generation_dir) / MANIFEST, 'r', encoding='utf-8') as f:
+        parent = json.load(f).get("parent")
+    try:
+        with open(generations_root(kb_dir) / parent / MANIFEST, 'r', encoding='utf-8') as f:
+            return set(json.load(f)["files"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return set()
+
+
+def export_generation(generation_dir, kb_dir=KB_DIR):
+    """把世代的產物逐檔原子替換到扁平目錄（Next.js 建置時 import 的位置），內容相同的檔案不動
+
+    rag_chunks.json 與 index.json 最後替換，其餘索引先就位；上次匯出過、新世代已不含的產物
+    （改名或刪除的章節 Markdown 等）最後從扁平目錄刪除，不在上次清單中的檔案不動。
+    回傳替換與刪除的檔案數
+    """
+    generation_dir, kb_dir = Path(generation_dir), Path(kb_dir)
+    with open(generation_dir / MANIFEST, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    files = manifest["files"]
+    previous = _exported_files(generation_dir, kb_dir)
+    last = ("rag_chunks.json", "index.json")
+    changed = 0
+    for rel in sorted(files, key=lambda rel: (rel in last, last.index(rel) if rel in last else 0, rel)):
+        target = kb_dir / rel
+        if target.is_file() and target.stat().st_size == files[rel]["size"] \
+                and file_digest(target)[1] == files[rel]["sha256"]:
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+        shutil.copy2(generation_dir / rel, tmp)
+        os.replace(tmp, target)
+        changed += 1
+    for rel in sorted(previous - set(files)):
+        path = kb_dir / rel
+        if not path.is_file():
+            continue
+        path.unlink()
+        changed += 1
+        # 順便移除因此變空的章節目錄
+        for parent in path.parents:
+            if parent == kb_dir or any(parent.iterdir()):
+                break
+            parent.rmdir()
+    record = kb_dir / EXPORTED
+    tmp = record.with_name(f"{EXPORTED}.{os.getpid()}.tmp")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({"generation": manifest["generation"], "files": sorted(files)}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, record)
+    return changed
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def acquire_lease(kb_dir, generation):
+    """標記本行程正在使用 generation，回傳租約檔路徑"""
+    leases = generations_root(kb_dir) / LEASES
+    leases.mkdir(parents=True, exist_ok=True)
+    path = leases / f"{generation}.{os.getpid()}.{next(_lease_ids)}"
+    path.touch()
+    return path
+
+
+def release_lease(path):
+    if path is not None:
+        Path(path).unlink(missing_ok=True)
+
+
+def leased_generations(kb_dir=KB_DIR):
+    """仍有存活行程持有租約的世代；已結束行程留下的租約順便刪除"""
+    leases = generations_root(kb_dir) / LEASES
+    held = set()
+    if not leases.exists():
+        return held
+    for path in leases.iterdir():
+        generation, pid, _ = path.name.split(".")
+        if _pid_alive(int(pid)):
+            held.add(generation)
+        else:
+            path.unlink(missing_ok=True)
+    return held
+
+
+def collect_garbage(kb_dir=KB_DIR, keep=KEEP_GENERATIONS):
+    """刪除 current 以外、不在最近 keep 個且沒有租約的世代，以及中斷建置留下的 .building 目錄"""
+    root = generations_root(kb_dir)
+    if not root.exists():
+        return []
+    protected = set(list_generations(kb_dir)[-keep:]) | leased_generations(kb_dir)
+    current = current_generation(kb_dir)
+    if current:
+        protected.add(current)
+    removed = []
+    for generation in list_generations(kb_dir):
+        if generation not in protected:
+            shutil.rmtree(root / generation)
+            removed.append(generation)
+    for path in root.glob(f"*{BUILDING_SUFFIX}"):
+        if time.time() - path.stat().st_mtime > STALE_BUILD_SECONDS:
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(path.name)
+    return removed
+
+
+class LiveGeneration:
+    """常駐讀取端持有的世代物件；current 切換後在背景載入新世代並替換
+
+    loader 接受世代目錄、回傳讀取端物件（如 Retriever.load）；warm 在替換前對新物件執行（預熱快取）。
+    get() 回傳目前的物件，已取得舊物件的請求不受替換影響
+    """
+
+    def __init__(self, loader, kb_dir=KB_DIR, interval=1.0, check=True, warm=None):
+        self.loader = loader
+        self.kb_dir = Path(kb_dir)
+        self.interval = interval
+        self.check = check
+        self.warm = warm
+        self.reloads = 0
+        self.error = None
+        self.rejected = None
+        generation = current_generation(kb_dir)
+        self.lease = acquire_lease(kb_dir, generation) if generation else None
+        # (世代 id, 物件) 以單一參照保存，讀取端不會看到不一致的一對
+        # 直接載入持有租約的世代，不再經由 current（期間若發佈了新世代，下一次 poll 會切換）
+        self.current = (generation, loader(generations_root(kb_dir) / generation if generation else self.kb_dir))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get(self):
+        return self.current[1]
+
+    @property
+    def generation(self):
+        return self.current[0]
+
+    def poll(self):
+        """current 已切換時重載；回傳是否替換"""
+        generation = current_generation(self.kb_dir)
+        if generation is None or generation in (self.generation, self.rejected):
+            return False
+        return self.reload(generation)
+
+    def reload(self, generation):
+        generation_dir = generations_root(self.kb_dir) / generation
+        # 先取得租約，載入期間不會被清理
+        lease = acquire_lease(self.kb_dir, generation)
+        try:
+            problems = verify(generation_dir) if self.check else []
+            if problems:
+                raise ValueError(f"世代 {generation} 校驗失敗: {', '.join(problems[:5])}")
+            value = self.loader(generation_dir)
+            if self.warm:
+                self.warm(value)
+        except Exception as e:
+            release_lease(lease)
+            self.error, self.rejected = e, generation
+            print(f"⚠️ 世代 {generation} 載入失敗，繼續使用 {self.generation}: {e}")
+            return False
+        old_lease, self.lease = self.lease, lease
+        self.current = (generation, value)
+        release_lease(old_lease)
+        self.reloads += 1
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def start(self):
+        """啟動背景輪詢執行緒"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="generation-reload", daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        release_lease(self.lease)
+        self.lease = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _publish_worker(kb_dir):
+    publish(begin_generation(kb_dir), kb_dir)
+
+
+def benchmark(seconds=3.0, publishes=5, seed=7):
+    """查詢執行緒持續查詢，另一個行程每隔一段時間發佈新世代：
+    背景重載與請求時同步重載的延遲分布、發佈耗時與切換到生效的時間"""
+    from retrieval import Retriever, _sample_queries
+
+    def percentile(values, q):
+        values = sorted(values)
+        return values[min(int(len(values) * q), len(values) - 1)] * 1000
+
+    with tempfile.TemporaryDirectory() as workdir:
+        t0 = time.perf_counter()
+        staging = begin_generation(workdir, seed_from=KB_DIR)
+        seed_time = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        publish(staging, workdir)
+        publish_time = time.perf_counter() - t0
+        generation_dir = resolve(workdir)
+        size = sum(p["size"] for p in json.load(open(generation_dir / MANIFEST, encoding='utf-8'))["files"].values())
+        t0 = time.perf_counter()
+        problems = verify(generation_dir)
+        verify_time = time.perf_counter() - t0
+
+        sample = _sample_queries(Retriever.load(generation_dir).chunks, 200, random.Random(seed))
+        ctx = multiprocessing.get_context("spawn")
+        print(f"📊 世代 {len(artifact_files(generation_dir))} 個檔案、{size / (1 << 20):.1f} MB")
+        print(f"   - 複製上一世代 {seed_time * 1000:.0f} ms、校驗與發佈 {publish_time * 1000:.0f} ms、"
+              f"驗證 {verify_time * 1000:.0f} ms（{'完整' if not problems else problems}）")
+
+        def run(mode):
+            """idle：不發佈；background：背景執行緒重載；inline：請求進來時才檢查並重載（對照組）"""
+            live = LiveGeneration(Retriever.load, workdir, interval=0.05,
+                                  warm=lambda r: [r.search(*q) for q in sample[:20]])
+            if mode == "background":
+                live.start()
+            latencies, swaps, stop = [], [], threading.Event()
+
+            def reader():
+                for query in itertools.cycle(sample):
+                    if stop.is_set():
+                        return
+                    t = time.perf_counter()
+                    if mode == "inline":
+                        live.poll()
+                    live.get().search(*query)
+                    latencies.append(time.perf_counter() - t)
+
+            thread = threading.Thread(target=reader)
+            thread.start()
+            for _ in range(publishes if mode != "idle" else 0):
+                time.sleep(seconds / (publishes + 1))
+                # 建置在另一個行程，與實際部署相同
+                builder = ctx.Process(target=_publish_worker, args=(workdir,))
+                builder.start()
+                builder.join()
+                published = time.perf_counter()
+                target = current_generation(workdir)
+                while live.generation != target:
+                    time.sleep(0.001)
+                swaps.append(time.perf_counter() - published)
+            time.sleep(seconds / (publishes + 1) if mode != "idle" else seconds)
+            stop.set()
+            thread.join()
+            live.close()
+            return latencies, swaps, live.reloads
+
+        for mode, label in (("idle", "無發佈"), ("inline", "請求時重載"), ("background", "背景重載")):
+            latencies, swaps, reloads = run(mode)
+            line = (f"   - {label:<6} 查詢 {len(latencies):5d} 筆  p50 {percentile(latencies, 0.5):5.2f} ms"
+                    f"  p99 {percentile(latencies, 0.99):6.2f} ms  最大 {max(latencies) * 1000:6.2f} ms")
+            if swaps:
+                line += f"  重載 {reloads} 次，切換到生效平均 {statistics.mean(swaps) * 1000:.0f} ms"
+            print(line)
+        print(f"   - 保留世代: {list_generations(workdir)}（KEEP_GENERATIONS = {KEEP_GENERATIONS}）")
+
+
+def main():
+    if "--bench" in sys.argv:
+        benchmark()
+        return
+    if "--publish" in sys.argv:
+        generation_dir = publish(begin_generation(KB_DIR, seed_from=KB_DIR))
+        print(f"✅ 已發佈世代 {generation_dir.name}")
+        return
+    if "--verify" in sys.argv:
+        generation = current_generation()
+        if generation is None:
+            print("⚠️ 尚未發佈任何世代")
+            return
+        problems = verify(resolve())
+        print(f"✅ 世代 {generation} 完整" if not problems else f"❌ 世代 {generation} 校驗失敗: {problems}")
+        return
+    if "--gc" in sys.argv:
+        removed = collect_garbage()
+        print(f"🗑️ 清理 {len(removed)} 個世代: {removed}")
+        return
+    current = current_generation()
+    leased = leased_generations()
+    for generation in list_generations():
+        marks = [m for m, on in (("current", generation == current), ("使用中", generation in leased)) if on]
+        print(f"   {generation}{'  (' + ', '.join(marks) + ')' if marks else ''}")
+    if current is None:
+        print("⚠️ 尚未發佈任何世代，讀取端使用扁平目錄")
+
+
+if __name__ == "__main__":
+    main()
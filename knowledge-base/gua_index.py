@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+易經卦爻結構索引
+解析易經類書籍的 RAG 分塊，標記每塊討論的卦（1-64）與爻位（1-6），
+輸出以卦序、爻位為鍵的索引，讓起卦結果可直接對應到古書段落
+"""
+import re
+import json
+from pathlib import Path
+
+KB_DIR = Path(__file__).resolve().parent
+
+# 易經類書籍
+GUA_BOOKS = {"傅佩榮易經入門課", "梅花易數", "易經雜說"}
+
+# 六十四卦（卦序, 卦名, 全名）
+HEXAGRAMS = [
+    (1, "乾", "乾為天"), (2, "坤", "坤為地"), (3, "屯", "水雷屯"), (4, "蒙", "山水蒙"),
+    (5, "需", "水天需"), (6, "訟", "天水訟"), (7, "師", "地水師"), (8, "比", "水地比"),
+    (9, "小畜", "風天小畜"), (10, "履", "天澤履"), (11, "泰", "地天泰"), (12, "否", "天地否"),
+    (13, "同人", "天火同人"), (14, "大有", "火天大有"), (15, "謙", "地山謙"), (16, "豫", "雷地豫"),
+    (17, "隨", "澤雷隨"), (18, "蠱", "山風蠱"), (19, "臨", "地澤臨"), (20, "觀", "風地觀"),
+    (21, "噬嗑", "火雷噬嗑"), (22, "賁", "山火賁"), (23, "剝", "山地剝"), (24, "復", "地雷復"),
+    (25, "无妄", "天雷无妄"), (26, "大畜", "山天大畜"), (27, "頤", "山雷頤"), (28, "大過", "澤風大過"),
+    (29, "坎", "坎為水"), (30, "離", "離為火"), (31, "咸", "澤山咸"), (32, "恆", "雷風恆"),
+    (33, "遯", "天山遯"), (34, "大壯", "雷天大壯"), (35, "晉", "火地晉"), (36, "明夷", "地火明夷"),
+    (37, "家人", "風火家人"), (38, "睽", "火澤睽"), (39, "蹇", "水山蹇"), (40, "解", "雷水解"),
+    (41, "損", "山澤損"), (42, "益", "風雷益"), (43, "夬", "澤天夬"), (44, "姤", "天風姤"),
+    (45, "萃", "澤地萃"), (46, "升", "地風升"), (47, "困", "澤水困"), (48, "井", "水風井"),
+    (49, "革", "澤火革"), (50, "鼎", "火風鼎"), (51, "震", "震為雷"), (52, "艮", "艮為山"),
+    (53, "漸", "風山漸"), (54, "歸妹", "雷澤歸妹"), (55, "豐", "雷火豐"), (56, "旅", "火山旅"),
+    (57, "巽", "巽為風"), (58, "兌", "兌為澤"), (59, "渙", "風水渙"), (60, "節", "水澤節"),
+    (61, "中孚", "風澤中孚"), (62, "小過", "雷山小過"), (63, "既濟", "水火既濟"), (64, "未濟", "火水未濟"),
+]
+
+# 異體字與簡體寫法
+VARIANTS = {
+    "訟": ["讼"], "師": ["师"], "謙": ["谦"], "隨": ["随"], "蠱": ["蛊"], "臨": ["临"],
+    "觀": ["观"], "賁": ["贲"], "剝": ["剥"], "无妄": ["無妄"], "頤": ["颐"], "大過": ["大过"],
+    "離": ["离"], "恆": ["恒"], "遯": ["遁"], "大壯": ["大壮"], "晉": ["晋"], "損": ["损"],
+    "漸": ["渐"], "歸妹": ["归妹"], "豐": ["丰"], "兌": ["兑"], "渙": ["涣"], "節": ["节"],
+    "小過": ["小过"], "既濟": ["既济"], "未濟": ["未济"],
+}
+
+# 「解卦」常作動詞（解讀卦象），不以「X卦」形式計入，只認全名「雷水解」
+AMBIGUOUS_SHORT = {"解"}
+
+YAO_POSITIONS = {"初": 1, "二": 2, "三": 3, "四": 4, "五": 5, "上": 6}
+
+
+def _build_name_table():
+    """建立 名稱 → 卦序 對照表（卦名需帶「卦」字，全名可單獨出現）"""
+    table = {}
+    for number, short, full in HEXAGRAMS:
+        shorts = [short] + VARIANTS.get(short, [])
+        for name in shorts:
+            if short not in AMBIGUOUS_SHORT:
+                table[name + "卦"] = number
+            table[full.replace(short, name)] = number
+    return table
+
+
+GUA_NAMES = _build_name_table()
+
+# 爻位：初九、六二、上六……，以及「初爻」「五爻」
+YAO_PATTERN = r"[初上][九六]|[九六][二三四五]|[初二三四五上]爻"
+
+# 名稱依長度遞減排列，讓「大過卦」優先於「過」之類的短匹配
+TOKEN_RE = re.compile(
+    "|".join(re.escape(n) for n in sorted(GUA_NAMES, key=len, reverse=True))
+    + "|" + YAO_PATTERN
+)
+
+
+def parse_yao(token):
+    """將爻位字串轉為 1-6"""
+    if token.endswith("爻"):
+        return YAO_POSITIONS[token[0]]
+    if token[0] in "初上":
+        return YAO_POSITIONS[token[0]]
+    return YAO_POSITIONS[token[1]]
+
+
+def tag_chunk(text, current_gua=None):
+    """標記單一分塊提到的卦與爻，爻歸屬於其前最近提到的卦
+
+    回傳 (tags, current_gua)，tags 為 {(卦序, 爻位): 次數}，爻位 0 代表整卦
+    """
+    tags = {}
+    for match in TOKEN_RE.finditer(text):
+        token = match.group(0)
+        number = GUA_NAMES.get(token)
+        if number:
+            current_gua = number
+            key = (number, 0)
+        elif current_gua:
+            key = (current_gua, parse_yao(token))
+        else:
+            continue
+        tags[key] = tags.get(key, 0) + 1
+    return tags, current_gua
+
+
+def _entry_id(chunk_id):
+    """由分塊 id 取出所屬章節條目 id"""
+    return chunk_id.rsplit("_chunk_", 1)[0]
+
+
+def build_gua_index(chunks):
+    """建立卦爻索引
+
+    同一章節的分塊依序解析，讓跨塊延續討論的爻仍能對應到正確的卦
+    """
+    postings = {}
+    chunk_tags = {}
+    current_gua = None
+    last_entry = None
+
+    for chunk in chunks:
+        if chunk.get("source") not in GUA_BOOKS:
+            continue
+        entry = _entry_id(chunk["id"])
+        if entry != last_entry:
+            current_gua = None
+            last_entry = entry
+
+        tags, current_gua = tag_chunk(chunk["text"], current_gua)
+        if not tags:
+            continue
+
+        chunk_tags[chunk["id"]] = sorted(tags)
+        for (number, yao), count in tags.items():
+            postings.setdefault(number, {}).setdefault(yao, []).append((count, chunk["id"]))
+
+    hexagrams = {}
+    for number, short, full in HEXAGRAMS:
+        lines = postings.get(number)
+        if not lines:
+            continue
+        # 每個位置依提及次數排序，次數高者優先
+        ordered = {
+            str(yao): [cid for _, cid in sorted(hits, key=lambda h: -h[0])]
+            for yao, hits in sorted(lines.items())
+        }
+        hexagrams[str(number)] = {
+            "name": full,
+            "short": short,
+            "chunks": ordered.pop("0", []),
+            "lines": ordered,
+        }
+
+    return {
+        "version": "1.0",
+        "total_tagged_chunks": len(chunk_tags),
+        "hexagrams": hexagrams,
+        "chunk_tags": chunk_tags,
+    }
+
+
+def save_gua_index(chunks, output_dir):
+    """建立並儲存 gua_index.json"""
+    index = build_gua_index(chunks)
+    index_path = Path(output_dir) / "gua_index.json"
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    return index_path, index
+
+
+def main():
+    chunks_path = KB_DIR / "rag_chunks.json"
+    with open(chunks_path, 'r', encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+
+    index_path, index = save_gua_index(chunks, KB_DIR)
+
+    line_postings = sum(len(h["lines"]) for h in index["hexagrams"].values())
+    print(f"✅ 卦爻索引完成")
+    print(f"   - 標記分塊: {index['total_tagged_chunks']}")
+    print(f"   - 涵蓋卦數: {len(index['hexagrams'])} / 64")
+    print(f"   - 爻位條目: {line_postings}")
+    print(f"📄 索引檔案: {index_path}")
+
+
+if __name__ == "__main__":
+    main()
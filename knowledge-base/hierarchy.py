@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+章節階層樹
+把 smart_split 辨識出的章節層級（篇 → 章 → 節 → 小節 → 條目）保存下來，
+建立 書 → 篇 → 章 → 節 → 分塊 的樹：每個節點有父節點、前後兄弟，
+並記錄其下所有分塊在閱讀順序中的區間，檢索命中後可直接取出鄰近分塊或整節，
+也可依章節合併重複的命中
+
+用法：
+    python hierarchy.py            # 建立 hierarchy.json
+"""
+import re
+import json
+from pathlib import Path
+
+KB_DIR = Path(__file__).resolve().parent
+
+# 章節標題模式（smart_split 也使用）
+HEADING_PATTERNS = [
+    # 第X章 標題
+    (r'^(第[一二三四五六七八九十\d]+章)\s*[:：]?\s*(.+?)$', 'chapter'),
+    # 第X篇 標題
+    (r'^(第[一二三四五六七八九十\d]+篇)\s*[:：]?\s*(.+?)$', 'part'),
+    # 第X節 標題
+    (r'^(第[一二三四五六七八九十\d]+節)\s*[:：]?\s*(.+?)$', 'section'),
+    # X.X 標題
+    (r'^(\d+\.\d+)\s+(.+?)$', 'subsection'),
+    # 一、標題 / 1、標題
+    (r'^([一二三四五六七八九十\d]+)[、.]\s*(.+?)$', 'item'),
+]
+
+# 層級深度：數字越小越上層；前言與固定長度分段視同章
+HEADING_RANK = {
+    "part": 1,
+    "preface": 2,
+    "chapter": 2,
+    "paragraph": 2,
+    "section": 3,
+    "subsection": 4,
+    "item": 5,
+}
+
+# 只有章節編號（沒有標題）時的判斷
+_LABEL_PATTERNS = [
+    (re.compile(r'^第[一二三四五六七八九十\d]+章$'), 'chapter'),
+    (re.compile(r'^第[一二三四五六七八九十\d]+篇$'), 'part'),
+    (re.compile(r'^第[一二三四五六七八九十\d]+節$'), 'section'),
+    (re.compile(r'^\d+\.\d+$'), 'subsection'),
+    (re.compile(r'^[一二三四五六七八九十\d]+$'), 'item'),
+]
+
+
+def classify_heading(chapter, title):
+    """由章節編號推斷層級（舊資料沒有記錄 level 時使用）"""
+    if chapter == "前言":
+        return "preface"
+    if chapter.isdigit() and title == f"第{chapter}部分":
+        return "paragraph"  # split_by_paragraphs 的固定長度分段
+    for pattern, level in _LABEL_PATTERNS:
+        if pattern.match(chapter):
+            return level
+    return "chapter"
+
+
+def entry_id_of(chunk_id):
+    """分塊 id → 所屬章節條目 id"""
+    return chunk_id.rsplit("_chunk_", 1)[0]
+
+
+def build_hierarchy(chunks, entries=()):
+    """由分塊（閱讀順序）與章節條目建立階層樹
+
+    條目有 level / parents（smart_split 記錄的上層標題）時直接使用，
+    沒有時依章節編號推斷層級，以堆疊還原上下層關係
+    """
+    entry_info = {entry["id"]: entry for entry in entries}
+
+    nodes = {}
+    order = []
+    stacks = {}   # 書名 → [(層級深度, (層級, 編號, 標題), 節點 id)]
+    last_entry = None
+
+    def add_node(node_id, level, label, title, parent):
+        nodes[node_id] = {"level": level, "label": label, "title": title,
+                          "parent": parent, "children": [], "chunks": []}
+        nodes[parent]["children"].append(node_id)
+
+    for chunk in chunks:
+        source = chunk["source"]
+        if source not in nodes:
+            nodes[source] = {"level": "book", "label": source, "title": source,
+                             "parent": None, "children": []}
+            stacks[source] = []
+
+        eid = entry_id_of(chunk["id"])
+        if eid != last_entry:
+            last_entry = eid
+            entry = entry_info.get(eid, chunk)
+            chapter, title = entry["chapter"], entry["title"]
+            level = entry.get("level") or classify_heading(chapter, title)
+            rank = HEADING_RANK.get(level, HEADING_RANK["chapter"])
+            stack = stacks[source]
+
+            parents = entry.get("parents")
+            if parents is not None:
+                # 依記錄的上層標題重建堆疊；相同的上層沿用既有節點，缺少的（內容太短未成條目）補上
+                rebuilt = []
+                for depth, (p_level, p_chapter, p_title) in enumerate(parents):
+                    key = (p_level, p_chapter, p_title)
+                    if depth < len(stack) and stack[depth][1] == key:
+                        rebuilt.append(stack[depth])
+                        continue
+                    node_id = f"{eid}#{depth}"
+                    add_node(node_id, p_level, p_chapter, p_title,
+                             rebuilt[-1][2] if rebuilt else source)
+                    rebuilt.append((HEADING_RANK.get(p_level, 0), key, node_id))
+                stack[:] = rebuilt
+            else:
+                while stack and stack[-1][0] >= rank:
+                    stack.pop()
+
+            add_node(eid, level, chapter, title, stack[-1][2] if stack else source)
+            stack.append((rank, (level, chapter, title), eid))
+
+        nodes[chunk["id"]] = {"level": "chunk", "parent": eid, "pos": len(order)}
+        nodes[eid]["chunks"].append(chunk["id"])
+        order.append(chunk["id"])
+
+    # 每個節點下所有分塊在 order 中的區間（子樹在閱讀順序中連續）
+    for pos, chunk_id in enumerate(order):
+        node_id = nodes[chunk_id]["parent"]
+        while node_id is not None:
+            node = nodes[node_id]
+            span = node.get("span")
+            if span is None:
+                node["span"] = [pos, pos + 1]
+            else:
+                span[1] = pos + 1
+            node_id = node["parent"]
+
+    # 章節節點的前後為同一父節點下的兄弟；分塊的前後為同一本書中的閱讀順序
+    for node in list(nodes.values()):
+        for prev_id, next_id in zip(node.get("children", ()), node.get("children", ())[1:]):
+            nodes[prev_id]["next"] = next_id
+            nodes[next_id]["prev"] = prev_id
+    for prev_id, next_id in zip(order, order[1:]):
+        if _book_of(nodes, prev_id) == _book_of(nodes, next_id):
+            nodes[prev_id]["next"] = next_id
+            nodes[next_id]["prev"] = prev_id
+    for node in nodes.values():
+        node.setdefault("prev", None)
+        node.setdefault("next", None)
+
+    return {
+        "version": "1.0",
+        "books": [node_id for node_id, node in nodes.items() if node["level"] == "book"],
+        "order": order,
+        "nodes": nodes,
+    }
+
+
+def _book_of(nodes, node_id):
+    while nodes[node_id]["parent"] is not None:
+        node_id = nodes[node_id]["parent"]
+    return node_id
+
+
+def save_hierarchy(chunks, entries, output_dir):
+    """建立並儲存 hierarchy.json"""
+    index = build_hierarchy(chunks, entries)
+    index_path = Path(output_dir) / "hierarchy.json"
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+    return index_path, index
+
+
+class Hierarchy:
+    """階層樹查詢：鄰近分塊、整節分塊、依章節合併命中"""
+
+    def __init__(self, index):
+        self.nodes = index["nodes"]
+        self.order = index["order"]
+
+    @classmethod
+    def load(cls, kb_dir=KB_DIR):
+        with open(Path(kb_dir) / "hierarchy.json", 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def parent(self, node_id):
+        return self.nodes[node_id]["parent"]
+
+    def ancestor(self, node_id, level):
+        """往上找到指定層級的節點（找不到回傳 None）"""
+        node_id = self.nodes[node_id]["parent"]
+        while node_id is not None:
+            if self.nodes[node_id]["level"] == level:
+                return node_id
+            node_id = self.nodes[node_id]["parent"]
+        return None
+
+    def book_of(self, node_id):
+        return _book_of(self.nodes, node_id)
+
+    def neighbors(self, chunk_id, radius=1):
+        """命中分塊前後各 radius 塊（同一本書內，依閱讀順序）"""
+        pos = self.nodes[chunk_id]["pos"]
+        start, end = self.nodes[self.book_of(chunk_id)]["span"]
+        return self.order[max(start, pos - radius):min(end, pos + radius + 1)]
+
+    def section_chunks(self, node_id):
+        """節點（章、節……）下的所有分塊"""
+        start, end = self.nodes[node_id]["span"]
+        return self.order[start:end]
+
+    def collapse(self, chunk_ids, level=None):
+        """依章節合併命中：同一節（或指定層級的同一祖先）只保留排序最前的分塊"""
+        seen = set()
+        kept = []
+        for chunk_id in chunk_ids:
+            group = (self.ancestor(chunk_id, level) if level else None) or self.parent(chunk_id)
+            if group not in seen:
+                seen.add(group)
+                kept.append(chunk_id)
+        return kept
+
+
+def main():
+    with open(KB_DIR / "rag_chunks.json", 'r', encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+    with open(KB_DIR / "index.json", 'r', encoding='utf-8') as f:
+        entries = json.load(f)["entries"]
+    index_path, index = save_hierarchy(chunks, entries, KB_DIR)
+
+    levels = {}
+    for node in index["nodes"].values():
+        levels[node["level"]] = levels.get(node["level"], 0) + 1
+    print(f"✅ 章節階層樹完成")
+    print(f"   - 書籍: {len(index['books'])}")
+    for level in ("part", "preface", "chapter", "paragraph", "section", "subsection", "item", "chunk"):
+        if level in levels:
+            print(f"   - {level}: {levels[level]}")
+    print(f"📄 索引檔案: {index_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+OCR 原始文字檔的讀取層
+以 mmap 映射來源檔，由開頭取樣判斷編碼（UTF-8／UTF-16 BOM、Big5、GBK），
+再以固定大小的視窗在行界切開、逐窗解碼與清理，不必一次讀入整個檔案；
+亂碼符號、控制字元與 tab 以預先建好的 str.translate 對照表處理，空白正規化合併為一個正則，
+視窗尾端的空白暫留到下一窗，結果與整份清理相同
+
+掃描的命理古書常是 Big5（台灣）或 GBK（大陸）輸出，原本以 UTF-8 開啟會直接失敗
+
+用法：
+    python ingest.py 八字/子平真詮.txt     # 顯示編碼與清理後字數
+    python ingest.py --bench               # 與整份讀入 + 多次 re.sub 比較速度與峰值記憶體
+"""
+import re
+import sys
+import mmap
+import time
+import codecs
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+from ocr_quality import iter_pages
+from boilerplate import running_heads, page_stripper
+
+KB_DIR = Path(__file__).resolve().parent
+
+SNIFF_BYTES = 64 * 1024
+WINDOW_BYTES = 4 * 1024 * 1024
+
+# 兩種傳統編碼都會把 GBK／Big5 位元組解成「合法」的字，以常用字命中率判斷哪一種才對：
+# 虛字、干支五行在繁簡兩種寫法相同，再加上繁簡不同的常用字兩種寫法
+COMMON_CHARS = frozenset(
+    "之不以而其者也人有一是在日月年生五行金木水火土天地中大上下此如所"
+    "甲乙丙丁戊己庚辛壬癸子丑寅卯辰巳午未申酉戌亥"
+    "為为於于時时命運运陰阴陽阳則则見见與与說说財财官殺杀"
+)
+LEGACY_ENCODINGS = ("cp950", "gb18030")
+BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+# 常見的 OCR 亂碼符號與不可打印字元（含換頁符號，分頁須在清理前完成）
+JUNK_CHARS = "﹐﹒﹔﹕﹖﹗﹛﹜﹝﹞﹟﹠﹡﹢﹣﹤﹥﹦﹨﹩﹪﹫"
+CONTROL_CHARS = "".join(chr(c) for c in [*range(0x00, 0x09), 0x0b, 0x0c, *range(0x0e, 0x20), *range(0x7f, 0xa0)])
+CLEAN_TABLE = str.maketrans({"\t": " ", **{ch: None for ch in JUNK_CHARS + CONTROL_CHARS}})
+# 非 ASCII 文字整段 translate 會逐字查表（比四次 re.sub 還慢），
+# 改以對照表的鍵組成字元類別，只把命中的片段交給 translate
+DIRTY_RE = re.compile("[" + re.escape("".join(map(chr, CLEAN_TABLE))) + "]+")
+# 連續空白併成一個、三個以上換行併成兩個（未命中的群組以空字串代入）
+WHITESPACE_RE = re.compile(r"( ) +|(\n\n)\n+")
+
+
+def sniff_encoding(sample):
+    """由開頭的位元組判斷編碼：BOM → UTF-8 → Big5／GBK 中常用字命中率較高者"""
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    try:
+        # 取樣可能切在多位元組字元中間，以遞增解碼器略過尾端不完整的部分
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+
+    def score(encoding):
+        text = sample.decode(encoding, errors="replace")
+        cjk = sum(1 for ch in text if "一" <= ch <= "鿿")
+        common = sum(1 for ch in text if ch in COMMON_CHARS)
+        return (common - 10 * text.count("�")) / max(cjk, 1)
+
+    return max(LEGACY_ENCODINGS, key=score)
+
+
+class SourceFile:
+    """以 mmap 映射的來源檔；iter_windows 在行界切開並逐窗解碼（換行統一為 \\n）"""
+
+    def __init__(self, path, window_bytes=WINDOW_BYTES, encoding=None):
+        self.path = Path(path)
+        self.window_bytes = window_bytes
+        self.file = open(self.path, 'rb')
+        size = self.path.stat().st_size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.encoding = encoding or sniff_encoding(self.data[:SNIFF_BYTES])
+        self.replaced = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def has_form_feed(self):
+        return self.data.find(b"\f") != -1
+
+    def iter_windows(self):
+        """逐窗回傳解碼後的文字；無法解碼的位元組以 U+FFFD 取代並計入 replaced"""
+        data, size = self.data, len(self.data)
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors="replace")
+        self.replaced = 0
+        pending_cr = ""
+        pos = 0
+        while pos < size:
+            end = min(pos + self.window_bytes, size)
+            if end < size:
+                newline = data.rfind(b"\n", pos, end)
+                if newline != -1:
+                    end = newline + 1
+            text = pending_cr + decoder.decode(data[pos:end], final=end == size)
+            pos = end
+            # \r\n 被視窗切開時，\r 留到下一窗再處理
+            pending_cr = ""
+            if text.endswith("\r") and pos < size:
+                text, pending_cr = text[:-1], "\r"
+            if "\r" in text:
+                text = text.replace("\r\n", "\n").replace("\r", "\n")
+            self.replaced += text.count("�")
+            yield text
+
+    def iter_lines(self):
+        """逐行回傳（保留行尾；與 str.splitlines 相同，換頁符號也視為行界）"""
+        for window in self.iter_windows():
+            yield from window.splitlines(keepends=True)
+
+
+def _translate_run(match):
+    return match.group().translate(CLEAN_TABLE)
+
+
+class OCRCleaner:
+    """逐窗清理 OCR 文字：亂碼與控制字元以對照表刪除、tab 換成空白，空白再以一個正則正規化
+
+    尾端的空白暫留到下一窗，跨視窗的連續空白、換行與整份清理結果相同；
+    第一段輸出去掉開頭空白、結束時丟掉尾端空白（等同 str.strip）
+    """
+
+    def __init__(self):
+        self.carry = ""
+        self.started = False
+
+    def feed(self, text):
+        text = self.carry + DIRTY_RE.sub(_translate_run, text)
+        body = text.rstrip()
+        self.carry = text[len(body):]
+        body = WHITESPACE_RE.sub(r"\1\2", body)
+        if not self.started:
+            body = body.lstrip()
+            self.started = bool(body)
+        return body
+
+    def clean(self, text):
+        """一次清理整份文字"""
+        return self.feed(text)
+
+
+def iter_clean_text(source, strip_furniture=True):
+    """逐窗回傳清理後的文字；有換頁符號時先逐頁刪除頁首／頁尾（兩次掃描，記憶體只保留一頁）"""
+    cleaner = OCRCleaner()
+    if strip_furniture and source.has_form_feed():
+        strip = page_stripper(running_heads(iter_pages(source.iter_lines())))
+        pieces = (strip(page) for page in iter_pages(source.iter_lines()))
+    else:
+        pieces = source.iter_windows()
+    for piece in pieces:
+        cleaned = cleaner.feed(piece)
+        if cleaned:
+            yield cleaned
+
+
+def iter_clean_lines(source, strip_furniture=True):
+    """逐行回傳清理後的文字（除最後一行外都帶 "\n"），合起來與 read_source 的全文相同；
+    記憶體只保留一個視窗，供邊讀邊評分、切章節的 process_book 使用"""
+    tail = ""
+    for piece in iter_clean_text(source, strip_furniture):
+        lines = (tail + piece).split("\n")
+        tail = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    yield tail
+
+
+def read_source(path, strip_furniture=True, window_bytes=WINDOW_BYTES):
+    """讀入並清理一本 OCR 文字檔，回傳 (清理後文字, 編碼)"""
+    with SourceFile(path, window_bytes) as source:
+        text = "".join(iter_clean_text(source, strip_furniture))
+        return text, source.encoding
+
+
+def _legacy_read(path):
+    """對照組：整份讀入後依序 strip_page_furniture 與四次 re.sub"""
+    from boilerplate import strip_page_furniture
+
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    text = strip_page_furniture(text)
+    text = re.sub(r'[﹐﹒﹔﹕﹖﹗﹛﹜﹝﹞﹟﹠﹡﹢﹣﹤﹥﹦﹨﹩﹪﹫]', '', text)
+    text = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]', '', text)
+    text = re.sub(r'[ \t]+', ' ', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    return text.strip()
+
+
+def benchmark(size="32MB", seed=0):
+    """合成 OCR 文字檔：整份讀入 vs mmap 逐窗讀取的速度與峰值記憶體，並確認結果一致；另測 Big5／GBK 判斷"""
+    from synth_corpus import SyntheticCorpus, parse_size
+
+    def measure(fn):
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        del result
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return elapsed, peak
+
+    def stream_only(path):
+        with SourceFile(path) as source:
+            return sum(len(piece) for piece in iter_clean_text(source))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = SyntheticCorpus(seed=seed).write_book(Path(workdir) / "synth.txt", parse_size(size))
+        mb = path.stat().st_size / (1 << 20)
+        with SourceFile(path) as source:
+            form_feed = source.has_form_feed()
+        same = _legacy_read(path) == read_source(path)[0]
+
+        print(f"📊 {mb:.1f} MB 合成 OCR 文字（{'有' if form_feed else '無'}換頁符號）")
+        for label, fn in (("整份讀入 + re.sub", lambda: _legacy_read(path)),
+                          ("mmap 逐窗", lambda: read_source(path)[0]),
+                          ("逐窗、不組回全文", lambda: stream_only(path))):
+            elapsed, peak = measure(fn)
+            print(f"   - {label:<16} {mb / elapsed:7.1f} MB/s  峰值 {peak / (1 << 20):7.1f} MB")
+        print(f"   - 結果{'一致' if same else '不一致'}")
+
+        with open(path, 'r', encoding='utf-8') as f:
+            sample = f.read(200000)
+        for encoding in ("cp950", "gb18030"):
+            legacy = Path(workdir) / f"synth.{encoding}.txt"
+            # 合成語料為繁體，GBK 版先轉成 GB18030 可編碼的文字（繁體字在 GB18030 也有碼位）
+            legacy.write_bytes(sample.encode(encoding, errors="ignore"))
+            text, detected = read_source(legacy)
+            print(f"   - {encoding} 檔案 → 判斷為 {detected}，清理後 {len(text):,} 字")
+
+
+def main():
+    if "--bench" in sys.argv:
+        benchmark()
+        return
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return
+
+    path = Path(sys.argv[1])
+    if not path.exists():
+        # 相對路徑以 process_books_v2 的來源目錄為準
+        from process_books_v2 import SOURCE_DIR
+        path = SOURCE_DIR / path
+    t0 = time.perf_counter()
+    with SourceFile(path) as source:
+        text = "".join(iter_clean_text(source))
+        print(f"✅ {path.name}")
+        print(f"   - 編碼: {source.encoding}（無法解碼的字元 {source.replaced}）")
+    print(f"   - 清理後: {len(text):,} 字（{time.perf_counter() - t0:.2f} 秒）")
+
+
+if __name__ == "__main__":
+    main()
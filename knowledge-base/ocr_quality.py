@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+OCR 品質評分
+計算每頁、每個分塊的亂碼比例、中文字比例、行長熵與術語命中率，
+作為處理流程的一道關卡：品質差的分塊隔離到 quarantine.json，
+品質普通的分塊以 ocr_quality 降權
+
+用法：
+    python ocr_quality.py                 # 評分並過濾 rag_chunks.json 的分塊，重建各索引
+    python ocr_quality.py 檔案或目錄 ...   # 平行評分原始 OCR 文字檔（書籍分級）
+"""
+import sys
+import json
+import math
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+KB_DIR = Path(__file__).resolve().parent
+
+# 低於此分數的分塊隔離，不進入索引
+QUARANTINE_BELOW = 0.45
+# 低於此分數的分塊保留但降權
+DOWNWEIGHT_BELOW = 0.7
+# 整本書平均低於此分數時跳過整本書
+BOOK_REJECT_BELOW = 0.5
+
+# 沒有換頁符號時，每頁約多少字
+PAGE_CHARS = 2000
+
+# 術語命中率達到此值（每千個中文字）即視為滿分
+DICT_HITS_TARGET = 8.0
+
+# 行長熵的分桶數（每 5 字一桶）
+LINE_BUCKETS = 16
+
+# 命理術語與古文常用詞，用來估計文字是否「讀得通」
+DICTIONARY_TERMS = [
+    "天干", "地支", "陰陽", "五行", "相生", "相剋", "生克", "印綬", "比肩", "劫財",
+    "食神", "傷官", "偏財", "正財", "偏官", "正官", "七殺", "格局", "用神", "喜神",
+    "忌神", "日主", "月令", "大運", "流年", "紫微", "天府", "太陽", "太陰", "武曲",
+    "天同", "廉貞", "天機", "貪狼", "巨門", "天相", "天梁", "破軍", "化祿", "化權",
+    "化科", "化忌", "四化", "命宮", "財帛", "官祿", "太極", "兩儀", "四象", "八卦",
+    "六十四卦", "卦辭", "爻辭", "動爻", "變卦",
+    "之", "而", "也", "者", "其", "以", "為", "於", "不", "有", "則", "故", "所", "此",
+]
+
+# 字元分類：c=中文字、p=標點、a=英數、s=空白；不在表內的字元視為亂碼
+_CATEGORY = {}
+for _cp in range(0x3400, 0x4DC0):
+    _CATEGORY[_cp] = "c"
+for _cp in range(0x4E00, 0xA000):
+    _CATEGORY[_cp] = "c"
+for _cp in range(0xF900, 0xFB00):
+    _CATEGORY[_cp] = "c"
+for _cp in range(0x20, 0x7F):
+    _CATEGORY[_cp] = "a" if chr(_cp).isalnum() else "p"
+for _ch in "，。、；：？！「」『』（）《》〈〉【】〔〕“”‘’…—─～·‧．／－＋＝％×→○〇◎　":
+    _CATEGORY[ord(_ch)] = "p"
+for _cp in list(range(0x2630, 0x2638)) + list(range(0x268A, 0x2690)):  # 卦爻符號 ☰ ⚊
+    _CATEGORY[_cp] = "p"
+for _cp in range(0x2460, 0x2474):  # 圈號數字 ①
+    _CATEGORY[_cp] = "p"
+for _ch in " \t\n\r\f":
+    _CATEGORY[ord(_ch)] = "s"
+for _cp in range(0xFF10, 0xFF1A):  # 全形數字
+    _CATEGORY[_cp] = "a"
+for _cp in range(0xFF21, 0xFF5B):  # 全形英文
+    _CATEGORY[_cp] = "a"
+CATEGORY_TABLE = str.maketrans(_CATEGORY)
+
+
+def _dictionary_hits(text):
+    """術語出現次數（單字詞依次數計）"""
+    return sum(text.count(term) for term in DICTIONARY_TERMS)
+
+
+def line_length_entropy(text):
+    """行長分布的正規化熵（0-1），OCR 斷行錯亂時偏高"""
+    histogram = [0] * LINE_BUCKETS
+    total = 0
+    for line in text.split("\n"):
+        length = len(line.strip())
+        if length:
+            histogram[min(length // 5, LINE_BUCKETS - 1)] += 1
+            total += 1
+    if total < 2:
+        return 0.0
+    entropy = -sum((n / total) * math.log2(n / total) for n in histogram if n)
+    return entropy / math.log2(LINE_BUCKETS)
+
+
+def score_text(text):
+    """計算一段文字的品質指標與綜合分數（0-1）"""
+    # 一次 translate 把每個字元換成分類代碼，再以 count 統計
+    categories = text.translate(CATEGORY_TABLE)
+    spaces = categories.count("s")
+    visible = len(categories) - spaces
+    if visible == 0:
+        return {"garbage_ratio": 0.0, "cjk_ratio": 0.0, "line_entropy": 0.0,
+                "dict_hit_rate": 0.0, "score": 0.0}
+
+    cjk = categories.count("c")
+    known = cjk + categories.count("p") + categories.count("a")
+    garbage_ratio = (visible - known) / visible
+    cjk_ratio = cjk / visible
+    entropy = line_length_entropy(text)
+    dict_hit_rate = _dictionary_hits(text) * 1000 / cjk if cjk else 0.0
+
+    score = (
+        0.4 * (1 - min(1.0, garbage_ratio / 0.1))
+        + 0.3 * cjk_ratio
+        + 0.15 * (1 - entropy)
+        + 0.15 * min(1.0, dict_hit_rate / DICT_HITS_TARGET)
+    )
+    return {
+        "garbage_ratio": round(garbage_ratio, 4),
+        "cjk_ratio": round(cjk_ratio, 4),
+        "line_entropy": round(entropy, 4),
+        "dict_hit_rate": round(dict_hit_rate, 2),
+        "score": round(score, 3),
+    }
+
+
+def iter_pages(lines, page_chars=PAGE_CHARS):
+    """從檔案（或行的序列）逐頁讀出文字：有換頁符號時以其分頁，否則在行界約每 page_chars 字分頁"""
+    page = []
+    length = 0
+    for line in lines:
+        if "\f" in line:
+            head, _, tail = line.partition("\f")
+            page.append(head)
+            yield "".join(page)
+            page, length = [tail], len(tail)
+            continue
+        page.append(line)
+        length += len(line)
+        if length >= page_chars:
+            yield "".join(page)
+            page, length = [], 0
+    if page:
+        yield "".join(page)
+
+
+def score_pages(pages):
+    """彙總逐頁分數為整本書的報告"""
+    return _book_report([score_text(page)["score"] for page in pages])
+
+
+def _book_report(page_scores):
+    """逐頁分數 → 整本書的報告"""
+    mean = sum(page_scores) / len(page_scores) if page_scores else 0.0
+    return {
+        "pages": len(page_scores),
+        "score": round(mean, 3),
+        "bad_pages": sum(1 for s in page_scores if s < QUARANTINE_BELOW),
+        "rejected": mean < BOOK_REJECT_BELOW,
+    }
+
+
+def score_book(text):
+    """評分已讀入記憶體的整本書"""
+    return score_pages(iter_pages(text.splitlines(keepends=True)))
+
+
+class PageScorer:
+    """邊讀邊評分：逐行 feed（原樣回傳，可串在其他逐行處理前面），每滿一頁評分一次，
+    分頁與 score_book 相同，整本文字不必留在記憶體；清理過的文字沒有換頁符號，只依字數分頁"""
+
+    def __init__(self, page_chars=PAGE_CHARS):
+        self.page_chars = page_chars
+        self.page = []
+        self.length = 0
+        self.page_scores = []
+
+    def feed(self, line):
+        for part in line.splitlines(keepends=True):
+            self.page.append(part)
+            self.length += len(part)
+            if self.length >= self.page_chars:
+                self._flush()
+        return line
+
+    def _flush(self):
+        self.page_scores.append(score_text("".join(self.page))["score"])
+        self.page, self.length = [], 0
+
+    def report(self):
+        if self.page:
+            self._flush()
+        return _book_report(self.page_scores)
+
+
+def score_file(path):
+    """逐頁評分一個 OCR 文字檔（mmap 逐窗解碼，自動判斷編碼），記憶體只保留一頁"""
+    from ingest import SourceFile
+
+    with SourceFile(path) as source:
+        return {"file": str(path), "encoding": source.encoding,
+                **score_pages(iter_pages(source.iter_lines()))}
+
+
+def score_files(paths, workers=None):
+    """以多個行程平行評分多個檔案"""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(score_file, paths))
+
+
+def gate_chunks(chunks):
+    """品質關卡：回傳 (保留的分塊, 隔離的分塊)
+
+    保留的分塊加上 ocr_quality 欄位；低於 DOWNWEIGHT_BELOW 的分塊在檢索時降權
+    """
+    kept, quarantined = [], []
+    for chunk in chunks:
+        quality = score_text(chunk["text"])
+        if quality["score"] < QUARANTINE_BELOW:
+            quarantined.append({**chunk, "ocr": quality})
+            continue
+        chunk["ocr_quality"] = quality["score"]
+        kept.append(chunk)
+    return kept, quarantined
+
+
+def save_quarantine(quarantined, output_dir):
+    """把隔離的分塊寫入 quarantine.json（冷資料，不進入檢索）"""
+    quarantine_path = Path(output_dir) / "quarantine.json"
+    with open(quarantine_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "version": "1.0",
+            "threshold": QUARANTINE_BELOW,
+            "total_chunks": len(quarantined),
+            "chunks": quarantined
+        }, f, ensure_ascii=False, indent=2)
+    return quarantine_path
+
+
+def _collect_files(args):
+    """展開命令列參數中的目錄為 .txt 檔"""
+    files = []
+    for arg in args:
+        path = Path(arg)
+        if path.is_dir():
+            files.extend(sorted(path.rglob("*.txt")))
+        else:
+            files.append(path)
+    return files
+
+
+def main():
+    if len(sys.argv) > 1:
+        files = _collect_files(sys.argv[1:])
+        print(f"🔍 平行評分 {len(files)} 個 OCR 檔案...\n")
+        for report in sorted(score_files(files), key=lambda r: r["score"]):
+            mark = "❌" if report["rejected"] else "✅"
+            print(f"  {mark} {report['score']:.3f}  {report['pages']:>5} 頁"
+                  f"  壞頁 {report['bad_pages']:>4}  {report['file']}")
+        return
+
+    from chunk_stream import ChunkFile
+    from rebuild import rebuild_outputs
+
+    chunks_path = KB_DIR / "rag_chunks.json"
+    with open(chunks_path, 'r', encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+
+    kept, quarantined = gate_chunks(chunks)
+    # ocr_quality 併入 prior，隔離的分塊從各索引移除：重算欄位並重建所有依賴分塊的產物
+    rebuild_outputs(kept, KB_DIR, ChunkFile(KB_DIR / "index.json", key="entries"))
+    # 之前已隔離的分塊不在 rag_chunks.json 裡，保留下來（同 id 以這次的為準）
+    quarantine_path = KB_DIR / "quarantine.json"
+    if quarantine_path.exists():
+        new_ids = {chunk["id"] for chunk in quarantined}
+        with open(quarantine_path, 'r', encoding='utf-8') as f:
+            quarantined = [c for c in json.load(f)["chunks"] if c["id"] not in new_ids] + quarantined
+    quarantine_path = save_quarantine(quarantined, KB_DIR)
+
+    downweighted = sum(1 for c in kept if c["ocr_quality"] < DOWNWEIGHT_BELOW)
+    print(f"✅ OCR 品質評分完成")
+    print(f"   - 保留分塊: {len(kept)}（其中降權 {downweighted}）")
+    print(f"   - 隔離分塊: {len(quarantined)}")
+    print(f"📄 RAG 分塊: {chunks_path}")
+    print(f"📄 隔離分塊: {quarantine_path}")
+
+
+if __name__ == "__main__":
+    main()
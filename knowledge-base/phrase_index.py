@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+整個語料的後綴陣列：精確片語查詢與跨書引文連結
+把所有分塊正規化（與 fuzzy_search 相同的混淆表，刪除空白與標點）後以分隔字元串接，
+建立後綴陣列與 LCP 表。查詢片語以二分搜尋取得後綴陣列的區間，O(m log n) 找到所有出現位置；
+LCP 表中相鄰後綴的共同前綴跨越不同著作時，即為一段被引用的文字（如「傷官見官，為禍百端」），
+預先算出每段引文的原典（朝代最早的著作），檢索時可優先採用原典
+
+用法：
+    python phrase_index.py                          # 建立後綴陣列與 quotation_links.json
+    python phrase_index.py 傷官見官為禍百端           # 查詢片語的所有出現位置
+    python phrase_index.py --bench                  # 與逐塊掃描比較
+"""
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+from array import array
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+
+from fuzzy_search import make_table, STRIP_CHARS
+
+KB_DIR = Path(__file__).resolve().parent
+
+# 分塊之間的分隔字元（正規化後的文字不會出現），共同前綴不會跨越分塊
+SEP = "\x00"
+# 建立後綴陣列時先依前幾個字排序，再以倍增法細分仍相同的區段
+INITIAL_PREFIX = 8
+# 跨著作共同文字至少幾個字（正規化後）才算引文
+MIN_QUOTE_CHARS = 8
+# quotation_links.json 中每段引文保留的文字長度
+PASSAGE_TEXT_CHARS = 40
+
+# phrase_index.bin：MAGIC + 正規化語料的 sha256 + 後綴陣列 + LCP 表
+MAGIC = b"KBSA0001"
+DIGEST_SIZE = 32
+
+DYNASTY_ORDER = ("先秦", "漢", "晉", "唐", "宋", "元", "明", "清", "民國", "現代")
+
+
+def work_of(source):
+    """同一著作的不同版本視為同一部書：子平真詮（原本）→ 子平真詮"""
+    return re.sub(r'（.*?）$', '', source)
+
+
+def source_eras():
+    """書名 → 朝代（取自兩個處理流程的書籍設定）"""
+    from process_books_v2 import BOOKS
+    from process_epub import EPUB_BOOKS
+    eras = {book: config["dynasty"] for books in BOOKS.values() for book, config in books.items()}
+    eras.update({config["name"]: config["dynasty"] for config in EPUB_BOOKS.values()})
+    return eras
+
+
+def build_suffix_array(text):
+    """後綴陣列：先依前 INITIAL_PREFIX 個字排序，再以倍增法只細分前綴相同的區段"""
+    n = len(text)
+    k = INITIAL_PREFIX
+    sa = sorted(range(n), key=lambda i: text[i:i + k])
+
+    # rank 為所在區段的起點，未分出先後的區段記在 groups
+    rank = [0] * n
+    groups = []
+    head = 0
+    for idx in range(n):
+        if idx and text[sa[idx]:sa[idx] + k] != text[sa[idx - 1]:sa[idx - 1] + k]:
+            if idx - head > 1:
+                groups.append((head, idx))
+            head = idx
+        rank[sa[idx]] = head
+    if n - head > 1:
+        groups.append((head, n))
+
+    while groups:
+        updates, next_groups = [], []
+        for start, end in groups:
+            keys = {i: (rank[i + k] if i + k < n else -1) for i in sa[start:end]}
+            members = sorted(sa[start:end], key=keys.__getitem__)
+            sa[start:end] = members
+            head, prev = start, keys[members[0]]
+            for offset, i in enumerate(members):
+                if keys[i] != prev:
+                    if start + offset - head > 1:
+                        next_groups.append((head, start + offset))
+                    head, prev = start + offset, keys[i]
+                updates.append((i, head))
+            if end - head > 1:
+                next_groups.append((head, end))
+        # 本輪的鍵都以上一輪的 rank 計算，全部排完才更新
+        for i, head in updates:
+            rank[i] = head
+        groups = next_groups
+        k *= 2
+    return array('I', sa)
+
+
+def build_lcp(text, sa):
+    """Kasai 法：lcp[r] 為 sa[r-1] 與 sa[r] 的共同前綴長度（遇到分隔字元即停止）"""
+    n = len(text)
+    rank = [0] * n
+    for r, i in enumerate(sa):
+        rank[i] = r
+    lcp = array('I', bytes(4 * n))
+    h = 0
+    for i in range(n):
+        r = rank[i]
+        if r == 0:
+            h = 0
+            continue
+        j = sa[r - 1]
+        while i + h < n and j + h < n and text[i + h] == text[j + h] and text[i + h] != SEP:
+            h += 1
+        lcp[r] = h
+        if h:
+            h -= 1
+    return lcp
+
+
+class PhraseIndex:
+    """正規化語料 + 後綴陣列 + LCP 表"""
+
+    def __init__(self, chunks, sa=None, lcp=None):
+        self.chunks = chunks
+        self.table = make_table()
+        texts = [chunk["text"].translate(self.table) for chunk in chunks]
+        self.starts = array('I')
+        pos = 0
+        for text in texts:
+            self.starts.append(pos)
+            pos += len(text) + 1
+        self.text = SEP.join(texts) + SEP
+        self.sa = sa if sa is not None else build_suffix_array(self.text)
+        self.lcp = lcp if lcp is not None else build_lcp(self.text, self.sa)
+
+    @classmethod
+    def load(cls, kb_dir=KB_DIR):
+        """讀取 phrase_index.bin；不存在或與 rag_chunks.json 的正規化語料（sha256）不符時重建"""
+        kb_dir = Path(kb_dir)
+        with open(kb_dir / "rag_chunks.json", 'r', encoding='utf-8') as f:
+            chunks = json.load(f)["chunks"]
+        cache = kb_dir / "phrase_index.bin"
+        if cache.exists():
+            raw = cache.read_bytes()
+            header = len(MAGIC) + DIGEST_SIZE
+            if raw[:len(MAGIC)] == MAGIC and (len(raw) - header) % 8 == 0:
+                data = array('I')
+                data.frombytes(raw[header:])
+                n = len(data) // 2
+                index = cls(chunks, data[:n], data[n:])
+                if len(index.text) == n and index.text_digest() == raw[len(MAGIC):header]:
+                    return index
+        index = cls(chunks)
+        index.save_arrays(kb_dir)
+        return index
+
+    def text_digest(self):
+        return hashlib.sha256(self.text.encode('utf-8')).digest()
+
+    def save_arrays(self, output_dir):
+        path = Path(output_dir) / "phrase_index.bin"
+        path.write_bytes(MAGIC + self.text_digest() + self.sa.tobytes() + self.lcp.tobytes())
+        return path
+
+    def chunk_at(self, pos):
+        """語料位置 → 分塊編號"""
+        return bisect_right(self.starts, pos) - 1
+
+    def suffix_range(self, phrase):
+        """以片語開頭的後綴在後綴陣列中的區間 [lo, hi)"""
+        m = len(phrase)
+        key = lambda i: self.text[i:i + m]
+        lo = bisect_left(self.sa, phrase, key=key)
+        hi = bisect_right(self.sa, phrase, lo=lo, key=key)
+        return lo, hi
+
+    def count(self, phrase):
+        phrase = phrase.translate(self.table)
+        if not phrase:
+            return 0
+        lo, hi = self.suffix_range(phrase)
+        return hi - lo
+
+    def find(self, phrase, category=None, limit=None):
+        """所有出現位置：[{"chunk", "match"}]，依語料順序；match 為原文中的片段（含標點）"""
+        phrase = phrase.translate(self.table)
+        if not phrase:
+            return []
+        lo, hi = self.suffix_range(phrase)
+        hits = []
+        for pos in sorted(self.sa[lo:hi]):
+            idx = self.chunk_at(pos)
+            chunk = self.chunks[idx]
+            if category and chunk["category"] != category:
+                continue
+            start = pos - self.starts[idx]
+            # 正規化文字的位置 → 原文位置（正規化只刪除空白與標點）
+            kept = [i for i, ch in enumerate(chunk["text"]) if ch not in STRIP_CHARS]
+            hits.append({
+                "chunk": chunk,
+                "match": chunk["text"][kept[start]:kept[start + len(phrase) - 1] + 1],
+            })
+            if limit and len(hits) >= limit:
+                break
+        return hits
+
+    def quotation_passages(self, eras, min_length=MIN_QUOTE_CHARS):
+        """跨著作的共同文字：LCP ≥ min_length 的連續後綴為一組，
+        略過組內前一個字全相同的組（只是更長引文的後段），只留出現在兩部以上著作的組
+
+        回傳 [{"text", "length", "primary", "chunks"}]；primary 為朝代最早的著作中的分塊
+        """
+        text, sa, lcp = self.text, self.sa, self.lcp
+        n = len(text)
+        passages = []
+        r = 1
+        while r < n:
+            if lcp[r] < min_length:
+                r += 1
+                continue
+            first, length = r - 1, lcp[r]
+            while r < n and lcp[r] >= min_length:
+                length = min(length, lcp[r])
+                r += 1
+            positions = sa[first:r]
+            before = {text[p - 1] if p else SEP for p in positions}
+            if len(before) == 1 and SEP not in before:
+                continue
+
+            chunk_ids = sorted({self.chunk_at(p) for p in positions})
+            works = {}
+            for idx in chunk_ids:
+                works.setdefault(work_of(self.chunks[idx]["source"]), []).append(idx)
+            if len(works) < 2:
+                continue
+
+            def priority(idx):
+                source = self.chunks[idx]["source"]
+                era = eras.get(source, DYNASTY_ORDER[-1])
+                rank = DYNASTY_ORDER.index(era) if era in DYNASTY_ORDER else len(DYNASTY_ORDER)
+                return rank, -len(works[work_of(source)]), idx
+
+            primary = min(chunk_ids, key=priority)
+            passages.append({
+                "text": text[positions[0]:positions[0] + min(length, PASSAGE_TEXT_CHARS)],
+                "length": length,
+                "primary": self.chunks[primary]["id"],
+                "chunks": [self.chunks[idx]["id"] for idx in chunk_ids],
+            })
+        passages.sort(key=lambda p: -p["length"])
+        return passages
+
+
+def build_quotation_links(index, eras=None):
+    """引文連結：passages 與 primary_of（引用分塊 → 原典分塊）"""
+    passages = index.quotation_passages(eras if eras is not None else source_eras())
+    source_of = {chunk["id"]: chunk["source"] for chunk in index.chunks}
+    primary_of = {}
+    for passage in passages:
+        primary_work = work_of(source_of[passage["primary"]])
+        for chunk_id in passage["chunks"]:
+            if work_of(source_of[chunk_id]) != primary_work:
+                primaries = primary_of.setdefault(chunk_id, [])
+                if passage["primary"] not in primaries:
+                    primaries.append(passage["primary"])
+    return {
+        "version": "1.0",
+        "min_length": MIN_QUOTE_CHARS,
+        "total_passages": len(passages),
+        "passages": passages,
+        "primary_of": primary_of,
+    }
+
+
+# 後綴陣列與引文連結用到的分塊欄位
+INDEX_FIELDS = ("id", "source", "category", "text")
+
+
+def save_phrase_index(chunks, output_dir, eras=None):
+    """建立後綴陣列（phrase_index.bin，可重建的快取）與引文連結（quotation_links.json）
+
+    chunks 可為串流的分塊來源，只保留 INDEX_FIELDS
+    """
+    index = PhraseIndex([{field: chunk[field] for field in INDEX_FIELDS} for chunk in chunks])
+    index.save_arrays(output_dir)
+    links = build_quotation_links(index, eras)
+    links_path = Path(output_dir) / "quotation_links.json"
+    with open(links_path, 'w', encoding='utf-8') as f:
+        json.dump(links, f, ensure_ascii=False, indent=2)
+    return links_path, links
+
+
+def benchmark(queries=200, seed=5):
+    """隨機取 4-16 字的原文片語，比較後綴陣列查詢與逐塊 in 掃描"""
+    index = PhraseIndex.load()
+    rng = random.Random(seed)
+    texts = [chunk["text"].translate(index.table) for chunk in index.chunks]
+    phrases = []
+    while len(phrases) < queries:
+        text = rng.choice(texts)
+        m = rng.randint(4, 16)
+        if len(text) > m:
+            start = rng.randrange(len(text) - m)
+            phrases.append(text[start:start + m])
+
+    t0 = time.perf_counter()
+    found = [index.count(p) for p in phrases]
+    indexed = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    scanned = [sum(text.count(p) for text in texts) for p in phrases]
+    scan = time.perf_counter() - t0
+
+    print(f"📊 {queries} 筆片語查詢（語料 {len(index.text):,} 字）")
+    print(f"   - 後綴陣列: 每筆 {indexed / queries * 1e6:.1f} µs")
+    print(f"   - 逐塊掃描: 每筆 {scan / queries * 1e6:.1f} µs")
+    print(f"   - 結果{'一致' if found == scanned else '不一致'}")
+
+
+def main():
+    if "--bench" in sys.argv:
+        benchmark()
+        return
+
+    if len(sys.argv) > 1:
+        index = PhraseIndex.load()
+        for phrase in sys.argv[1:]:
+            hits = index.find(phrase)
+            print(f"🔍 {phrase}：{len(hits)} 處")
+            for hit in hits:
+                print(f"   - {hit['chunk']['id']}  {hit['match']}")
+        return
+
+    with open(KB_DIR / "rag_chunks.json", 'r', encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+    t0 = time.perf_counter()
+    links_path, links = save_phrase_index(chunks, KB_DIR)
+    print(f"✅ 後綴陣列與引文連結完成（{time.perf_counter() - t0:.1f} 秒）")
+    print(f"   - 跨書引文: {links['total_passages']} 段")
+    print(f"   - 引用原典的分塊: {len(links['primary_of'])}")
+    print(f"📄 引文連結: {links_path}")
+
+
+if __name__ == "__main__":
+    main()
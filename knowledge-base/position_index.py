@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+術語位置索引與鄰近度計分
+「甲 + 子 + 食神」這類命盤查詢，三個詞在同一句裡出現才有意義，散落在一千字的不同段落則否；
+原本的計分只看出現次數與是否在開頭 100 字，不管彼此距離。
+
+建置時記錄每個術語（分塊 keywords 與同義詞表的所有寫法）在每個分塊中的出現位置，
+倒排表依術語存放：分塊編號差值、出現次數、位置差值，皆以 varint 編碼。
+查詢時只解碼查詢詞的倒排表，從位置直接算出：
+  - window：涵蓋所有命中詞的最短視窗（k 路合併掃描）
+  - pairs：每一對命中詞的最近距離
+不讀取分塊文字；分類與 prior 也存在索引中。
+
+分數 = Σ min(出現次數, 3) + PROXIMITY_BONUS ×（命中詞數 - 1）× 鄰近度，再乘上 prior；
+鄰近度 = PROXIMITY_SCALE ÷（PROXIMITY_SCALE + 詞與詞之間的字數），相連時為 1。
+
+用法：
+    python position_index.py                  # 建立 position_index.bin
+    python position_index.py 甲 子 食神        # 以最短視窗查詢（--pairs 改用兩兩距離）
+    python position_index.py --bench          # 索引大小、查詢延遲，與逐塊掃描文字比較
+"""
+import sys
+import json
+import time
+import heapq
+import random
+import struct
+from array import array
+from itertools import combinations
+from pathlib import Path
+
+from aho_corasick import AhoCorasick
+from shared_corpus import _source_stamp
+from synonyms import TEXT_FORMS, text_forms
+
+KB_DIR = Path(__file__).resolve().parent
+
+MAGIC = b"KBPOS001"
+HEADER = struct.Struct("<8sI")
+TF_CAP = 3
+PROXIMITY_BONUS = 6
+# 兩詞之間相隔此字數時，鄰近度為 0.5
+PROXIMITY_SCALE = 20
+
+
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varints(data):
+    """bytes → 所有 varint 組成的 list"""
+    values, value, shift = [], 0, 0
+    for byte in data:
+        if byte & 0x80:
+            value |= (byte & 0x7F) << shift
+            shift += 7
+        else:
+            values.append(value | (byte << shift))
+            value, shift = 0, 0
+    return values
+
+
+def build_position_index(chunks):
+    """回傳 (中繼資料, 倒排表位元組)；術語表與 chapter_index 相同：keywords 與同義詞表的所有寫法"""
+    vocabulary = sorted({kw for chunk in chunks for kw in chunk.get("keywords", [])} | set(TEXT_FORMS))
+    matcher = AhoCorasick({term: term for term in vocabulary})
+
+    postings = {term: bytearray() for term in vocabulary}
+    last_chunk = {term: -1 for term in vocabulary}
+    df = dict.fromkeys(vocabulary, 0)
+    total_positions = 0
+    for idx, chunk in enumerate(chunks):
+        occurrences = {}
+        for start, _, term in matcher.iter_all(chunk["text"]):
+            occurrences.setdefault(term, []).append(start)
+        for term, positions in occurrences.items():
+            out = postings[term]
+            encode_varint(idx - last_chunk[term], out)
+            encode_varint(len(positions), out)
+            previous = 0
+            for pos in positions:
+                encode_varint(pos - previous, out)
+                previous = pos
+            last_chunk[term] = idx
+            df[term] += 1
+            total_positions += len(positions)
+
+    blob, terms = bytearray(), {}
+    for term in vocabulary:
+        if postings[term]:
+            terms[term] = [len(blob), len(postings[term]), df[term]]
+            blob += postings[term]
+
+    categories = sorted({chunk["category"] for chunk in chunks})
+    code = {category: i for i, category in enumerate(categories)}
+    meta = {
+        "version": "1.0",
+        "ids": [chunk["id"] for chunk in chunks],
+        "categories": categories,
+        "category_codes": [code[chunk["category"]] for chunk in chunks],
+        "priors": [chunk.get("prior", 1.0) for chunk in chunks],
+        "terms": terms,
+        "positions": total_positions,
+    }
+    return meta, bytes(blob)
+
+
+def save_position_index(chunks, output_dir):
+    """建立並儲存 position_index.bin（記錄 rag_chunks.json 的大小與修改時間，不符時 load 會重建）"""
+    output_dir = Path(output_dir)
+    meta, blob = build_position_index(chunks)
+    chunks_path = output_dir / "rag_chunks.json"
+    meta["source"] = _source_stamp(chunks_path) if chunks_path.exists() else None
+    raw = json.dumps(meta, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    index_path = output_dir / "position_index.bin"
+    with open(index_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(raw)))
+        f.write(raw)
+        f.write(blob)
+    return index_path, meta
+
+
+def _min_window(lists):
+    """k 個依起點排序的 (起點, 終點) 列表：涵蓋每個列表至少一次的最短視窗，回傳詞與詞之間的字數"""
+    heap = [(occ[0][0], i, 0) for i, occ in enumerate(lists)]
+    heapq.heapify(heap)
+    lengths = [occ[0][1] - occ[0][0] for occ in lists]
+    end = max(occ[0][1] for occ in lists)
+    best_span, best_gap = None, 0
+    while True:
+        start, i, j = heap[0]
+        span = end - start
+        if best_span is None or span < best_span:
+            best_span, best_gap = span, max(span - sum(lengths), 0)
+        if j + 1 == len(lists[i]):
+            return best_gap
+        nxt_start, nxt_end = lists[i][j + 1]
+        heapq.heapreplace(heap, (nxt_start, i, j + 1))
+        lengths[i] = nxt_end - nxt_start
+        end = max(end, nxt_end)
+
+
+def _pair_gap(a, b):
+    """兩個依起點排序的出現列表之間的最近距離（重疊或相連為 0）"""
+    i = j = 0
+    best = None
+    while i < len(a) and j < len(b):
+        gap = max(a[i][0], b[j][0]) - min(a[i][1], b[j][1])
+        gap = max(gap, 0)
+        if best is None or gap < best:
+            best = gap
+            if not best:
+                return 0
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return best
+
+
+def closeness(gap):
+    return PROXIMITY_SCALE / (PROXIMITY_SCALE + gap)
+
+
+def proximity_score(lists, mode="window"):
+    """各查詢詞在分塊中的出現列表（未出現為空）→ 未乘 prior 的分數"""
+    present = [occ for occ in lists if occ]
+    score = sum(min(len(occ), TF_CAP) for occ in present)
+    if len(present) < 2:
+        return score
+    if mode == "pairs":
+        pairs = list(combinations(present, 2))
+        nearness = sum(closeness(_pair_gap(a, b)) for a, b in pairs) / len(pairs)
+    else:
+        nearness = closeness(_min_window(present))
+    return score + PROXIMITY_BONUS * (len(present) - 1) * nearness
+
+
+def text_occurrences(text, keyword, category=None):
+    """從文字取得關鍵字（含 category 中的同義寫法）的出現列表；逐塊掃描的對照組"""
+    occ = []
+    for form in text_forms(keyword, category):
+        pos = text.find(form)
+        while pos != -1:
+            occ.append((pos, pos + len(form)))
+            pos = text.find(form, pos + 1)
+    return sorted(occ)
+
+
+class PositionIndex:
+    """讀取 position_index.bin，以位置倒排表計算鄰近度分數"""
+
+    def __init__(self, path):
+        data = Path(path).read_bytes()
+        magic, meta_len = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f"{path} 不是 position_index.bin 格式")
+        self.meta = json.loads(data[HEADER.size:HEADER.size + meta_len])
+        self.blob = memoryview(data)[HEADER.size + meta_len:]
+        self.ids = self.meta["ids"]
+        self.priors = self.meta["priors"]
+        self.category_codes = array('B', self.meta["category_codes"])
+        self.category_of = {category: i for i, category in enumerate(self.meta["categories"])}
+        self.terms = self.meta["terms"]
+        # 解碼後的倒排表：術語 → {分塊編號: [(起點, 終點), ...]}
+        self.cache = {}
+
+    @classmethod
+    def load(cls, kb_dir=KB_DIR):
+        """讀取 position_index.bin；不存在或與 rag_chunks.json 不符時重建"""
+        kb_dir = Path(kb_dir)
+        path = kb_dir / "position_index.bin"
+        if path.exists():
+            index = cls(path)
+            if index.meta["source"] == _source_stamp(kb_dir / "rag_chunks.json"):
+                return index
+        with open(kb_dir / "rag_chunks.json", 'r', encoding='utf-8') as f:
+            chunks = json.load(f)["chunks"]
+        save_position_index(chunks, kb_dir)
+        return cls(path)
+
+    def postings(self, term):
+        """單一寫法的倒排表"""
+        if term in self.cache:
+            return self.cache[term]
+        entry = self.terms.get(term)
+        result = {}
+        if entry:
+            offset, length, _ = entry
+            values = decode_varints(self.blob[offset:offset + length])
+            idx, k, size = -1, 0, len(term)
+            while k < len(values):
+                idx += values[k]
+                tf = values[k + 1]
+                pos, occ = 0, []
+                for delta in values[k + 2:k + 2 + tf]:
+                    pos += delta
+                    occ.append((pos, pos + size))
+                result[idx] = occ
+                k += 2 + tf
+        self.cache[term] = result
+        return result
+
+    def occurrences(self, keyword, category=None):
+        """關鍵字所有寫法（依 category 的概念）合併後的倒排表：分塊編號 → 依起點排序的出現列表"""
+        forms = [form for form in text_forms(keyword, category) if form in self.terms]
+        if len(forms) == 1:
+            return self.postings(forms[0])
+        merged = {}
+        for form in forms:
+            for idx, occ in self.postings(form).items():
+                merged.setdefault(idx, []).extend(occ)
+        for occ in merged.values():
+            occ.sort()
+        return merged
+
+    def chunk_occurrences(self, keyword, category=None):
+        """查詢用的倒排表：每個分塊取其分類的寫法（紫微分塊的七殺含七殺星，八字分塊的含偏官）"""
+        if category:
+            return self.occurrences(keyword, category)
+        merged = {}
+        for name, code in self.category_of.items():
+            for idx, occ in self.occurrences(keyword, name).items():
+                if self.category_codes[idx] == code:
+                    merged[idx] = occ
+        return merged
+
+    def missing(self, keywords):
+        """不在術語表中（無法以位置計分）的關鍵字"""
+        return [kw for kw in keywords if not any(form in self.terms for form in text_forms(kw))]
+
+    def search(self, keywords, category=None, limit=5, mode="window"):
+        """回傳前 limit 名 (分塊 id, 分數)；同分時較前面的分塊優先"""
+        per_term = [self.chunk_occurrences(kw, category) for kw in keywords]
+        candidates = set().union(*per_term) if per_term else set()
+        code = self.category_of.get(category, -1) if category else None
+        heap = []
+        for idx in candidates:
+            if code is not None and self.category_codes[idx] != code:
+                continue
+            score = proximity_score([postings.get(idx, ()) for postings in per_term], mode) * self.priors[idx]
+            item = (score, -idx)
+            if len(heap) < limit:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+        return [(self.ids[-neg_idx], score) for score, neg_idx in sorted(heap, reverse=True)]
+
+
+def scan_search(chunks, keywords, category=None, limit=5, mode="window"):
+    """對照組：逐塊掃描文字取得出現位置，計分與 PositionIndex.search 相同"""
+    heap = []
+    for idx, chunk in enumerate(chunks):
+        if category and chunk["category"] != category:
+            continue
+        lists = [text_occurrences(chunk["text"], kw, chunk["category"]) for kw in keywords]
+        if not any(lists):
+            continue
+        score = proximity_score(lists, mode) * chunk.get("prior", 1.0)
+        item = (score, -idx)
+        if len(heap) < limit:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+    return [(chunks[-neg_idx]["id"], score) for score, neg_idx in sorted(heap, reverse=True)]
+
+
+def _chart_queries(chunks, n, rng):
+    """2～4 個在同一分塊出現的 keywords 組成的查詢（分類取該分塊的分類）"""
+    queries = []
+    pool = [chunk for chunk in chunks if len(chunk.get("keywords") or []) >= 4]
+    for _ in range(n):
+        chunk = rng.choice(pool)
+        queries.append((rng.sample(sorted(chunk["keywords"]), rng.randint(2, 4)), chunk["category"]))
+    return queries
+
+
+def benchmark(queries=200, seed=7):
+    """索引大小（與 4 位元組定長位置比較）、冷／熱查詢延遲、與逐塊掃描文字的延遲與結果比對，
+    以及原本計分與鄰近度計分的前 5 名中查詢詞的平均間隔"""
+    from retrieval import Retriever
+
+    with open(KB_DIR / "rag_chunks.json", 'r', encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+    t0 = time.perf_counter()
+    index_path, meta = save_position_index(chunks, KB_DIR)
+    build_time = time.perf_counter() - t0
+    index = PositionIndex(index_path)
+    size = index_path.stat().st_size
+    postings_size = len(index.blob)
+    chunk_entries = sum(entry[2] for entry in meta["terms"].values())
+    # 定長編碼：每筆 (分塊編號, 出現次數) 8 位元組、每個位置 4 位元組
+    fixed = chunk_entries * 8 + meta["positions"] * 4
+    text_bytes = sum(len(chunk["text"].encode('utf-8')) for chunk in chunks)
+    print(f"📊 位置索引（{len(meta['terms'])} 個術語、{chunk_entries:,} 筆分塊項、{meta['positions']:,} 個位置）")
+    print(f"   - 建置 {build_time * 1000:.0f} ms；檔案 {size / 1024:.0f} KB（倒排表 {postings_size / 1024:.0f} KB，"
+          f"定長編碼 {fixed / 1024:.0f} KB 的 {postings_size / fixed:.0%}），分塊文字 {text_bytes / 1024:.0f} KB 的 "
+          f"{size / text_bytes:.1%}")
+
+    rng = random.Random(seed)
+    sample = _chart_queries(chunks, queries, rng)
+    for mode in ("window", "pairs"):
+        index.cache.clear()
+        t0 = time.perf_counter()
+        for keywords, category in sample:
+            index.search(keywords, category, mode=mode)
+        cold = (time.perf_counter() - t0) / queries
+        t0 = time.perf_counter()
+        results = [index.search(keywords, category, mode=mode) for keywords, category in sample]
+        warm = (time.perf_counter() - t0) / queries
+        t0 = time.perf_counter()
+        scanned = [scan_search(chunks, keywords, category, mode=mode) for keywords, category in sample]
+        scan = (time.perf_counter() - t0) / queries
+        same = all([i for i, _ in a] == [i for i, _ in b] for a, b in zip(results, scanned))
+        print(f"   - {mode:<6} 位置索引 冷 {cold * 1000:5.2f} ms／熱 {warm * 1000:5.2f} ms"
+              f"  逐塊掃描文字 {scan * 1000:6.2f} ms  結果{'相同' if same else '不同'}")
+
+    retriever = Retriever(chunks)
+    by_id = {chunk["id"]: idx for idx, chunk in enumerate(chunks)}
+
+    def mean_gap(ids, keywords):
+        """前幾名中至少命中兩個詞的分塊，涵蓋命中詞的最短視窗中詞與詞之間的平均字數"""
+        gaps = []
+        for chunk_id in ids:
+            lists = [occ for occ in (index.occurrences(kw).get(by_id[chunk_id]) for kw in keywords) if occ]
+            if len(lists) >= 2:
+                gaps.append(_min_window(lists))
+        return gaps
+
+    base_gaps, window_gaps = [], []
+    for keywords, category in sample:
+        base_gaps += mean_gap([c["id"] for c in retriever.search(keywords, category, 5)], keywords)
+        window_gaps += mean_gap([i for i, _ in index.search(keywords, category, 5)], keywords)
+    print(f"   - 前 5 名命中詞之間的平均字數：原本計分 {sum(base_gaps) / len(base_gaps):.0f}、"
+          f"最短視窗計分 {sum(window_gaps) / len(window_gaps):.0f}")
+
+
+def main():
+    if "--bench" in sys.argv:
+        benchmark()
+        return
+    keywords = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    if keywords:
+        index = PositionIndex.load()
+        mode = "pairs" if "--pairs" in sys.argv else "window"
+        missing = index.missing(keywords)
+        if missing:
+            print(f"⚠️ 不在術語表中，不計分: {missing}")
+        for chunk_id, score in index.search(keywords, limit=10, mode=mode):
+            print(f"   {score:6.2f}  {chunk_id}")
+        return
+    with open(KB_DIR / "rag_chunks.json", 'r', encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+    index_path, meta = save_position_index(chunks, KB_DIR)
+    print(f"✅ 位置索引建立完成（{len(meta['terms'])} 個術語、{meta['positions']:,} 個位置）")
+    print(f"📄 位置索引: {index_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,17 @@
 """
 import os
 import re
+import sys
 import json
 from pathlib import Path
 
+from ocr_quality import PageScorer, gate_chunks, save_quarantine
+from boilerplate import filter_chunks, save_cold_chunks
+from ingest import OCRCleaner, SourceFile, iter_clean_lines, read_source
+from hierarchy import HEADING_PATTERNS, HEADING_RANK
+from rebuild import rebuild_outputs
+from generations import begin_generation, publish, export_generation
+
 SOURCE_DIR = Path.home() / "Documents/算命書/文字檔"
 OUTPUT_DIR = Path.home() / "Projects/jgeizhun/knowledge-base"
 
@@ -88,39 +96,34 @@ BOOKS = {
 }
 
 def clean_ocr_text(text):
-    """清理 OCR 常見錯誤"""
-    # 移除常見的 OCR 亂碼符號
-    text = re.sub(r'[﹐﹒﹔﹕﹖﹗﹛﹜﹝﹞﹟﹠﹡﹢﹣﹤﹥﹦﹨﹩﹪﹫]', '', text)
-    # 移除不可打印字符
-    text = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]', '', text)
-    # 標準化空白
-    text = re.sub(r'[ \t]+', ' ', text)
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    return text.strip()
+    """清理 OCR 常見錯誤（亂碼符號、不可打印字符、空白），規則見 ingest.OCRCleaner"""
+    return OCRCleaner().clean(text)
 
 def smart_split(text, book_name):
     """智能章節分割"""
+    sections = split_sections(text.split('\n'))
+    
+    # 如果沒有分出章節，按固定長度分段
+    if len(sections) < 3:
+        sections = split_by_paragraphs(text, 2000)  # 每段約 2000 字
+    
+    return sections
+
+def split_sections(lines):
+    """依章節標題切分；lines 可以是逐行產生的迭代器（只往後看一行），不必先組出全文"""
     sections = []
     
     # 各種章節模式
-    patterns = [
-        # 第X章 標題
-        (r'^(第[一二三四五六七八九十\d]+章)\s*[:：]?\s*(.+?)$', 'chapter'),
-        # 第X篇 標題
-        (r'^(第[一二三四五六七八九十\d]+篇)\s*[:：]?\s*(.+?)$', 'part'),
-        # 第X節 標題
-        (r'^(第[一二三四五六七八九十\d]+節)\s*[:：]?\s*(.+?)$', 'section'),
-        # X.X 標題
-        (r'^(\d+\.\d+)\s+(.+?)$', 'subsection'),
-        # 一、標題 / 1、標題
-        (r'^([一二三四五六七八九十\d]+)[、.]\s*(.+?)$', 'item'),
-    ]
+    patterns = HEADING_PATTERNS
     
-    lines = text.split('\n')
-    current_section = {"chapter": "前言", "title": "前言", "content": []}
+    lines = iter(lines)
+    upcoming = next(lines, None)
+    current_section = {"chapter": "前言", "title": "前言", "level": "preface", "parents": [], "content": []}
+    # 目前開啟中的上層標題（層級深度, [層級, 編號, 標題]）
+    open_headings = []
     
-    for i, line in enumerate(lines):
-        line = line.strip()
+    while upcoming is not None:
+        line, upcoming = upcoming.strip(), next(lines, None)
         if not line:
             current_section["content"].append("")
             continue
@@ -130,7 +133,7 @@ def smart_split(text, book_name):
             match = re.match(pattern, line)
             if match:
                 # 檢查這是否只是目錄條目（下一行也是章節標題）
-                next_line = lines[i+1].strip() if i+1 < len(lines) else ""
+                next_line = upcoming.strip() if upcoming is not None else ""
                 is_toc = any(re.match(p[0], next_line) for p in patterns)
                 
                 # 如果當前內容很少且下一行也是章節標題，可能是目錄
@@ -143,12 +146,17 @@ def smart_split(text, book_name):
                     current_section["content"] = content_text
                     sections.append(current_section)
                 
-                # 開始新章節
+                # 開始新章節，記錄其上層標題
+                while open_headings and open_headings[-1][0] >= HEADING_RANK[ptype]:
+                    open_headings.pop()
                 current_section = {
                     "chapter": match.group(1),
                     "title": match.group(2).strip() if len(match.groups()) > 1 else match.group(1),
+                    "level": ptype,
+                    "parents": [heading for _, heading in open_headings],
                     "content": []
                 }
+                open_headings.append((HEADING_RANK[ptype], [ptype, current_section["chapter"], current_section["title"]]))
                 matched = True
                 break
         
@@ -161,17 +169,13 @@ def smart_split(text, book_name):
         current_section["content"] = content_text
         sections.append(current_section)
     
-    # 如果沒有分出章節，按固定長度分段
-    if len(sections) < 3:
-        sections = split_by_paragraphs(text, 2000)  # 每段約 2000 字
-    
     return sections
 
 def split_by_paragraphs(text, max_chars=2000):
     """按段落和字數分割"""
     paragraphs = [p.strip() for p in text.split('\n\n') if p.strip()]
     sections = []
-    current_section = {"chapter": "1", "title": "第1部分", "content": []}
+    current_section = {"chapter": "1", "title": "第1部分", "level": "paragraph", "content": []}
     current_length = 0
     section_num = 1
     
@@ -183,7 +187,7 @@ def split_by_paragraphs(text, max_chars=2000):
             
             # 開始新段落
             section_num += 1
-            current_section = {"chapter": str(section_num), "title": f"第{section_num}部分", "content": []}
+            current_section = {"chapter": str(section_num), "title": f"第{section_num}部分", "level": "paragraph", "content": []}
             current_length = 0
         
         current_section["content"].append(para)
@@ -237,7 +241,8 @@ def extract_keywords(text):
         if term in text:
             keywords.add(term)
     
-    return list(keywords)[:20]
+    # 依術語表的順序取前 20 個；直接取集合的前 20 個會隨雜湊種子改變，各行程（watch 的 worker）取到的不同
+    return sorted(keywords, key=all_terms.index)[:20]
 
 def process_book(category, book_name, config):
     """處理單本書籍"""
@@ -248,14 +253,24 @@ def process_book(category, book_name, config):
     
     print(f"  📖 處理: {book_name}")
     
-    with open(file_path, 'r', encoding='utf-8') as f:
-        text = f.read()
-    
-    # 清理 OCR 文本
-    text = clean_ocr_text(text)
+    # mmap 逐窗讀取：判斷編碼（Big5／GBK 亦可）、刪除每頁重複的頁首／頁尾、清理 OCR 文本；
+    # 清理後的文字逐行邊評分邊切章節，不組回全文
+    scorer = PageScorer()
+    with SourceFile(file_path) as source:
+        if source.encoding != "utf-8":
+            print(f"    🔤 編碼: {source.encoding}")
+        sections = split_sections(scorer.feed(line) for line in iter_clean_lines(source))
+    
+    # OCR 品質分級，整本太差就跳過
+    report = scorer.report()
+    if report["rejected"]:
+        print(f"    ❌ OCR 品質不佳（{report['score']:.2f}），跳過")
+        return []
     
-    # 智能分段
-    sections = smart_split(text, book_name)
+    # 沒有分出章節時才讀入全文，按固定長度分段
+    if len(sections) < 3:
+        text, _ = read_source(file_path)
+        sections = split_by_paragraphs(text, 2000)
     
     # 生成知識庫條目
     entries = []
@@ -276,6 +291,8 @@ def process_book(category, book_name, config):
             "category": category,
             "chapter": section.get("chapter", str(i+1)),
             "title": section.get("title", f"第{i+1}節"),
+            "level": section.get("level", "chapter"),
+            "parents": section.get("parents", []),
             "content": content,
             "keywords": extract_keywords(content),
             "metadata": {
@@ -386,6 +403,9 @@ def main():
     
     all_entries = []
     
+    # 輸出寫進新的建置世代，全部完成後才切換（全量重建，章節 Markdown 重新輸出）
+    output_dir = begin_generation(OUTPUT_DIR, markdown=False)
+    
     for category, books in BOOKS.items():
         print(f"\n📚 處理類別: {category}")
         for book_name, config in books.items():
@@ -394,13 +414,21 @@ def main():
             
             # 儲存 Markdown
             for entry in entries:
-                save_markdown(entry, OUTPUT_DIR)
+                save_markdown(entry, output_dir)
     
     # 生成 RAG 分塊
     rag_chunks = generate_rag_chunks(all_entries)
     
+    # OCR 品質關卡：隔離亂碼分塊
+    rag_chunks, quarantined = gate_chunks(rag_chunks)
+    quarantine_path = save_quarantine(quarantined, output_dir)
+    
+    # 目錄、版權頁、封面移到冷資料
+    rag_chunks, cold = filter_chunks(rag_chunks)
+    cold_path = save_cold_chunks(cold, output_dir)
+    
     # 儲存 JSON 索引
-    index_path = OUTPUT_DIR / "index.json"
+    index_path = output_dir / "index.json"
     with open(index_path, 'w', encoding='utf-8') as f:
         json.dump({
             "version": "2.0",
@@ -411,22 +439,33 @@ def main():
             "entries": all_entries
         }, f, ensure_ascii=False, indent=2)
     
-    # 儲存 RAG 分塊
-    chunks_path = OUTPUT_DIR / "rag_chunks.json"
-    with open(chunks_path, 'w', encoding='utf-8') as f:
-        json.dump({
-            "version": "1.0",
-            "total_chunks": len(rag_chunks),
-            "chunks": rag_chunks
-        }, f, ensure_ascii=False, indent=2)
+    # 同義詞概念、靜態先驗、估計 token 數與 uid，儲存 RAG 分塊與位移索引，
+    # 重建變更紀錄、各索引、章節階層、引文連結與位置索引（字典壓縮的分塊文字只在 --compress 時重建）
+    outputs, changes = rebuild_outputs(rag_chunks, output_dir, all_entries, compress="--compress" in sys.argv)
+    if "text_store" in outputs:
+        print(f"📄 壓縮文字: {OUTPUT_DIR / outputs['text_store'].name}")
+    
+    # 校驗、切換 current，並更新 Next.js import 的扁平目錄
+    generation_dir = publish(output_dir, OUTPUT_DIR)
+    export_generation(generation_dir, OUTPUT_DIR)
     
     print(f"\n✅ 完成！")
     print(f"📊 統計：")
     print(f"   - 章節條目: {len(all_entries)}")
     print(f"   - RAG 分塊: {len(rag_chunks)}")
-    print(f"📁 輸出位置: {OUTPUT_DIR}")
-    print(f"📄 索引檔案: {index_path}")
-    print(f"📄 RAG 分塊: {chunks_path}")
+    print(f"   - 隔離分塊: {len(quarantined)}")
+    print(f"   - 冷資料分塊: {len(cold)}")
+    print(f"   - 變更: 新增 {len(changes['added'])}、刪除 {len(changes['removed'])}、"
+          f"中繼資料 {len(changes['modified'])}")
+    print(f"📁 輸出位置: {OUTPUT_DIR}（世代 {generation_dir.name}）")
+    print(f"📄 索引檔案: {OUTPUT_DIR / index_path.name}")
+    for name, label in (("rag_chunks", "RAG 分塊"), ("gua_index", "卦爻索引"), ("ziwei_index", "紫微索引"),
+                        ("snippet_index", "引用句索引"), ("chapter_index", "章節摘要"), ("synonyms", "同義詞表"),
+                        ("hierarchy", "章節階層"), ("quotations", "引文連結"), ("position_index", "位置索引"),
+                        ("changes", "變更紀錄")):
+        print(f"📄 {label}: {OUTPUT_DIR / outputs[name].name}")
+    print(f"📄 隔離分塊: {OUTPUT_DIR / quarantine_path.name}")
+    print(f"📄 冷資料: {OUTPUT_DIR / cold_path.name}")
 
 if __name__ == "__main__":
     main()
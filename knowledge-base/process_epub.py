@@ -9,6 +9,13 @@ import zipfile
 from pathlib import Path
 from html.parser import HTMLParser
 
+from ocr_quality import gate_chunks, save_quarantine
+from boilerplate import strip_running_heads, filter_chunks, save_cold_chunks
+from chunk_stream import ChunkFile, load_offsets, append_chunks, append_items
+from chunk_ids import assign_uids
+from rebuild import annotate_chunks, write_chunks, rebuild_outputs
+from generations import begin_generation, abort_generation, publish, export_generation
+
 # ePub 檔案配置
 EPUB_DIR = Path.home() / "Documents/電子書/Eddie電子書/命理書籍/命理相關epub word"
 OUTPUT_DIR = Path.home() / "Projects/jgeizhun/knowledge-base"
@@ -151,25 +158,30 @@ def parse_epub(epub_path):
             ordered_files = sorted(html_files)
         
         # 讀取每個 HTML 檔案
+        documents = []
         for i, html_file in enumerate(ordered_files):
             try:
                 content = zf.read(html_file).decode('utf-8', errors='ignore')
                 text = extract_text_from_html(content)
-                text = clean_text(text)
-                
-                if len(text.strip()) < 50:
-                    continue
-                
-                # 嘗試從內容中提取章節標題
-                title = extract_chapter_title(text, html_file, i+1)
-                
-                chapters.append({
-                    "chapter": f"第{i+1}章",
-                    "title": title,
-                    "content": text.strip()
-                })
+                documents.append((i, html_file, clean_text(text)))
             except Exception as e:
                 print(f"    ⚠️ 無法讀取 {html_file}: {e}")
+        
+        # 刪除各檔重複的頁首／頁尾（書名、頁碼）
+        texts = strip_running_heads([text for _, _, text in documents])
+        
+        for (i, html_file, _), text in zip(documents, texts):
+            if len(text.strip()) < 50:
+                continue
+            
+            # 嘗試從內容中提取章節標題
+            title = extract_chapter_title(text, html_file, i+1)
+            
+            chapters.append({
+                "chapter": f"第{i+1}章",
+                "title": title,
+                "content": text.strip()
+            })
     
     return chapters
 
@@ -274,7 +286,8 @@ def extract_keywords(text):
         if term in text:
             keywords.add(term)
     
-    return list(keywords)[:20]
+    # 依術語表的順序取前 20 個；直接取集合的前 20 個會隨雜湊種子改變，各行程（watch 的 worker）取到的不同
+    return sorted(keywords, key=all_terms.index)[:20]
 
 def process_epub_book(epub_filename, config):
     """處理單本 ePub 書籍"""
@@ -415,36 +428,43 @@ keywords: {keywords_str}
     with open(filepath, 'w', encoding='utf-8') as f:
         f.write(content)
 
+def merge_stored_chunks(path, sources, new_chunks):
+    """冷資料檔（quarantine.json 等）中其他書的分塊 + 本次新書的分塊"""
+    if not path.exists():
+        return new_chunks
+    with open(path, 'r', encoding='utf-8') as f:
+        stored = json.load(f)["chunks"]
+    return [chunk for chunk in stored if chunk["source"] not in sources] + new_chunks
+
+
 def main():
     print("🚀 開始處理 ePub 電子書...\n")
     
     all_entries = []
     
+    # 在目前世代的副本上追加，全部完成後才切換；讀取端不會看到只更新一半的 rag_chunks.json 與 index.json
+    output_dir = begin_generation(OUTPUT_DIR)
+    
     for epub_filename, config in EPUB_BOOKS.items():
         entries = process_epub_book(epub_filename, config)
         all_entries.extend(entries)
         
         # 儲存 Markdown
         for entry in entries:
-            save_markdown(entry, OUTPUT_DIR)
+            save_markdown(entry, output_dir)
     
     if not all_entries:
         print("\n❌ 沒有成功處理任何書籍")
+        abort_generation(output_dir)
         return
     
-    # 讀取現有的 rag_chunks.json
-    chunks_path = OUTPUT_DIR / "rag_chunks.json"
-    existing_chunks = []
+    # 讀取現有來源（走位移索引，不必整份載入 rag_chunks.json），避免重複
+    chunks_path = output_dir / "rag_chunks.json"
     existing_sources = set()
     
     if chunks_path.exists():
-        with open(chunks_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            existing_chunks = data.get("chunks", [])
-            
-            # 記錄現有來源，避免重複
-            for chunk in existing_chunks:
-                existing_sources.add(chunk.get("source", ""))
+        offsets = load_offsets(chunks_path)
+        existing_sources = {row[2] or "" for row in offsets["entries"]}
     
     # 過濾掉已存在的書籍
     new_entries = []
@@ -454,54 +474,69 @@ def main():
     
     if not new_entries:
         print("\n⚠️ 所有書籍已經在知識庫中")
+        abort_generation(output_dir)
         return
     
     # 生成新的 RAG 分塊
     new_chunks = generate_rag_chunks(new_entries)
-    
-    # 合併分塊
-    all_chunks = existing_chunks + new_chunks
-    
-    # 儲存更新後的 rag_chunks.json
-    with open(chunks_path, 'w', encoding='utf-8') as f:
-        json.dump({
-            "version": "1.0",
-            "total_chunks": len(all_chunks),
-            "chunks": all_chunks
-        }, f, ensure_ascii=False, indent=2)
-    
-    # 更新 index.json
-    index_path = OUTPUT_DIR / "index.json"
+    new_chunks, quarantined = gate_chunks(new_chunks)
+    # 隔離的分塊併入既有的 quarantine.json 供人工檢視（同一本書重跑時取代舊的）
+    new_sources = {entry["source"] for entry in new_entries}
+    save_quarantine(merge_stored_chunks(output_dir / "quarantine.json", new_sources, quarantined), output_dir)
+    # 目錄、版權頁、封面等版面雜訊同樣併入 cold_chunks.json
+    new_chunks, cold = filter_chunks(new_chunks)
+    save_cold_chunks(merge_stored_chunks(output_dir / "cold_chunks.json", new_sources, cold), output_dir)
+    # 同義詞概念、靜態先驗、估計 token 數與 uid（既有分塊不變，只為新書計算）
+    annotate_chunks(new_chunks, new_entries)
+    assign_uids(new_chunks)
+    
+    # 追加到 rag_chunks.json 尾端，只修補檔頭的 total_chunks
+    if chunks_path.exists():
+        def bump_total(header):
+            header["total_chunks"] += len(new_chunks)
+        append_chunks(chunks_path, new_chunks, update_header=bump_total)
+    else:
+        write_chunks(new_chunks, output_dir)
+    # 之後的索引各自從檔案串流讀取，不把整份 rag_chunks.json 載入記憶體
+    all_chunks = ChunkFile(chunks_path)
+    # 發佈後暫存目錄會更名，總數先由位移索引取得
+    total_chunks = len(all_chunks)
+    
+    # 更新 index.json：條目追加到 entries 尾端，書籍列表與統計在檔頭修補
+    index_path = output_dir / "index.json"
+    entries = None
     if index_path.exists():
-        with open(index_path, 'r', encoding='utf-8') as f:
-            index_data = json.load(f)
-        
-        # 添加新條目
-        existing_entries = index_data.get("entries", [])
-        existing_entries.extend(new_entries)
-        
-        # 更新書籍列表
-        existing_books = set((b["name"], b["category"]) for b in index_data.get("books", []))
-        for entry in new_entries:
-            book_tuple = (entry["source"], entry["category"])
-            if book_tuple not in existing_books:
-                index_data.setdefault("books", []).append({
-                    "name": entry["source"],
-                    "category": entry["category"]
-                })
-        
-        index_data["entries"] = existing_entries
-        index_data["total_entries"] = len(existing_entries)
-        index_data["total_chunks"] = len(all_chunks)
+        def update_index_header(header):
+            existing_books = set((b["name"], b["category"]) for b in header.get("books", []))
+            for entry in new_entries:
+                book_tuple = (entry["source"], entry["category"])
+                if book_tuple not in existing_books:
+                    existing_books.add(book_tuple)
+                    header.setdefault("books", []).append({
+                        "name": entry["source"],
+                        "category": entry["category"]
+                    })
+            header["total_entries"] += len(new_entries)
+            header["total_chunks"] = total_chunks
         
-        with open(index_path, 'w', encoding='utf-8') as f:
-            json.dump(index_data, f, ensure_ascii=False, indent=2)
+        append_items(index_path, "entries", new_entries, update_header=update_index_header)
+        # 章節階層的條目同樣以串流讀取
+        entries = ChunkFile(index_path, key="entries")
+    
+    # 重建變更紀錄、卦爻、紫微、引用句、章節摘要、章節階層、引文連結與位置索引
+    rebuild_outputs(all_chunks, output_dir, entries, write=False)
+    
+    # 校驗、切換 current，並更新 Next.js import 的扁平目錄
+    generation_dir = publish(output_dir, OUTPUT_DIR)
+    export_generation(generation_dir, OUTPUT_DIR)
     
-    print(f"\n✅ 完成！")
+    print(f"\n✅ 完成！（世代 {generation_dir.name}）")
     print(f"📊 新增統計：")
     print(f"   - 新增章節條目: {len(new_entries)}")
     print(f"   - 新增 RAG 分塊: {len(new_chunks)}")
-    print(f"   - 總 RAG 分塊: {len(all_chunks)}")
+    print(f"   - 新增隔離分塊: {len(quarantined)}")
+    print(f"   - 新增冷資料分塊: {len(cold)}")
+    print(f"   - 總 RAG 分塊: {total_chunks}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+分塊的靜態排序先驗（prior）
+與查詢無關的調整原本在每次請求時對每個分塊重算：前言減半、開頭 200 字的「X卦」正則、
+OCR 品質降權；書籍的 metadata.quality 則沒有用上。這裡在建置時把這些訊號與分塊長度
+合成一個乘數，存在分塊的 prior 欄位，查詢時只需把關鍵字分數乘上 prior。
+chapter_index.py 的章節條目記錄章內最高的 prior，作為章節分數上限的一部分
+
+用法：
+    python rank_prior.py            # 為 rag_chunks.json 補上 prior
+"""
+import re
+import json
+from pathlib import Path
+
+from ocr_quality import DOWNWEIGHT_BELOW
+
+KB_DIR = Path(__file__).resolve().parent
+
+GUA_HEAD_RE = re.compile(r"[乾坤震巽坎離艮兌]卦")
+GUA_HEAD_CHARS = 200
+
+# 前言減半（與原本 rag.ts 相同）
+PREFACE_WEIGHT = 0.5
+# 開頭有具體卦名：原本固定加 2 分，改為乘數
+GUA_HEAD_WEIGHT = 1.1
+# 書籍品質（metadata.quality，1-5）：每少一級扣 5%
+SOURCE_QUALITY_FULL = 5
+SOURCE_QUALITY_STEP = 0.05
+# 過短的分塊資訊量少：長度不到 LENGTH_FULL 字時由 LENGTH_FLOOR 線性升到 1
+LENGTH_FULL = 200
+LENGTH_FLOOR = 0.7
+
+
+def is_preface(chunk):
+    return chunk.get("title") == "前言" or "前言" in (chunk.get("chapter") or "")
+
+
+def chunk_prior(chunk, source_quality=SOURCE_QUALITY_FULL):
+    """單一分塊的先驗乘數"""
+    prior = 1.0
+    if is_preface(chunk):
+        prior *= PREFACE_WEIGHT
+    quality = chunk.get("ocr_quality", 1.0)
+    if quality < DOWNWEIGHT_BELOW:
+        prior *= quality
+    if GUA_HEAD_RE.search(chunk["text"][:GUA_HEAD_CHARS]):
+        prior *= GUA_HEAD_WEIGHT
+    prior *= 1 - SOURCE_QUALITY_STEP * (SOURCE_QUALITY_FULL - source_quality)
+    prior *= LENGTH_FLOOR + (1 - LENGTH_FLOOR) * min(1.0, len(chunk["text"]) / LENGTH_FULL)
+    return round(prior, 4)
+
+
+def source_qualities(entries):
+    """書名 → metadata.quality（entries 可為產生器）"""
+    qualities = {}
+    for entry in entries:
+        quality = (entry.get("metadata") or {}).get("quality")
+        if quality is not None:
+            qualities[entry["source"]] = quality
+    return qualities
+
+
+def assign_priors(chunks, entries):
+    """為每個分塊加上 prior 欄位"""
+    qualities = source_qualities(entries)
+    for chunk in chunks:
+        chunk["prior"] = chunk_prior(chunk, qualities.get(chunk["source"], SOURCE_QUALITY_FULL))
+    return chunks
+
+
+def main():
+    from chunk_stream import build_offsets, iter_chunks
+    from chunk_ids import save_changes
+    from chapter_index import save_chapter_index
+
+    chunks_path = KB_DIR / "rag_chunks.json"
+    with open(chunks_path, 'r', encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+    assign_priors(chunks, iter_chunks(KB_DIR / "index.json", key="entries", use_offsets=False))
+    with open(chunks_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "version": "1.0",
+            "total_chunks": len(chunks),
+            "chunks": chunks
+        }, f, ensure_ascii=False, indent=2)
+    build_offsets(chunks_path)
+    # prior 屬於中繼資料，下游只需更新欄位
+    save_changes(chunks, KB_DIR)
+    # 章節摘要記錄章節內最高的 prior
+    save_chapter_index(chunks, KB_DIR)
+
+    priors = sorted(chunk["prior"] for chunk in chunks)
+    print(f"✅ 靜態先驗完成（{len(chunks)} 個分塊）")
+    print(f"   - 最小 {priors[0]:.3f}  中位數 {priors[len(priors) // 2]:.3f}  最大 {priors[-1]:.3f}")
+    print(f"   - 低於 1 的分塊: {sum(1 for p in priors if p < 1)}")
+    print(f"📄 RAG 分塊: {chunks_path}")
+
+
+if __name__ == "__main__":
+    main()
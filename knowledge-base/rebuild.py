@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+分塊改變後的重建流程
+分塊的文字或清單改變後，要重算的欄位（concepts、prior、tokens、uid）與依賴分塊的產物
+（rag_chunks.json 與位移索引、同義詞表、變更紀錄、各索引、章節階層、引文連結、壓縮文字）
+只在這裡列一次；process_books_v2.py、process_epub.py、watch.py 的拼接、boilerplate.py 與
+ocr_quality.py 的重寫都呼叫 rebuild_outputs，不再各自維護一份清單。
+
+只改中繼資料欄位的步驟（synonyms.py、tokens.py、rank_prior.py 單獨執行時）只更新依賴該欄位的索引，不經過這裡
+
+用法：
+    python rebuild.py               # 以目前的 rag_chunks.json 重算欄位並重建所有產物
+"""
+import json
+from pathlib import Path
+
+from chunk_ids import assign_uids, save_changes
+from chunk_stream import ChunkFile, build_offsets
+from gua_index import save_gua_index
+from ziwei_index import save_ziwei_index
+from snippets import save_snippet_index
+from chapter_index import save_chapter_index
+from hierarchy import save_hierarchy
+from phrase_index import save_phrase_index
+from position_index import save_position_index
+from rank_prior import assign_priors
+from synonyms import assign_concepts, save_synonyms
+from tokens import assign_tokens
+from text_store import save_text_store
+
+KB_DIR = Path(__file__).resolve().parent
+
+TEXT_STORE_INDEX = "chunk_text.idx.json"
+
+
+def annotate_chunks(chunks, entries=()):
+    """重算依分塊文字而定的欄位：concepts、prior（entries 提供書籍品質）、tokens；uid 由 rebuild_outputs 對全部分塊指定"""
+    assign_concepts(chunks)
+    assign_priors(chunks, entries)
+    assign_tokens(chunks)
+    return chunks
+
+
+def write_chunks(chunks, output_dir):
+    """寫入 rag_chunks.json 並建立位移索引"""
+    chunks_path = Path(output_dir) / "rag_chunks.json"
+    with open(chunks_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "version": "1.0",
+            "total_chunks": len(chunks),
+            "chunks": chunks
+        }, f, ensure_ascii=False, indent=2)
+    build_offsets(chunks_path)
+    return chunks_path
+
+
+def rebuild_outputs(chunks, output_dir, entries=None, annotate=True, write=True, quotations=True,
+                    compress=None, previous_snippets=None, previous_chapters=None):
+    """重建所有依賴分塊的產物，回傳 (產物名稱 → 路徑, 變更紀錄)
+
+    chunks：分塊列表；write=False 時為已寫好的 rag_chunks.json（ChunkFile，如 process_epub 追加後），
+        不再重算欄位與 uid
+    entries：章節條目（可重複迭代），提供 prior 的書籍品質與章節階層；None 時不重建章節階層
+    annotate：重算 concepts、prior、tokens（watch 的 worker 已為重建的書算過時傳 False）
+    quotations：False 時不重建後綴陣列與引文連結（watch 延後在背景重建）
+    compress：是否寫壓縮文字；None 時 output_dir 已有壓縮文字才重寫，不留下過期的版本
+    previous_snippets / previous_chapters：可沿用的引用句與章節摘要舊項目（見 watch.splice）
+    """
+    output_dir = Path(output_dir)
+    if compress is None:
+        compress = (output_dir / TEXT_STORE_INDEX).exists()
+    paths = {}
+    if write:
+        if annotate:
+            annotate_chunks(chunks, entries if entries is not None else ())
+        # 內容定址的穩定 uid（原 id 保留為可讀別名）
+        assign_uids(chunks)
+        paths["rag_chunks"] = write_chunks(chunks, output_dir)
+    paths["synonyms"] = save_synonyms(output_dir)
+    paths["changes"], changes = save_changes(chunks, output_dir)
+    paths["gua_index"], _ = save_gua_index(chunks, output_dir)
+    paths["ziwei_index"], _ = save_ziwei_index(chunks, output_dir)
+    paths["snippet_index"], _ = save_snippet_index(chunks, output_dir, previous_snippets)
+    paths["chapter_index"], _ = save_chapter_index(chunks, output_dir, previous_chapters)
+    if entries is not None:
+        paths["hierarchy"], _ = save_hierarchy(chunks, entries, output_dir)
+    if quotations:
+        paths["quotations"], _ = save_phrase_index(chunks, output_dir)
+    paths["position_index"], _ = save_position_index(chunks, output_dir)
+    if compress:
+        paths["text_store"], _ = save_text_store(chunks, output_dir)
+    return paths, changes
+
+
+def main():
+    with open(KB_DIR / "rag_chunks.json", 'r', encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+    paths, changes = rebuild_outputs(chunks, KB_DIR, ChunkFile(KB_DIR / "index.json", key="entries"))
+    print(f"✅ 重建完成: {len(chunks)} 個分塊，{len(paths)} 個產物")
+    print(f"   - 變更: 新增 {len(changes['added'])}、刪除 {len(changes['removed'])}、"
+          f"中繼資料 {len(changes['modified'])}")
+
+
+if __name__ == "__main__":
+    main()
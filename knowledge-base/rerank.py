@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+"""
+特徵式兩段排序：第一段以關鍵字分數取約 100 個候選，第二段計算候選的特徵矩陣，
+乘上由評估集學到的線性權重重新排序（src/lib/rag.ts 的 searchChunks 以相同特徵與權重重排）
+原本的分數把 keywords 命中、開頭 100 字、「X卦」與出現次數直接相加，權重是手調的；
+這裡把這些訊號拆成特徵，再加上詞頻、首次出現位置、關鍵字之間的距離（兩兩最近距離、
+涵蓋所有命中詞的最短視窗）、分類、靜態先驗、OCR 品質與書籍品質，由資料決定權重
+
+評估集：章節標題點出主題的分塊（論正官、論財帛宮……）。查詢為主題術語加上同分類其他分塊的
+5 個關鍵字（模擬命盤中只有一個關鍵字與要找的段落有關），標題含該主題任一寫法的同分類分塊為相關結果；
+依主題的雜湊固定分成訓練與測試兩半，測試集的主題不會出現在訓練集。
+權重以邏輯迴歸訓練（標準化後的特徵，L2 正則），存在 rerank_model.json
+
+特徵不逐塊比對字串：每個查詢詞在各分塊的出現次數、首次位置、是否接「卦」與前 MAX_POSITIONS 個位置，
+在第一次查到該詞時由位置索引（position_index.bin）整理成陣列並快取（術語表沒有的詞掃描全文一次）。
+查詢時依候選編號取出各詞的陣列，特徵、標準化與計分都是每筆查詢一次的陣列運算；
+沒有安裝 numpy 時退回純 Python（結果相同，只是較慢）。訓練需要 numpy
+
+用法：
+    python rerank.py --train    # 訓練權重並寫入 rerank_model.json
+    python rerank.py --bench    # 測試集上第一段與重排序的 MRR、命中率與各階段延遲
+"""
+import sys
+import json
+import math
+import time
+import random
+import zlib
+from bisect import bisect_left
+from itertools import combinations
+from pathlib import Path
+
+from position_index import PositionIndex
+from retrieval import TERM_SCORE_MAX
+from synonyms import CONCEPT_OF
+from topk import TopKSearch
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+KB_DIR = Path(__file__).resolve().parent
+
+FEATURES = (
+    "base",            # 第一段分數 ÷（關鍵字數 × 單詞上限）
+    "coverage",        # 出現在文中的關鍵字比例
+    "tf",              # 平均 log(1 + 出現次數)
+    "tagged",          # keywords／concepts 含該詞（或其概念）的比例
+    "idf_coverage",    # 以 idf 加權的 coverage（少見的詞較重要）
+    "idf_tf",          # 以 idf 加權的 tf
+    "idf_tagged",      # 以 idf 加權的 tagged
+    "head",            # 出現在開頭 100 字的比例
+    "gua",             # 出現「X卦」的比例
+    "first_pos",       # 最早出現位置越前越高（1 - 位置 ÷ 長度）
+    "proximity",       # 命中詞兩兩最近距離的平均接近度 1 / (1 + 距離 ÷ 10)
+    "window",          # 涵蓋所有命中詞的最短視窗接近度 1 / (1 + 視窗 ÷ 50)
+    "category",        # 與查詢分類相同
+    "prior",
+    "ocr_quality",
+    "source_quality",  # 書籍 metadata.quality ÷ 5
+    "length",          # log(字數) ÷ log(1000)
+)
+CANDIDATES = 100
+# 每個關鍵字在每個分塊取前幾個出現位置（距離特徵用）；記錄在 rerank_model.json，rag.ts 由此讀取
+MAX_POSITIONS = 8
+NOISE_KEYWORDS = 5
+# 位置陣列的填充值（大於任何分塊長度）
+NO_POSITION = 1 << 30
+
+
+def _min_distance(a, b):
+    """兩個已排序位置列表的最近距離（合併走訪）"""
+    i = j = 0
+    best = None
+    while i < len(a) and j < len(b):
+        d = abs(a[i] - b[j])
+        if best is None or d < best:
+            best = d
+        if a[i] < b[j]:
+            i += 1
+        else:
+            j += 1
+    return best
+
+
+def _min_window(lists):
+    """涵蓋每個列表至少一個位置的最短視窗長度"""
+    events = sorted((pos, k) for k, positions in enumerate(lists) for pos in positions)
+    need = len(lists)
+    counts = [0] * need
+    covered = 0
+    best = None
+    left = 0
+    for pos, k in events:
+        counts[k] += 1
+        if counts[k] == 1:
+            covered += 1
+        while covered == need:
+            start, lk = events[left]
+            span = pos - start
+            if best is None or span < best:
+                best = span
+            counts[lk] -= 1
+            if counts[lk] == 0:
+                covered -= 1
+            left += 1
+    return best
+
+
+def _proximity_arrays(positions, hit):
+    """positions：候選 × 查詢詞 × MAX_POSITIONS（NO_POSITION 填充），hit：候選 × 查詢詞
+    回傳命中詞兩兩最近距離的平均接近度與最短涵蓋視窗接近度（命中不到兩個詞時為 0）"""
+    size, width, _ = positions.shape
+    proximity, window = np.zeros(size), np.zeros(size)
+    multi = np.flatnonzero(hit.sum(axis=1) >= 2)
+    if not len(multi):
+        return proximity, window
+
+    # 兩兩最近距離：只取兩個詞都命中的 (候選, 詞對)；另一方的填充改為負值，填充位置彼此不會算成相鄰
+    a, b = np.triu_indices(width, 1)
+    rows, pairs = np.nonzero(hit[:, a] & hit[:, b])
+    left = positions[rows, a[pairs]]
+    right = positions[rows, b[pairs]]
+    right = np.where(right == NO_POSITION, -NO_POSITION, right)
+    distance = np.abs(left[:, :, None] - right[:, None, :]).min(axis=(1, 2))
+    closeness = np.bincount(rows, weights=1 / (1 + distance / 10), minlength=size)
+    pair_counts = np.bincount(rows, minlength=size)
+    np.divide(closeness, pair_counts, out=proximity, where=pair_counts > 0)
+
+    # 最短視窗：各候選的出現位置依序排列，反向累積最小值得到每個位置之後（含）各詞的第一個位置；
+    # 以每個位置為左端，右端為各命中詞在其後第一個位置中的最大者
+    sub = positions[multi].reshape(len(multi), -1)
+    order = np.argsort(sub, axis=1, kind="stable")
+    starts = np.take_along_axis(sub, order, axis=1)
+    owner = np.repeat(np.arange(width), MAX_POSITIONS)[order]
+    later = np.where(owner[:, None, :] == np.arange(width)[:, None], starts[:, None, :], NO_POSITION)
+    later = np.minimum.accumulate(later[:, :, ::-1], axis=2)[:, :, ::-1]
+    later = np.where(hit[multi][:, :, None], later, 0)
+    spans = np.where(starts < NO_POSITION, later.max(axis=1) - starts, NO_POSITION)
+    window[multi] = 1 / (1 + spans.min(axis=1) / 50)
+    return proximity, window
+
+
+class Reranker:
+    """第一段（TopKSearch）取候選，第二段以特徵矩陣 × 權重重新排序"""
+
+    def __init__(self, search, positions, model=None, source_qualities=None):
+        self.search_engine = search
+        retriever = search.retriever
+        self.retriever = retriever
+        self.positions = positions
+        self.source_qualities = source_qualities or {}
+        # 與查詢無關的特徵：建立時算一次
+        self.static = [
+            (chunk.get("prior", 1.0), chunk.get("ocr_quality", 1.0),
+             self.source_qualities.get(chunk["source"], 5) / 5,
+             math.log(max(len(chunk["text"]), 1)) / math.log(1000))
+            for chunk in retriever.chunks
+        ]
+        self.lengths = [max(len(chunk["text"]), 1) for chunk in retriever.chunks]
+        self.idx_of = {id(chunk): idx for idx, chunk in enumerate(retriever.chunks)}
+        # 查詢詞 → term_stats 的結果
+        self.stats = {}
+        self.model = model
+        if np is not None:
+            self.static_matrix = np.asarray(self.static, dtype=np.float64).reshape(-1, 4)
+            self.length_array = np.asarray(self.lengths, dtype=np.float64)
+            self.category_of = {category: i for i, category in enumerate(sorted(set(search.categories)))}
+            self.category_codes = np.asarray([self.category_of[c] for c in search.categories], dtype=np.int64)
+            if model:
+                self.mean = np.asarray(model["mean"])
+                self.scale = np.asarray(model["std"])
+                self.weights = np.asarray(model["weights"])
+        self.timings = {"candidates": 0.0, "features": 0.0, "score": 0.0}
+
+    @classmethod
+    def load(cls, kb_dir=KB_DIR):
+        from rank_prior import source_qualities
+        from chunk_stream import iter_chunks
+
+        kb_dir = Path(kb_dir)
+        model_path = kb_dir / "rerank_model.json"
+        model = None
+        if model_path.exists():
+            with open(model_path, 'r', encoding='utf-8') as f:
+                model = json.load(f)
+        qualities = source_qualities(iter_chunks(kb_dir / "index.json", key="entries", use_offsets=False))
+        return cls(TopKSearch.load(kb_dir), PositionIndex.load(kb_dir), model, qualities)
+
+    def candidates(self, keywords, category=None, limit=CANDIDATES):
+        """第一段：關鍵字分數（已乘 prior）的前 limit 名 (分塊編號, 分數)"""
+        return self.search_engine.search(keywords, category, limit, scored=True)
+
+    def _occurrences(self, term):
+        """分塊編號 → 依序的出現位置（含重疊的出現）；位置索引的術語表沒有的詞掃描全文"""
+        if not term:
+            return {}
+        if term in self.positions.terms:
+            return {idx: [start for start, _ in occ] for idx, occ in self.positions.postings(term).items()}
+        result = {}
+        for idx, chunk in enumerate(self.retriever.chunks):
+            text = chunk["text"]
+            pos = text.find(term)
+            while pos != -1:
+                result.setdefault(idx, []).append(pos)
+                pos = text.find(term, pos + 1)
+        return result
+
+    def term_stats(self, term):
+        """查詢詞的統計（第一次查到時建立並快取）：含該詞的分塊編號（遞增）與各分塊的出現次數、
+        首次位置、是否接「卦」、前 MAX_POSITIONS 個位置；keywords 含該詞或 concepts 含其（分塊類別的）概念的分塊；
+        idf = log(分塊數 ÷ (1 + 第一段有分數的分塊數))"""
+        stats = self.stats.get(term)
+        if stats is not None:
+            return stats
+        chunks = self.retriever.chunks
+        occurrences = self._occurrences(term)
+        ids = sorted(occurrences)
+        engine = self.search_engine
+        # 概念 id 依分塊類別而定（紫微的七殺 → 七殺星）
+        concepts = {category: self.retriever.concept_of(term, category) for category in self.retriever.categories}
+        tagged_ids = set(engine.tagged.get(term, ()))
+        for concept in set(concepts.values()):
+            tagged_ids.update(idx for idx in engine.concept_tagged.get(concept, ())
+                              if concepts[engine.categories[idx]] == concept)
+        tagged_ids = sorted(tagged_ids)
+        stats = {
+            "ids": ids,
+            "counts": [len(occurrences[idx]) for idx in ids],
+            "first": [occurrences[idx][0] for idx in ids],
+            "gua": [any(chunks[idx]["text"].startswith("卦", pos + len(term)) for pos in occurrences[idx])
+                    for idx in ids],
+            "positions": [occurrences[idx][:MAX_POSITIONS] for idx in ids],
+            "tagged": tagged_ids,
+            "idf": math.log(len(chunks) / (1 + len(set(ids).union(tagged_ids)))),
+        }
+        if np is not None:
+            padded = np.full((len(ids), MAX_POSITIONS), NO_POSITION, dtype=np.int64)
+            for row, positions in enumerate(stats["positions"]):
+                padded[row, :len(positions)] = positions
+            stats["arrays"] = (
+                np.asarray(ids, dtype=np.int64),
+                np.asarray(stats["counts"], dtype=np.float64),
+                np.asarray(stats["first"], dtype=np.int64),
+                np.asarray(stats["gua"], dtype=bool),
+                padded,
+                np.asarray(tagged_ids, dtype=np.int64),
+            )
+        self.stats[term] = stats
+        return stats
+
+    def features(self, keywords, category, candidates):
+        """候選的特徵矩陣（列順序同 candidates，欄順序同 FEATURES）；沒有 numpy 時為 tuple 的 list"""
+        if np is None:
+            return self._features_python(keywords, category, candidates)
+        terms = list(dict.fromkeys(keywords))
+        stats = [self.term_stats(term) for term in terms]
+        ids = np.fromiter((idx for idx, _ in candidates), dtype=np.int64, count=len(candidates))
+        size, width = len(ids), len(terms)
+
+        # 候選 × 查詢詞：各詞的陣列以 (詞序, 分塊編號) 為鍵串接，一次二分搜尋取出
+        offsets = np.arange(width, dtype=np.int64) * len(self.lengths)
+        end = np.asarray([width * len(self.lengths)], dtype=np.int64)
+        arrays = [entry["arrays"] for entry in stats]
+        keys = np.concatenate([a[0] + offset for a, offset in zip(arrays, offsets)] + [end])
+        query = ids[:, None] + offsets
+        rows = np.searchsorted(keys, query)
+        found = keys[rows] == query
+        rows = np.where(found, rows, len(keys) - 1)
+        counts = np.concatenate([a[1] for a in arrays] + [[0.0]])[rows]
+        first = np.concatenate([a[2] for a in arrays] + [[NO_POSITION]])[rows]
+        gua = np.concatenate([a[3] for a in arrays] + [[False]])[rows]
+        positions = np.concatenate([a[4] for a in arrays] + [np.full((1, MAX_POSITIONS), NO_POSITION)])[rows]
+        tagged_keys = np.concatenate([a[5] + offset for a, offset in zip(arrays, offsets)] + [end])
+        tagged = tagged_keys[np.searchsorted(tagged_keys, query)] == query
+
+        hit = counts > 0
+        n = width or 1
+        idfs = np.asarray([entry["idf"] for entry in stats])
+        idf_total = idfs.sum() or 1.0
+        log_tf = np.log1p(counts)
+        head = hit & (first + np.asarray([len(term) for term in terms], dtype=np.int64) <= 100)
+        first_pos = np.where(hit.any(axis=1), 1 - first.min(axis=1) / self.length_array[ids], 0.0)
+        proximity, window = _proximity_arrays(positions, hit)
+        if category:
+            same = (self.category_codes[ids] == self.category_of.get(category, -1)).astype(np.float64)
+        else:
+            same = np.ones(size)
+        base_bound = len(keywords) * TERM_SCORE_MAX
+        base = np.fromiter((score for _, score in candidates), dtype=np.float64, count=size)
+        return np.column_stack((
+            base / base_bound if base_bound else np.zeros(size),
+            hit.sum(axis=1) / n, log_tf.sum(axis=1) / n, tagged.sum(axis=1) / n,
+            hit @ idfs / idf_total, log_tf @ idfs / idf_total, tagged @ idfs / idf_total,
+            head.sum(axis=1) / n, gua.sum(axis=1) / n,
+            first_pos, proximity, window, same,
+            self.static_matrix[ids],
+        ))
+
+    def _features_python(self, keywords, category, candidates):
+        """與 features 相同的特徵，逐個候選計算（沒有 numpy 時）"""
+        terms = list(dict.fromkeys(keywords))
+        stats = [self.term_stats(term) for term in terms]
+        idfs = [entry["idf"] for entry in stats]
+        idf_total = sum(idfs) or 1.0
+        base_bound = len(keywords) * TERM_SCORE_MAX
+        n = len(terms) or 1
+        rows = []
+        for idx, base in candidates:
+            chunk = self.retriever.chunks[idx]
+            length = self.lengths[idx]
+            hits, tf, tagged, head, gua, first = [], 0.0, 0, 0, 0, length
+            idf_hits = idf_tf = idf_tagged = 0.0
+            for term, entry, idf in zip(terms, stats, idfs):
+                k = bisect_left(entry["tagged"], idx)
+                if k < len(entry["tagged"]) and entry["tagged"][k] == idx:
+                    tagged += 1
+                    idf_tagged += idf
+                row = bisect_left(entry["ids"], idx)
+                if row == len(entry["ids"]) or entry["ids"][row] != idx:
+                    continue
+                hits.append(entry["positions"][row])
+                count = math.log1p(entry["counts"][row])
+                tf += count
+                idf_hits += idf
+                idf_tf += idf * count
+                head += entry["first"][row] + len(term) <= 100
+                gua += entry["gua"][row]
+                first = min(first, entry["first"][row])
+            if len(hits) >= 2:
+                pairs = [_min_distance(a, b) for a, b in combinations(hits, 2)]
+                proximity = sum(1 / (1 + d / 10) for d in pairs) / len(pairs)
+                window = 1 / (1 + _min_window(hits) / 50)
+            else:
+                proximity = window = 0.0
+            rows.append((
+                base / base_bound if base_bound else 0.0,
+                len(hits) / n, tf / n, tagged / n,
+                idf_hits / idf_total, idf_tf / idf_total, idf_tagged / idf_total,
+                head / n, gua / n,
+                1 - first / length if hits else 0.0,
+                proximity, window,
+                1.0 if not category or chunk["category"] == category else 0.0,
+                *self.static[idx],
+            ))
+        return rows
+
+    def score(self, rows):
+        """標準化後乘上權重：每筆查詢一次矩陣運算"""
+        model = self.model
+        if np is not None:
+            return ((rows - self.mean) / self.scale) @ self.weights + model["bias"]
+        mean, scale, weights = model["mean"], model["std"], model["weights"]
+        return [sum((x - m) / s * w for x, m, s, w in zip(row, mean, scale, weights)) + model["bias"]
+                for row in rows]
+
+    def search(self, keywords, category=None, limit=5):
+        """兩段式查詢；沒有權重檔時只用第一段"""
+        t0 = time.perf_counter()
+        candidates = self.candidates(keywords, category)
+        t1 = time.perf_counter()
+        self.timings["candidates"] += t1 - t0
+        if not self.model or not candidates:
+            return [self.retriever.chunks[idx] for idx, _ in candidates[:limit]]
+        rows = self.features(keywords, category, candidates)
+        t2 = time.perf_counter()
+        scores = self.score(rows)
+        # 同分時保留第一段的順序
+        if np is not None:
+            order = np.argsort(-scores, kind="stable")[:limit]
+        else:
+            order = sorted(range(len(candidates)), key=lambda i: -scores[i])[:limit]
+        self.timings["features"] += t2 - t1
+        self.timings["score"] += time.perf_counter() - t2
+        return [self.retriever.chunks[candidates[i][0]] for i in order]
+
+
+def _topics(chunks):
+    """章節標題中的術語（概念 id）→ 標題含該主題任一寫法的分塊"""
+    forms = {kw for chunk in chunks for kw in chunk.get("keywords", []) if len(kw) >= 2}
+    forms.update(form for form in CONCEPT_OF if len(form) >= 2)
+    topics = {}
+    for idx, chunk in enumerate(chunks):
+        title = chunk.get("title") or ""
+        for form in forms:
+            if form in title:
+                topics.setdefault(CONCEPT_OF.get(form, form), set()).add(idx)
+    return topics
+
+
+def eval_queries(chunks, n, seed=11):
+    """評估集：[(keywords, category, 相關分塊編號集合, 是否為測試集)]"""
+    rng = random.Random(seed)
+    topics = _topics(chunks)
+    names = sorted(topics)
+    by_category = {}
+    for chunk in chunks:
+        by_category.setdefault(chunk["category"], []).append(chunk)
+    queries = []
+    for _ in range(n):
+        topic = rng.choice(names)
+        category = chunks[rng.choice(sorted(topics[topic]))]["category"]
+        relevant = {idx for idx in topics[topic] if chunks[idx]["category"] == category}
+        pool = sorted({kw for c in rng.sample(by_category[category], 5) for kw in c.get("keywords", [])}
+                      - {topic})
+        keywords = [topic] + rng.sample(pool, min(NOISE_KEYWORDS, len(pool)))
+        rng.shuffle(keywords)
+        held_out = zlib.crc32(topic.encode('utf-8')) % 2 == 1
+        queries.append((keywords, category, relevant, held_out))
+    return queries
+
+
+def train(reranker, queries, epochs=400, rate=0.5, l2=1e-3):
+    """邏輯迴歸（全批次梯度下降）：候選為相關分塊時標 1；回傳 model dict"""
+    if np is None:
+        raise RuntimeError("訓練需要 numpy（pip install numpy）")
+    blocks, labels = [], []
+    for keywords, category, relevant, held_out in queries:
+        if held_out:
+            continue
+        candidates = reranker.candidates(keywords, category)
+        if not candidates:
+            continue
+        blocks.append(reranker.features(keywords, category, candidates))
+        labels.extend(1.0 if idx in relevant else 0.0 for idx, _ in candidates)
+    matrix = np.vstack(blocks)
+    y = np.asarray(labels)
+    mean = matrix.mean(axis=0)
+    std = matrix.std(axis=0)
+    std[std == 0] = 1.0
+    x = (matrix - mean) / std
+    # 正例很少：依類別頻率加權
+    positive = max(y.sum(), 1.0)
+    sample_weight = np.where(y == 1, len(y) / (2 * positive), len(y) / (2 * (len(y) - positive)))
+    w = np.zeros(x.shape[1])
+    b = 0.0
+    for _ in range(epochs):
+        p = 1 / (1 + np.exp(-(x @ w + b)))
+        g = (p - y) * sample_weight
+        w -= rate * (x.T @ g / len(y) + l2 * w)
+        b -= rate * g.mean()
+    return {
+        "version": "1.0",
+        "features": list(FEATURES),
+        "mean": mean.round(6).tolist(),
+        "std": std.round(6).tolist(),
+        "weights": w.round(6).tolist(),
+        "bias": round(float(b), 6),
+        "max_positions": MAX_POSITIONS,
+        # rag.ts 沒有讀取 index.json，書籍品質特徵取自這裡
+        "source_quality": reranker.source_qualities,
+        "train_rows": len(y),
+        "train_positives": int(y.sum()),
+    }
+
+
+def evaluate(reranker, queries, k=5):
+    """測試集上的 MRR@10 與 P@k：第一段 vs 重排序；另回傳第一段候選含相關分塊的比例"""
+    stats = {"first": [0.0, 0.0], "rerank": [0.0, 0.0]}
+    recall = total = 0
+    for keywords, category, relevant, held_out in queries:
+        if not held_out:
+            continue
+        total += 1
+        candidates = reranker.candidates(keywords, category)
+        recall += any(idx in relevant for idx, _ in candidates)
+        first = [idx for idx, _ in candidates[:10]]
+        ranked = [reranker.idx_of[id(c)] for c in reranker.search(keywords, category, limit=10)]
+        for label, ids in (("first", first), ("rerank", ranked)):
+            rank = next((r for r, idx in enumerate(ids, 1) if idx in relevant), None)
+            if rank:
+                stats[label][0] += 1 / rank
+            stats[label][1] += sum(1 for idx in ids[:k] if idx in relevant) / k
+    return {label: (mrr / total, precision / total) for label, (mrr, precision) in stats.items()}, \
+        recall / total, total
+
+
+def save_model(model, output_dir):
+    model_path = Path(output_dir) / "rerank_model.json"
+    with open(model_path, 'w', encoding='utf-8') as f:
+        json.dump(model, f, ensure_ascii=False, indent=2)
+    return model_path
+
+
+def benchmark(n=400):
+    """測試集上的排序品質與各階段延遲"""
+    reranker = Reranker.load()
+    if not reranker.model:
+        print("⚠️ 找不到 rerank_model.json，請先執行 python rerank.py --train")
+        return
+    queries = eval_queries(reranker.retriever.chunks, n)
+    stats, recall, total = evaluate(reranker, queries)
+    first, rerank = stats["first"], stats["rerank"]
+    for key in reranker.timings:
+        reranker.timings[key] = 0.0
+    for keywords, category, _, held_out in queries:
+        if held_out:
+            reranker.search(keywords, category)
+    timings = {key: value / total * 1000 for key, value in reranker.timings.items()}
+
+    print(f"📊 測試集 {total} 筆查詢（主題術語 + {NOISE_KEYWORDS} 個無關關鍵字，"
+          f"{'numpy' if np is not None else '純 Python'}）")
+    print(f"   - 第一段前 {CANDIDATES} 名含相關分塊: {recall:.1%}")
+    print(f"   - 第一段:   MRR@10 {first[0]:.3f}，P@5 {first[1]:.3f}")
+    print(f"   - 重排序:   MRR@10 {rerank[0]:.3f}，P@5 {rerank[1]:.3f}")
+    print(f"   - 延遲（每筆）: 候選 {timings['candidates']:.2f} ms、特徵 {timings['features']:.2f} ms、"
+          f"計分 {timings['score'] * 1000:.0f} µs")
+
+
+def main():
+    if "--bench" in sys.argv:
+        benchmark()
+        return
+    if "--train" in sys.argv:
+        reranker = Reranker.load()
+        queries = eval_queries(reranker.retriever.chunks, 400)
+        t0 = time.perf_counter()
+        model = train(reranker, queries)
+        model_path = save_model(model, KB_DIR)
+        print(f"✅ 重排序權重完成（{model['train_rows']:,} 列、{model['train_positives']} 個正例，"
+              f"{time.perf_counter() - t0:.1f} 秒）")
+        for name, weight in sorted(zip(FEATURES, model["weights"]), key=lambda item: -abs(item[1])):
+            print(f"   - {name:<15} {weight:+.3f}")
+        print(f"📄 權重: {model_path}")
+        return
+    print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
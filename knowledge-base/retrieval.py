@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+知識庫檢索（Python 版）
+評分規則與 src/lib/rag.ts 的 searchChunks 第一段一致（第二段重排序見 rerank.py），另提供批次查詢：
+多個 (keywords, category, limit) 查詢只掃描分塊一次，共用術語的倒排表，
+每個查詢以大小為 limit 的堆積維護前 k 名
+
+用法：
+    python retrieval.py --bench    # 批次 vs 逐筆查詢基準測試
+"""
+import re
+import sys
+import json
+import time
+import heapq
+import random
+from pathlib import Path
+
+from rank_prior import chunk_prior
+from synonyms import concept_of
+
+KB_DIR = Path(__file__).resolve().parent
+
+# 單一關鍵字的最高分：keywords 命中 5（只有概念相同時 3）、開頭 100 字 4、「X卦」6、出現次數最多 3
+TERM_SCORE_MAX = 18
+KEYWORD_BONUS = 5
+CONCEPT_BONUS = 3
+GUA_BONUS = 6
+GUA_PREFIX_RE = re.compile(r"(.)卦", re.S)
+
+
+def term_score(text, keyword_set, keyword, concept=None, concept_set=frozenset()):
+    """單一關鍵字對單一分塊的分數；concept 為關鍵字在分塊類別的概念 id（synonyms.concept_of），
+    分塊 keywords 沒有關鍵字本身、但 concepts 含該概念時得到較少的 CONCEPT_BONUS"""
+    if keyword in keyword_set:
+        score = KEYWORD_BONUS
+    elif concept is not None and concept in concept_set:
+        score = CONCEPT_BONUS
+    else:
+        score = 0
+    count = text.count(keyword)
+    if not count:
+        # 文本沒有出現時，開頭與「X卦」條件也不可能成立
+        return score
+    if text.find(keyword, 0, 100) != -1:
+        score += 4
+    if keyword + "卦" in text:
+        score += 6
+    return score + min(count, 3)
+
+
+class Retriever:
+    """持有分塊與查詢時不變的特徵，提供單筆與批次查詢
+
+    expand=False 時不使用建置時標記的 concepts（對照組，只比對字面）
+    """
+
+    def __init__(self, chunks, expand=True):
+        self.chunks = chunks
+        self.expand = expand
+        self.categories = sorted({c["category"] for c in chunks})
+        self.keyword_sets = [frozenset(c.get("keywords") or []) for c in chunks]
+        self.concept_sets = [frozenset(c.get("concepts") or [] if expand else []) for c in chunks]
+        self.vocabulary = frozenset().union(*self.keyword_sets)
+        self.concept_vocabulary = frozenset().union(*self.concept_sets)
+        # 語料中出現在「卦」前面的字；關鍵字結尾不在其中時拿不到「X卦」分
+        self.gua_prefix_chars = frozenset(ch for c in chunks for ch in GUA_PREFIX_RE.findall(c["text"]))
+        # 靜態先驗（rank_prior.py 建置時算好；舊資料沒有 prior 欄位時當場計算）
+        self.priors = [c["prior"] if "prior" in c else chunk_prior(c) for c in chunks]
+        self.visited = 0
+
+    @classmethod
+    def load(cls, kb_dir=KB_DIR):
+        with open(Path(kb_dir) / "rag_chunks.json", 'r', encoding='utf-8') as f:
+            return cls(json.load(f)["chunks"])
+
+    def finalize(self, idx, score):
+        """套用與查詢無關的靜態先驗"""
+        return score * self.priors[idx]
+
+    def concept_of(self, term, category):
+        """關鍵字在某分類的概念 id（expand=False 或不在對照表中時為 None）"""
+        return concept_of(term, category) if self.expand else None
+
+    def concepts(self, keywords, category=None):
+        """各分類的概念 id：{分類: [每個關鍵字的概念 id]}；指定 category 時只有該分類。
+        同一寫法在不同分類可能指不同概念（紫微的七殺 → 七殺星），所以依分塊類別查表"""
+        categories = (category,) if category else self.categories
+        return {c: [self.concept_of(kw, c) for kw in keywords] for c in categories}
+
+    def chunk_score(self, idx, keywords, concepts=None):
+        """單一分塊的分數（已乘 prior）；concepts 為 self.concepts 的結果"""
+        chunk = self.chunks[idx]
+        if concepts is None:
+            concepts = self.concepts(keywords, chunk["category"])
+        text, keyword_set, concept_set = chunk["text"], self.keyword_sets[idx], self.concept_sets[idx]
+        return self.finalize(idx, sum(term_score(text, keyword_set, kw, concept, concept_set)
+                                      for kw, concept in zip(keywords, concepts[chunk["category"]])))
+
+    def score_bound(self, keywords):
+        """關鍵字分數上限：不在任何分塊 keywords 中的關鍵字最多拿到概念命中分，
+        各分類的概念 id 也都不在任何分塊 concepts 中時拿不到，
+        結尾字從未出現在「卦」前面的關鍵字拿不到「X卦」分"""
+        bound = 0
+        for kw in keywords:
+            bound += TERM_SCORE_MAX
+            if kw not in self.vocabulary:
+                if any(self.concept_of(kw, c) in self.concept_vocabulary for c in self.categories):
+                    bound -= KEYWORD_BONUS - CONCEPT_BONUS
+                else:
+                    bound -= KEYWORD_BONUS
+            if not kw or kw[-1] not in self.gua_prefix_chars:
+                bound -= GUA_BONUS
+        return bound
+
+    def search(self, keywords, category=None, limit=5):
+        """單筆查詢（與 searchChunks 的第一段相同）
+
+        逐塊計分，以大小為 limit 的最小堆積保留前幾名；需要略過分塊時用
+        chapter_index.ChapterSearch（章節分數上限）或 topk.TopKSearch（倒排表）
+        """
+        concepts = self.concepts(keywords, category)
+        heap = []
+        for idx, chunk in enumerate(self.chunks):
+            if category and chunk["category"] != category:
+                continue
+            self.visited += 1
+            score = self.chunk_score(idx, keywords, concepts)
+            if score <= 0:
+                continue
+            # 同分時較前面的分塊優先
+            item = (score, -idx)
+            if len(heap) < limit:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+        return [self.chunks[-neg_idx] for _, neg_idx in sorted(heap, reverse=True)]
+
+    def batch_search(self, queries):
+        """批次查詢：queries 為 [(keywords, category, limit), ...]
+
+        只掃描分塊一次，為所有查詢用到的不同術語建立稀疏倒排表（分塊 → 分數），
+        各查詢再加總自己的倒排表，以大小為 limit 的最小堆積取前 k 名
+        """
+        # 每個分類需要計分的 (術語, 該分類的概念 id)，先算好再掃描（category 為 None 表示不限分類）
+        terms_by_category = {}
+        for keywords, category, _ in queries:
+            terms_by_category.setdefault(category, set()).update(keywords)
+        shared = terms_by_category.pop(None, set())
+        scored = {category: [(term, self.concept_of(term, category))
+                             for term in terms_by_category.get(category, set()) | shared]
+                  for category in self.categories}
+
+        postings = {}
+        for idx, chunk in enumerate(self.chunks):
+            text, keyword_set, concept_set = chunk["text"], self.keyword_sets[idx], self.concept_sets[idx]
+            for term, concept in scored[chunk["category"]]:
+                s = term_score(text, keyword_set, term, concept, concept_set)
+                if s:
+                    postings.setdefault(term, []).append((idx, s))
+
+        results = []
+        for keywords, category, limit in queries:
+            totals = {}
+            for kw in keywords:
+                for idx, s in postings.get(kw, ()):
+                    if category and self.chunks[idx]["category"] != category:
+                        continue
+                    totals[idx] = totals.get(idx, 0) + s
+
+            # 最小堆積保留前 limit 名；同分時較前面的分塊優先
+            heap = []
+            for idx, score in totals.items():
+                score = self.finalize(idx, score)
+                if score <= 0:
+                    continue
+                item = (score, -idx)
+                if len(heap) < limit:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+            results.append([self.chunks[-neg_idx] for _, neg_idx in sorted(heap, reverse=True)])
+
+        return results
+
+
+_default_retriever = None
+
+
+def _default():
+    global _default_retriever
+    if _default_retriever is None:
+        _default_retriever = Retriever.load()
+    return _default_retriever
+
+
+def search_chunks(keywords, category=None, limit=5):
+    """以預設知識庫做單筆查詢"""
+    return _default().search(keywords, category, limit)
+
+
+def batch_search(queries):
+    """以預設知識庫做批次查詢"""
+    return _default().batch_search(queries)
+
+
+def _sample_queries(chunks, n, rng):
+    """以分塊的 keywords 模擬命盤查詢（約 8 個關鍵字）"""
+    categories = ["八字", "紫微", "易經"]
+    queries = []
+    for _ in range(n):
+        chunk = rng.choice(chunks)
+        pool = sorted({kw for c in rng.sample(chunks, 5) for kw in c["keywords"]} | set(chunk["keywords"]))
+        keywords = rng.sample(pool, min(8, len(pool)))
+        queries.append((keywords, rng.choice(categories), rng.choice([2, 3, 5])))
+    return queries
+
+
+def benchmark(batch_sizes=(3, 10, 50), seed=7):
+    """比較批次查詢與逐筆查詢的耗時，並確認結果一致"""
+    retriever = Retriever.load()
+    rng = random.Random(seed)
+
+    print(f"📊 批次 vs 逐筆查詢（{len(retriever.chunks)} 個分塊）")
+    for size in batch_sizes:
+        queries = _sample_queries(retriever.chunks, size, rng)
+
+        t0 = time.perf_counter()
+        one_by_one = [retriever.search(*q) for q in queries]
+        sequential = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        batched = retriever.batch_search(queries)
+        batch = time.perf_counter() - t0
+
+        same = all(
+            [c["id"] for c in a] == [c["id"] for c in b]
+            for a, b in zip(one_by_one, batched)
+        )
+        print(f"   - {size:>2} 筆: 逐筆 {sequential * 1000:7.1f} ms"
+              f"  批次 {batch * 1000:7.1f} ms  加速 {sequential / batch:4.1f}×"
+              f"  結果{'一致' if same else '不一致'}")
+
+
+def main():
+    if "--bench" in sys.argv:
+        benchmark()
+        return
+    print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+多個 worker 行程共用的唯讀語料
+每個 worker 各自 json.load 分塊並建立索引時，記憶體隨 worker 數線性成長。
+這裡把分塊文字（UTF-8 位元組堆）、位移表與檢索用的陣列（prior、分類、關鍵字／概念代碼與其倒排表）
+寫成一個二進位檔 corpus.bin，各 worker 以 mmap 唯讀映射，所有行程共用作業系統的同一份頁面快取。
+
+陣列以 memoryview.cast 直接檢視映射的記憶體，不複製；計分也不解碼文字：
+UTF-8 的子字串比對與字元比對等價，計分時只把正在計分的分塊切成 bytes 以 count／find 比對
+（開頭 100 字的位元組位置建置時先算好），逐塊計分的方式與 Retriever 相同，
+只有回傳結果時才解碼
+
+multiprocessing.shared_memory 的緩衝區只能以 memoryview 存取，沒有 find，
+逐塊比對得先複製成 bytes，所以改用共用的 mmap 檔案
+
+用法：
+    python shared_corpus.py                  # 建立 corpus.bin
+    python shared_corpus.py --bench          # 4 個 worker：私有副本 vs 共用映射的記憶體與延遲
+    python shared_corpus.py --bench --workers 8
+"""
+import sys
+import json
+import mmap
+import time
+import heapq
+import random
+import struct
+import multiprocessing
+from array import array
+from pathlib import Path
+
+from retrieval import CONCEPT_BONUS, KEYWORD_BONUS
+from synonyms import concept_of
+
+KB_DIR = Path(__file__).resolve().parent
+
+MAGIC = b"KBCORP02"
+HEADER = struct.Struct("<8sI")
+ALIGN = 8
+HEAD_CHARS = 100
+
+# (欄位, array 型別)；位移表多一個元素
+ARRAY_FIELDS = (
+    ("text_offsets", "Q"),
+    ("head_ends", "Q"),
+    ("priors", "d"),
+    ("category_codes", "B"),
+    ("keyword_offsets", "I"),
+    ("keyword_ids", "H"),
+    ("concept_offsets", "I"),
+    ("concept_ids", "H"),
+    ("term_offsets", "I"),
+    ("term_chunks", "I"),
+)
+
+
+def _source_stamp(path):
+    stat = Path(path).stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def build_shared_corpus(chunks, path, source=None):
+    """把分塊寫成 corpus.bin：檔頭 + JSON 中繼資料 + 對齊的陣列 + 文字位元組堆"""
+    vocabulary, codes = [], {}
+
+    def code(term):
+        if term not in codes:
+            codes[term] = len(vocabulary)
+            vocabulary.append(term)
+        return codes[term]
+
+    categories = sorted({chunk["category"] for chunk in chunks})
+    arrays = {name: array(typecode) for name, typecode in ARRAY_FIELDS}
+    arrays["text_offsets"].append(0)
+    arrays["keyword_offsets"].append(0)
+    arrays["concept_offsets"].append(0)
+    texts = []
+    heap_size = 0
+    for chunk in chunks:
+        encoded = chunk["text"].encode('utf-8')
+        texts.append(encoded)
+        arrays["head_ends"].append(heap_size + len(chunk["text"][:HEAD_CHARS].encode('utf-8')))
+        heap_size += len(encoded)
+        arrays["text_offsets"].append(heap_size)
+        arrays["priors"].append(chunk.get("prior", 1.0))
+        arrays["category_codes"].append(categories.index(chunk["category"]))
+        arrays["keyword_ids"].extend(code(kw) for kw in chunk.get("keywords", []))
+        arrays["keyword_offsets"].append(len(arrays["keyword_ids"]))
+        arrays["concept_ids"].extend(code(c) for c in chunk.get("concepts", []))
+        arrays["concept_offsets"].append(len(arrays["concept_ids"]))
+    # 倒排表：詞代碼 → keywords 或 concepts 含該詞的分塊（keywords 命中分用）
+    postings = [[] for _ in vocabulary]
+    for idx in range(len(chunks)):
+        k0, k1 = arrays["keyword_offsets"][idx], arrays["keyword_offsets"][idx + 1]
+        c0, c1 = arrays["concept_offsets"][idx], arrays["concept_offsets"][idx + 1]
+        for term in sorted({*arrays["keyword_ids"][k0:k1], *arrays["concept_ids"][c0:c1]}):
+            postings[term].append(idx)
+    arrays["term_offsets"].append(0)
+    for chunk_ids in postings:
+        arrays["term_chunks"].extend(chunk_ids)
+        arrays["term_offsets"].append(len(arrays["term_chunks"]))
+
+    meta = {
+        "version": "1.0",
+        "source": _source_stamp(source) if source else None,
+        "ids": [chunk["id"] for chunk in chunks],
+        "sources": [chunk["source"] for chunk in chunks],
+        "chapters": [chunk.get("chapter", "") for chunk in chunks],
+        "titles": [chunk.get("title", "") for chunk in chunks],
+        "categories": categories,
+        "vocabulary": vocabulary,
+        "arrays": {},
+    }
+
+    # 陣列位置相對於中繼資料之後的對齊起點；先算位置再寫入
+    offset = 0
+    for name, _ in ARRAY_FIELDS:
+        data = arrays[name]
+        meta["arrays"][name] = [offset, len(data)]
+        offset += -(-len(data) * data.itemsize // ALIGN) * ALIGN
+    meta["heap"] = [offset, heap_size]
+
+    meta_bytes = json.dumps(meta, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    body_start = -(-(HEADER.size + len(meta_bytes)) // ALIGN) * ALIGN
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(meta_bytes)))
+        f.write(meta_bytes)
+        f.write(b"\0" * (body_start - HEADER.size - len(meta_bytes)))
+        for name, _ in ARRAY_FIELDS:
+            raw = arrays[name].tobytes()
+            f.write(raw)
+            f.write(b"\0" * (-len(raw) % ALIGN))
+        for encoded in texts:
+            f.write(encoded)
+    return Path(path)
+
+
+def save_shared_corpus(chunks, output_dir):
+    """建立 corpus.bin（可重建的快取，記錄 rag_chunks.json 的大小與修改時間）"""
+    output_dir = Path(output_dir)
+    return build_shared_corpus(chunks, output_dir / "corpus.bin", output_dir / "rag_chunks.json")
+
+
+def ensure_shared_corpus(kb_dir=KB_DIR):
+    """corpus.bin 不存在或與 rag_chunks.json 不符時重建（在啟動 worker 之前由主行程呼叫）"""
+    kb_dir = Path(kb_dir)
+    path = kb_dir / "corpus.bin"
+    if path.exists():
+        try:
+            with SharedCorpus(path) as corpus:
+                if corpus.meta["source"] == _source_stamp(kb_dir / "rag_chunks.json"):
+                    return path
+        except ValueError:
+            # 舊版格式（KBCORP01 多一個 prior 排序陣列）
+            pass
+    with open(kb_dir / "rag_chunks.json", 'r', encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+    return save_shared_corpus(chunks, kb_dir)
+
+
+class SharedCorpus:
+    """唯讀映射 corpus.bin；search 與 retrieval.Retriever.search 結果相同"""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, meta_len = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise ValueError(f"{path} 不是 corpus.bin 格式")
+        self.meta = json.loads(self.data[HEADER.size:HEADER.size + meta_len])
+        body = -(-(HEADER.size + meta_len) // ALIGN) * ALIGN
+
+        self.view = memoryview(self.data)
+        for name, typecode in ARRAY_FIELDS:
+            start, length = self.meta["arrays"][name]
+            size = length * array(typecode).itemsize
+            setattr(self, name, self.view[body + start:body + start + size].cast(typecode))
+        # 文字位移加上 heap_start 即為檔案中的絕對位置，find 直接用
+        self.heap_start = body + self.meta["heap"][0]
+
+        self.ids = self.meta["ids"]
+        self.categories = self.meta["categories"]
+        self.codes = {term: code for code, term in enumerate(self.meta["vocabulary"])}
+        self.visited = 0
+
+    @classmethod
+    def attach(cls, kb_dir=KB_DIR):
+        return cls(Path(kb_dir) / "corpus.bin")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for name, _ in ARRAY_FIELDS:
+            getattr(self, name).release()
+        self.view.release()
+        self.data.close()
+        self.file.close()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def text(self, idx):
+        start = self.heap_start + self.text_offsets[idx]
+        end = self.heap_start + self.text_offsets[idx + 1]
+        return self.data[start:end].decode('utf-8')
+
+    def chunk(self, idx):
+        """還原成 dict（只在回傳結果時解碼）"""
+        meta, vocabulary = self.meta, self.meta["vocabulary"]
+        k0, k1 = self.keyword_offsets[idx], self.keyword_offsets[idx + 1]
+        c0, c1 = self.concept_offsets[idx], self.concept_offsets[idx + 1]
+        return {
+            "id": self.ids[idx],
+            "text": self.text(idx),
+            "source": meta["sources"][idx],
+            "chapter": meta["chapters"][idx],
+            "title": meta["titles"][idx],
+            "category": self.categories[self.category_codes[idx]],
+            "keywords": [vocabulary[k] for k in self.keyword_ids[k0:k1]],
+            "concepts": [vocabulary[c] for c in self.concept_ids[c0:c1]],
+            "prior": self.priors[idx],
+        }
+
+    def postings(self, term):
+        """keywords 或 concepts 含 term 的分塊（term 不在詞表中時為空）"""
+        code = self.codes.get(term)
+        if code is None:
+            return ()
+        return self.term_chunks[self.term_offsets[code]:self.term_offsets[code + 1]]
+
+    def tagged(self, term, category_code=None):
+        """(keywords 含 term 的分塊, concepts 含 term 在分塊類別之概念 id 的分塊)；
+        category_code 不為 None 時只取該分類"""
+        code = self.codes.get(term)
+        literal = set()
+        if code is not None:
+            for idx in self.postings(term):
+                k0, k1 = self.keyword_offsets[idx], self.keyword_offsets[idx + 1]
+                if code in self.keyword_ids[k0:k1]:
+                    literal.add(idx)
+        conceptual = set()
+        categories = range(len(self.categories)) if category_code is None else (category_code,)
+        for cc in categories:
+            concept = concept_of(term, self.categories[cc])
+            concept_code = self.codes.get(concept)
+            if concept_code is None:
+                continue
+            for idx in self.postings(concept):
+                c0, c1 = self.concept_offsets[idx], self.concept_offsets[idx + 1]
+                if self.category_codes[idx] == cc and concept_code in self.concept_ids[c0:c1]:
+                    conceptual.add(idx)
+        return literal, conceptual
+
+    def term_score(self, text, head_end, tag_score, needle, gua):
+        """與 retrieval.term_score 相同，在分塊的 UTF-8 位元組上計算；tag_score 為 keywords／概念命中分"""
+        score = tag_score
+        count = text.count(needle)
+        if not count:
+            return score
+        if text.find(needle, 0, head_end) != -1:
+            score += 4
+        if gua in text:
+            score += 6
+        return score + min(count, 3)
+
+    def search(self, keywords, category=None, limit=5):
+        """單筆查詢（與 Retriever.search 相同：逐塊計分，以大小為 limit 的最小堆積保留前幾名）"""
+        if category and category not in self.categories:
+            return []
+        category_code = self.categories.index(category) if category else None
+        # 每個關鍵字：(UTF-8, 「X卦」的 UTF-8, keywords 含關鍵字的分塊, concepts 含其概念 id 的分塊)
+        terms = [(kw.encode('utf-8'), (kw + "卦").encode('utf-8'), *self.tagged(kw, category_code))
+                 for kw in keywords]
+        data, offsets, head_ends, base = self.data, self.text_offsets, self.head_ends, self.heap_start
+        heap = []
+        for idx in range(len(self)):
+            if category and self.category_codes[idx] != category_code:
+                continue
+            prior = self.priors[idx]
+            self.visited += 1
+            # 只複製這一塊（暫時的 bytes），計分完即釋放
+            start = offsets[idx]
+            text = data[base + start:base + offsets[idx + 1]]
+            head_end = head_ends[idx] - start
+            score = sum(self.term_score(text, head_end,
+                                        KEYWORD_BONUS if idx in literal else CONCEPT_BONUS if idx in conceptual else 0,
+                                        needle, gua)
+                        for needle, gua, literal, conceptual in terms) * prior
+            if score <= 0:
+                continue
+            # 同分時較前面的分塊優先
+            item = (score, -idx)
+            if len(heap) < limit:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+        return [self.chunk(-neg_idx) for _, neg_idx in sorted(heap, reverse=True)]
+
+
+def _memory():
+    """(RSS, PSS) 位元組；PSS 把共用頁面依共用行程數平均分攤（Linux）"""
+    values = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    values[key] = int(rest.split()[0]) * 1024
+    except OSError:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        values = {"Rss": rss, "Pss": rss}
+    return values["Rss"], values["Pss"]
+
+
+def _worker(mode, kb_dir, queries, barrier, results):
+    """載入（私有副本或共用映射）→ 查詢 → 所有 worker 都載入完成後才量記憶體"""
+    from retrieval import Retriever
+
+    base_rss, base_pss = _memory()
+    t0 = time.perf_counter()
+    engine = Retriever.load(kb_dir) if mode == "private" else SharedCorpus.attach(kb_dir)
+    load = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for query in queries:
+        engine.search(*query)
+    elapsed = time.perf_counter() - t0
+
+    barrier.wait()
+    rss, pss = _memory()
+    results.put({"load": load, "per_query": elapsed / len(queries),
+                 "rss": rss - base_rss, "pss": pss - base_pss})
+    barrier.wait()
+
+
+def benchmark(workers=4, queries=100, seed=7, kb_dir=KB_DIR):
+    """N 個 worker：私有副本（各自 json.load）vs 共用映射，總記憶體增量與每筆查詢延遲"""
+    from retrieval import Retriever, _sample_queries
+
+    ensure_shared_corpus(kb_dir)
+    retriever = Retriever.load(kb_dir)
+    sample = _sample_queries(retriever.chunks, queries, random.Random(seed))
+    with SharedCorpus.attach(kb_dir) as corpus:
+        same = all([c["id"] for c in retriever.search(*q)] == [c["id"] for c in corpus.search(*q)]
+                   for q in sample)
+    size = (Path(kb_dir) / "corpus.bin").stat().st_size
+    del retriever
+
+    ctx = multiprocessing.get_context("spawn")
+    print(f"📊 {workers} 個 worker，各 {queries} 筆查詢（corpus.bin {size / (1 << 20):.1f} MB）")
+    for mode, label in (("private", "私有副本"), ("shared", "共用映射")):
+        barrier = ctx.Barrier(workers)
+        results = ctx.Queue()
+        procs = [ctx.Process(target=_worker, args=(mode, str(kb_dir), sample, barrier, results))
+                 for _ in range(workers)]
+        for proc in procs:
+            proc.start()
+        reports = [results.get() for _ in procs]
+        for proc in procs:
+            proc.join()
+        rss = sum(r["rss"] for r in reports) / (1 << 20)
+        pss = sum(r["pss"] for r in reports) / (1 << 20)
+        latency = sum(r["per_query"] for r in reports) / workers * 1000
+        load = sum(r["load"] for r in reports) / workers * 1000
+        print(f"   - {label}: RSS 合計 {rss:6.1f} MB  PSS 合計 {pss:6.1f} MB"
+              f"  載入 {load:6.1f} ms  每筆 {latency:.2f} ms")
+    print(f"   - 結果{'一致' if same else '不一致'}")
+
+
+def main():
+    if "--bench" in sys.argv:
+        workers = int(sys.argv[sys.argv.index("--workers") + 1]) if "--workers" in sys.argv else 4
+        benchmark(workers)
+        return
+
+    with open(KB_DIR / "rag_chunks.json", 'r', encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+    path = save_shared_corpus(chunks, KB_DIR)
+    print(f"✅ 共用語料完成（{len(chunks)} 個分塊，{path.stat().st_size / (1 << 20):.1f} MB）")
+    print(f"📄 共用語料: {path}")
+
+
+if __name__ == "__main__":
+    main()
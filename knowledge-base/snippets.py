@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+引用句索引
+為每個分塊預先記錄句子邊界位置、每句的 token 數，以及 術語 → 句子編號 的對照，
+引用古書時只需查表、二分搜尋與切片即可取出最適合的一句
+
+用法：
+    python snippets.py            # 建立 snippet_index.json
+    python snippets.py --bench    # 10,000 次取句基準測試
+"""
+import re
+import sys
+import json
+import time
+import random
+from bisect import bisect_right
+from pathlib import Path
+
+from aho_corasick import AhoCorasick
+from tokens import count_tokens
+
+KB_DIR = Path(__file__).resolve().parent
+
+# 句尾標點（含緊接的結束引號）
+SENTENCE_END_RE = re.compile(r"[。！？；][」』]?")
+
+DEFAULT_MAX_CHARS = 80
+
+
+def sentence_ends(text):
+    """回傳每個句子的結束位置（遞增）"""
+    ends = [m.end() for m in SENTENCE_END_RE.finditer(text)]
+    if not ends or ends[-1] < len(text):
+        ends.append(len(text))
+    return ends
+
+
+def build_snippet_index(chunks, previous=None):
+    """建立每個分塊的句子邊界、每句 token 數與 術語 → 句子編號 對照
+
+    術語表取自所有分塊的 keywords，一個自動機掃描全部分塊；
+    previous 為可沿用的舊項目（分塊 id → 項目，文字與術語表都未改變），這些分塊不再掃描
+    """
+    vocabulary = sorted({kw for chunk in chunks for kw in chunk.get("keywords", [])})
+    matcher = AhoCorasick({term: term for term in vocabulary})
+    previous = previous or {}
+
+    entries = {}
+    for chunk in chunks:
+        if chunk["id"] in previous:
+            entries[chunk["id"]] = previous[chunk["id"]]
+            continue
+        text = chunk["text"]
+        ends = sentence_ends(text)
+        terms = {}
+        for start, _, term in matcher.iter_all(text):
+            sid = bisect_right(ends, start)
+            sids = terms.setdefault(term, [])
+            if not sids or sids[-1] != sid:
+                sids.append(sid)
+        tokens = [count_tokens(text[start:end]) for start, end in zip([0] + ends[:-1], ends)]
+        entries[chunk["id"]] = {"ends": ends, "tokens": tokens, "terms": terms}
+
+    return {
+        "version": "1.0",
+        "vocabulary_size": len(vocabulary),
+        "chunks": entries,
+    }
+
+
+def save_snippet_index(chunks, output_dir, previous=None):
+    """建立並儲存 snippet_index.json"""
+    index = build_snippet_index(chunks, previous)
+    index_path = Path(output_dir) / "snippet_index.json"
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+    return index_path, index
+
+
+class SnippetStore:
+    """載入分塊文字與引用句索引，提供 best_snippet 查詢"""
+
+    def __init__(self, chunks, index):
+        self.texts = {chunk["id"]: chunk["text"] for chunk in chunks}
+        self.entries = index["chunks"]
+
+    @classmethod
+    def load(cls, kb_dir=KB_DIR):
+        with open(Path(kb_dir) / "rag_chunks.json", 'r', encoding='utf-8') as f:
+            chunks = json.load(f)["chunks"]
+        with open(Path(kb_dir) / "snippet_index.json", 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        return cls(chunks, index)
+
+    def best_snippet(self, chunk_id, keywords, max_chars=DEFAULT_MAX_CHARS):
+        """取出命中最多不同關鍵字的一句（同分取較前者），超過 max_chars 時截斷"""
+        text = self.texts[chunk_id]
+        entry = self.entries[chunk_id]
+        ends, terms = entry["ends"], entry["terms"]
+
+        hits = {}
+        for keyword in set(keywords):
+            sids = terms.get(keyword)
+            if sids is None:
+                # 不在術語表中的詞：找出所有出現位置，以二分搜尋換算成句子編號
+                sids = set()
+                pos = text.find(keyword)
+                while pos != -1:
+                    sids.add(bisect_right(ends, pos))
+                    pos = text.find(keyword, pos + 1)
+            for sid in sids:
+                hits[sid] = hits.get(sid, 0) + 1
+
+        sid = min(hits, key=lambda s: (-hits[s], s)) if hits else 0
+        start = ends[sid - 1] if sid else 0
+        sentence = text[start:ends[sid]].replace("\n", "").strip()
+
+        if len(sentence) <= max_chars:
+            return sentence
+        # 句子過長時，從第一個命中的關鍵字前一點開始截取
+        first = min((sentence.find(k) for k in keywords if k in sentence), default=0)
+        begin = max(0, min(first - max_chars // 4, len(sentence) - max_chars))
+        return sentence[begin:begin + max_chars - 1] + "…"
+
+
+_default_store = None
+
+
+def best_snippet(chunk_id, keywords, max_chars=DEFAULT_MAX_CHARS):
+    """以預設知識庫取出分塊中最適合引用的一句"""
+    global _default_store
+    if _default_store is None:
+        _default_store = SnippetStore.load()
+    return _default_store.best_snippet(chunk_id, keywords, max_chars)
+
+
+def _naive_snippet(text, keywords, max_chars=DEFAULT_MAX_CHARS):
+    """對照組：每次請求重新切句並逐句掃描"""
+    best, best_hits = "", -1
+    start = 0
+    for end in sentence_ends(text):
+        sentence = text[start:end]
+        hits = sum(1 for k in set(keywords) if k in sentence)
+        if hits > best_hits:
+            best, best_hits = sentence, hits
+        start = end
+    return best.replace("\n", "").strip()[:max_chars]
+
+
+def benchmark(requests=10000, seed=42):
+    """比較預先索引與請求時重新掃描的取句速度"""
+    with open(KB_DIR / "rag_chunks.json", 'r', encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+    store = SnippetStore(chunks, build_snippet_index(chunks))
+
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(requests):
+        chunk = rng.choice(chunks)
+        pool = chunk["keywords"] or ["之"]
+        queries.append((chunk["id"], rng.sample(pool, min(3, len(pool)))))
+
+    t0 = time.perf_counter()
+    for chunk_id, keywords in queries:
+        store.best_snippet(chunk_id, keywords)
+    indexed = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for chunk_id, keywords in queries:
+        _naive_snippet(store.texts[chunk_id], keywords)
+    naive = time.perf_counter() - t0
+
+    print(f"📊 {requests:,} 次取句")
+    print(f"   - 預先索引: {indexed * 1000:.1f} ms（每次 {indexed / requests * 1e6:.1f} µs）")
+    print(f"   - 重新掃描: {naive * 1000:.1f} ms（每次 {naive / requests * 1e6:.1f} µs）")
+    print(f"   - 加速: {naive / indexed:.1f}×")
+
+
+def main():
+    if "--bench" in sys.argv:
+        benchmark()
+        return
+
+    with open(KB_DIR / "rag_chunks.json", 'r', encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+    index_path, index = save_snippet_index(chunks, KB_DIR)
+
+    sentences = sum(len(e["ends"]) for e in index["chunks"].values())
+    print(f"✅ 引用句索引完成")
+    print(f"   - 分塊: {len(index['chunks'])}")
+    print(f"   - 句子: {sentences}")
+    print(f"   - 術語表: {index['vocabulary_size']}")
+    print(f"📄 索引檔案: {index_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+命理同義詞與關係詞展開（建置時）
+命盤關鍵字與古書用語常是同一概念的不同名稱：七殺／偏官、正印／印綬、交友宮／奴僕宮、
+生克／生剋，簡體本又寫成七杀、印绶；地支與生肖（子 ↔ 鼠）也常互換。
+同一寫法也可能在不同類別指不同概念：紫微的「七殺」是星曜（概念 id 七殺星），不是八字十神的七殺（偏官），
+紫微分塊中的這些寫法依 CATEGORY_CONCEPTS 標成星曜。
+這裡維護一張人工整理的對照表，建置時為每個分塊標上出現過的概念 id（正規名稱），
+存在分塊的 concepts 欄位；查詢時每個關鍵字依分塊類別查一次 concept_of 換成概念 id，
+不必把一個詞展開成多個詞逐一計分；只有概念相同（分塊 keywords 沒有這個詞）的分塊得到較少的加分
+
+標記規則：
+- 分塊 keywords 中的詞直接換成概念 id（依分塊類別，見 CATEGORY_CONCEPTS）
+- 全文只比對兩字以上的寫法；單字（干支、生肖）在行文中太常見（君子、白虎、潛龍、羊刃），
+  地支改以「屬鼠」「鼠年」等複合寫法比對
+
+用法：
+    python synonyms.py            # 為 rag_chunks.json 補上 concepts 並重建相關索引
+    python synonyms.py --bench    # 召回率、精確率與索引大小（相關性由章節標題判定）
+"""
+import sys
+import json
+import time
+from pathlib import Path
+
+from aho_corasick import AhoCorasick
+
+KB_DIR = Path(__file__).resolve().parent
+
+# 正規名稱 → 其他寫法（異名、簡體、俗寫）
+CONCEPTS = {
+    # 八字十神
+    "七殺": ["偏官", "七煞", "七杀"],
+    "正印": ["印綬", "印绶"],
+    "偏印": ["梟神", "枭神", "梟印", "枭印", "倒食"],
+    "劫財": ["劫财", "敗財", "败财"],
+    "傷官": ["伤官"],
+    "偏財": ["偏财"],
+    "正財": ["正财"],
+    # 八字神煞、十二長生
+    "羊刃": ["陽刃", "阳刃"],
+    "臨官": ["建祿", "建禄", "临官"],
+    "長生": ["长生"],
+    "冠帶": ["冠带"],
+    "日主": ["日元", "日干"],
+    "大運": ["大运"],
+    "生克": ["生剋"],
+    "相剋": ["相克"],
+    "陰陽": ["阴阳"],
+    # 紫微宮位（古稱、今稱、簡體）
+    "交友宮": ["奴僕宮", "僕役宮", "交友宫", "奴仆宫", "仆役宫"],
+    "事業宮": ["官祿宮", "官禄宫", "事业宫"],
+    "命宮": ["命宫"],
+    "兄弟宮": ["兄弟宫"],
+    "夫妻宮": ["夫妻宫"],
+    "子女宮": ["子女宫"],
+    "財帛宮": ["财帛宫"],
+    "疾厄宮": ["疾厄宫"],
+    "遷移宮": ["迁移宫"],
+    "田宅宮": ["田宅宫"],
+    "福德宮": ["福德宫"],
+    "父母宮": ["父母宫"],
+    # 紫微星曜與四化
+    "紫微": ["紫薇"],
+    "天機": ["天机"],
+    "廉貞": ["廉贞"],
+    "貪狼": ["贪狼"],
+    "巨門": ["巨门"],
+    "天梁": ["天樑"],
+    "破軍": ["破军"],
+    "七殺星": ["七杀星"],
+    "左輔": ["左辅"],
+    "天鉞": ["天钺"],
+    "祿存": ["禄存"],
+    "天馬": ["天马"],
+    "陀羅": ["陀罗"],
+    "鈴星": ["铃星"],
+    "化祿": ["化禄"],
+    "化權": ["化权"],
+    "飛化": ["飞化"],
+    # 易經
+    "太極": ["太极"],
+    "兩儀": ["两仪"],
+}
+
+# 地支 → 生肖（繁、簡）
+ZODIAC = {
+    "子": ["鼠"], "丑": ["牛"], "寅": ["虎"], "卯": ["兔"], "辰": ["龍", "龙"], "巳": ["蛇"],
+    "午": ["馬", "马"], "未": ["羊"], "申": ["猴"], "酉": ["雞", "鸡"], "戌": ["狗"], "亥": ["豬", "猪"],
+}
+ZODIAC_FORMS = ("屬{}", "属{}", "肖{}", "{}年")
+
+# 類別 → 在該類別改指其他概念的寫法（覆蓋 CONCEPTS 的對應）
+CATEGORY_CONCEPTS = {
+    "紫微": {"七殺": "七殺星", "七杀": "七殺星", "七煞": "七殺星"},
+}
+
+
+def _build_tables():
+    """回傳 (查詢用：寫法 → 概念 id, 全文比對用：兩字以上寫法 → 概念 id)"""
+    concept_of, text_forms = {}, {}
+    for canonical, aliases in CONCEPTS.items():
+        for form in (canonical, *aliases):
+            concept_of[form] = canonical
+            text_forms[form] = canonical
+    for branch, animals in ZODIAC.items():
+        concept_of[branch] = branch
+        for animal in animals:
+            concept_of[animal] = branch
+            for pattern in ZODIAC_FORMS:
+                form = pattern.format(animal)
+                concept_of[form] = branch
+                text_forms[form] = branch
+    return concept_of, text_forms
+
+
+CONCEPT_OF, TEXT_FORMS = _build_tables()
+_matcher = None
+
+
+def concept_of(term, category=None):
+    """寫法 → 概念 id（指定類別時先查 CATEGORY_CONCEPTS）；不在對照表中時回傳 None"""
+    concept = CATEGORY_CONCEPTS.get(category, {}).get(term)
+    return concept if concept is not None else CONCEPT_OF.get(term)
+
+
+def text_forms(term, category=None):
+    """詞所屬概念在全文中比對的所有寫法（取引用句時用；不在對照表中時只有詞本身）
+    指定類別時依該類別的概念：紫微的七殺星含七殺、七杀、七煞，偏官則不含這些寫法；
+    不指定時七殺星含各類別改指它的寫法"""
+    concept = concept_of(term, category)
+    if concept is None:
+        return [term]
+    overrides = CATEGORY_CONCEPTS.get(category, {})
+    forms = [form for form, value in TEXT_FORMS.items()
+             if value == concept and form != term and overrides.get(form, concept) == concept]
+    for table in (CATEGORY_CONCEPTS.values() if category is None else (overrides,)):
+        forms.extend(form for form, value in table.items() if value == concept and form != term and form not in forms)
+    return [term] + forms
+
+
+def chunk_concepts(chunk):
+    """分塊涉及的概念 id（依字典序）"""
+    global _matcher
+    if _matcher is None:
+        _matcher = AhoCorasick(TEXT_FORMS)
+    category, text = chunk.get("category"), chunk["text"]
+    concepts = {concept_of(kw, category) for kw in chunk.get("keywords", []) if kw in CONCEPT_OF}
+    concepts.update(concept_of(text[start:end], category) for start, end, _ in _matcher.iter_all(text))
+    return sorted(concepts)
+
+
+def assign_concepts(chunks):
+    """為每個分塊加上 concepts 欄位"""
+    for chunk in chunks:
+        chunk["concepts"] = chunk_concepts(chunk)
+    return chunks
+
+
+def save_synonyms(output_dir):
+    """寫入 synonyms.json（rag.ts 查詢時換成概念 id 用）"""
+    synonyms_path = Path(output_dir) / "synonyms.json"
+    with open(synonyms_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "version": "1.1",
+            "concept_of": CONCEPT_OF,
+            "category_concepts": CATEGORY_CONCEPTS,
+        }, f, ensure_ascii=False, indent=2)
+    return synonyms_path
+
+
+def _title_topics(chunks):
+    """概念 id → 章節標題含該概念任一寫法的分塊（依分塊類別判定概念；與 concepts 標記無關）"""
+    topics = {}
+    for idx, chunk in enumerate(chunks):
+        title = chunk.get("title") or ""
+        for form in TEXT_FORMS:
+            if form in title:
+                topics.setdefault(concept_of(form, chunk["category"]), set()).add(idx)
+    return topics
+
+
+def benchmark(chunks, limit=10):
+    """每個概念的每種寫法各查一次：展開前後的召回率與精確率，以及索引大小
+
+    相關分塊以章節標題判定（如 rerank.py 的評估集）：標題含該概念任一寫法的分塊。
+    concepts 標記由全文比對而來，以它當相關標準會讓展開後的召回率必然是 100%
+    """
+    from retrieval import Retriever
+    from chapter_index import build_chapter_index
+
+    expanded = Retriever(chunks)
+    literal = Retriever(chunks, expand=False)
+    relevant = _title_topics(chunks)
+    idx_of = {id(chunk): idx for idx, chunk in enumerate(chunks)}
+
+    # [展開前, 展開後, 分母]
+    rows = {"any": [0, 0, 0], "top": [0, 0, 0], "hit": [0, 0, 0], "precision": [0, 0, 0], "foreign": [0, 0, 0],
+            "category_top": [0, 0, 0], "category_precision": [0, 0, 0]}
+    queries = [form for form, concept in CONCEPT_OF.items() if concept in relevant]
+    t0 = time.perf_counter()
+    for form in queries:
+        targets = relevant[CONCEPT_OF[form]]
+        categories = {chunks[idx]["category"] for idx in targets}
+        for i, retriever in enumerate((literal, expanded)):
+            rows["any"][i] += sum(1 for idx in targets if retriever.chunk_score(idx, [form]) > 0)
+            top = [idx_of[id(c)] for c in retriever.search([form], limit=limit)]
+            hits = sum(1 for idx in top if idx in targets)
+            rows["top"][i] += hits
+            rows["hit"][i] += hits > 0
+            rows["precision"][i] += hits / limit
+            # 其他類別的結果（如查八字的偏官卻取到紫微的七殺星）
+            rows["foreign"][i] += sum(1 for idx in top if chunks[idx]["category"] not in categories) / limit
+            # 指定相關分塊的類別查詢（依該類別的概念，如紫微的七杀 → 七殺星）
+            for category in categories:
+                in_category = {idx for idx in targets if chunks[idx]["category"] == category}
+                top = [idx_of[id(c)] for c in retriever.search([form], category, limit)]
+                hits = sum(1 for idx in top if idx in in_category)
+                rows["category_top"][i] += hits
+                rows["category_precision"][i] += hits / limit
+                if i:
+                    rows["category_top"][2] += min(limit, len(in_category))
+                    rows["category_precision"][2] += 1
+        rows["any"][2] += len(targets)
+        rows["top"][2] += min(limit, len(targets))
+        rows["hit"][2] += 1
+        rows["precision"][2] += 1
+        rows["foreign"][2] += 1
+    elapsed = time.perf_counter() - t0
+
+    def size(items):
+        return len(json.dumps({"chunks": items}, ensure_ascii=False, indent=2).encode('utf-8'))
+
+    bare = [{k: v for k, v in c.items() if k != "concepts"} for c in chunks]
+    chapter_bytes = len(json.dumps(build_chapter_index(chunks), ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+    chapter_literal = len(json.dumps(build_chapter_index(bare, expand=False), ensure_ascii=False,
+                                     separators=(',', ':')).encode('utf-8'))
+    synonyms_bytes = len(json.dumps({"concept_of": CONCEPT_OF, "category_concepts": CATEGORY_CONCEPTS},
+                                    ensure_ascii=False, indent=2).encode('utf-8'))
+
+    def rate(key):
+        before, after, total = rows[key]
+        return f"{before / total:.1%} → {after / total:.1%}"
+
+    print(f"📊 {len(queries)} 個單詞查詢（{len(relevant)} 個概念，相關分塊依章節標題，{elapsed:.1f} 秒）")
+    print(f"   - 有分數的相關分塊: {rate('any')}")
+    print(f"   - 前 {limit} 名召回: {rate('top')}")
+    print(f"   - 前 {limit} 名有相關分塊的查詢: {rate('hit')}")
+    print(f"   - 前 {limit} 名精確率: {rate('precision')}")
+    print(f"   - 前 {limit} 名中其他類別的分塊: {rate('foreign')}")
+    print(f"   - 指定類別時前 {limit} 名召回: {rate('category_top')}")
+    print(f"   - 指定類別時前 {limit} 名精確率: {rate('category_precision')}")
+    print(f"   - rag_chunks.json: {size(bare) / (1 << 20):.2f} MB → {size(chunks) / (1 << 20):.2f} MB")
+    print(f"   - chapter_index.json: {chapter_literal / 1024:.0f} KB → {chapter_bytes / 1024:.0f} KB")
+    print(f"   - synonyms.json: {synonyms_bytes / 1024:.1f} KB")
+
+
+def main():
+    chunks_path = KB_DIR / "rag_chunks.json"
+    with open(chunks_path, 'r', encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+    assign_concepts(chunks)
+
+    if "--bench" in sys.argv:
+        benchmark(chunks)
+        return
+
+    from chunk_stream import build_offsets
+    from chunk_ids import save_changes
+    from chapter_index import save_chapter_index
+
+    with open(chunks_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "version": "1.0",
+            "total_chunks": len(chunks),
+            "chunks": chunks
+        }, f, ensure_ascii=False, indent=2)
+    build_offsets(chunks_path)
+    # concepts 屬於中繼資料，下游只需更新欄位
+    save_changes(chunks, KB_DIR)
+    save_chapter_index(chunks, KB_DIR)
+    synonyms_path = save_synonyms(KB_DIR)
+
+    tagged = sum(1 for chunk in chunks if chunk["concepts"])
+    print(f"✅ 概念標記完成（{len(chunks)} 個分塊）")
+    print(f"   - 對照表: {len(CONCEPTS) + len(ZODIAC)} 個概念、{len(CONCEPT_OF)} 種寫法")
+    print(f"   - 有概念的分塊: {tagged}，平均每塊 {sum(len(c['concepts']) for c in chunks) / len(chunks):.1f} 個")
+    print(f"📄 RAG 分塊: {chunks_path}")
+    print(f"📄 同義詞表: {synonyms_path}")
+
+
+if __name__ == "__main__":
+    main()
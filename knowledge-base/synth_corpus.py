@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+合成測試語料
+原始書檔不在版本庫內，無法測試處理流程在大檔案上的表現。這裡以現有分塊的句子為素材，
+產生形似古籍 OCR 文字檔的書：篇／章／節／條目標題、開頭的目錄區塊、OCR 雜訊（亂碼、誤認字、
+斷行、換頁），也能輸出 ePub。邊產生邊寫檔，1 GB 的書也只占用少量記憶體
+
+用法：
+    python synth_corpus.py --size 10MB --out /tmp/synth              # 產生一本 10 MB 的 .txt
+    python synth_corpus.py --size 1GB --out /tmp/synth --count 2
+    python synth_corpus.py --size 5MB --out /tmp/synth --epub        # 產生 ePub
+"""
+import sys
+import json
+import random
+import itertools
+import zipfile
+from pathlib import Path
+
+from snippets import sentence_ends
+
+KB_DIR = Path(__file__).resolve().parent
+
+# OCR 常見的亂碼字元與誤認字（正確字 → 誤認字）
+GARBAGE_CHARS = "□■▯�ſ¦|~^_#@$%&*"
+MISREAD = {"與": "輿", "戌": "戍", "日": "曰", "未": "末", "土": "士", "己": "已", "間": "閒"}
+
+CHINESE_DIGITS = "零一二三四五六七八九"
+
+# 書的結構（每篇幾章、每章幾節、每節幾條）與每條的段落數
+CHAPTERS_PER_PART = (3, 8)
+SECTIONS_PER_CHAPTER = (0, 4)
+ITEMS_PER_SECTION = (0, 5)
+PARAGRAPHS_PER_BLOCK = (2, 8)
+SENTENCES_PER_PARAGRAPH = (2, 9)
+LINE_WIDTH = (18, 36)
+PAGE_CHARS = 2000
+# 開頭目錄列出的篇、章標題數
+TOC_LINES = 40
+
+
+def parse_size(value):
+    """'10MB'、'1GB'、'512KB' → 位元組數"""
+    units = {"KB": 1 << 10, "MB": 1 << 20, "GB": 1 << 30}
+    value = value.strip().upper()
+    for unit, factor in units.items():
+        if value.endswith(unit):
+            return int(float(value[:-len(unit)]) * factor)
+    return int(value)
+
+
+def chinese_number(n):
+    """1-99 → 中文數字（一、十、十二、二十三）；100 以上用阿拉伯數字"""
+    if n >= 100:
+        return str(n)
+    if n < 10:
+        return CHINESE_DIGITS[n]
+    tens, ones = divmod(n, 10)
+    head = "" if tens == 1 else CHINESE_DIGITS[tens]
+    return head + "十" + (CHINESE_DIGITS[ones] if ones else "")
+
+
+def load_sentences(kb_dir=KB_DIR):
+    """從現有分塊切出句子作為素材（去掉原有換行）"""
+    with open(Path(kb_dir) / "rag_chunks.json", 'r', encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+    sentences = []
+    for chunk in chunks:
+        text = chunk["text"].replace("\n", "")
+        start = 0
+        for end in sentence_ends(text):
+            sentence = text[start:end].strip()
+            if 4 <= len(sentence) <= 120:
+                sentences.append(sentence)
+            start = end
+    return sentences
+
+
+class SyntheticCorpus:
+    """以句子素材產生合成書籍"""
+
+    def __init__(self, seed=0, noise=0.02, sentences=None):
+        self.rng = random.Random(seed)
+        self.noise = noise
+        self.sentences = sentences if sentences is not None else load_sentences()
+        self.titles = [s.rstrip("。！？；」』")[:12] for s in self.sentences if len(s) >= 6]
+
+    def _title(self):
+        return self.rng.choice(self.titles)
+
+    def _paragraph(self):
+        rng = self.rng
+        text = "".join(rng.choices(self.sentences, k=rng.randint(*SENTENCES_PER_PARAGRAPH)))
+        if self.noise:
+            text = self._add_noise(text)
+        # 依掃描版面斷行
+        width = rng.randint(*LINE_WIDTH)
+        return "\n".join(text[i:i + width] for i in range(0, len(text), width))
+
+    def _add_noise(self, text):
+        """亂碼與誤認字：每字約 noise 的機率"""
+        rng = self.rng
+        count = int(len(text) * self.noise * rng.random() * 2)
+        if not count:
+            return text
+        chars = list(text)
+        for _ in range(count):
+            i = rng.randrange(len(chars))
+            chars[i] = MISREAD.get(chars[i]) or rng.choice(GARBAGE_CHARS)
+        return "".join(chars)
+
+    def _headings(self):
+        """無限產生標題行：[(層級, 標題行)]，依篇 → 章 → 節／小節 → 條目的順序"""
+        rng = self.rng
+        part = chapter = 0
+        while True:
+            part += 1
+            yield "part", f"第{chinese_number(part)}篇 {self._title()}"
+            for _ in range(rng.randint(*CHAPTERS_PER_PART)):
+                chapter += 1
+                yield "chapter", f"第{chapter}章 {self._title()}"
+                for s in range(1, rng.randint(*SECTIONS_PER_CHAPTER) + 1):
+                    if rng.random() < 0.5:
+                        yield "section", f"第{chinese_number(s)}節 {self._title()}"
+                    else:
+                        yield "subsection", f"{chapter}.{s} {self._title()}"
+                    for item in range(1, rng.randint(*ITEMS_PER_SECTION) + 1):
+                        yield "item", f"{chinese_number(item)}、{self._title()}"
+
+    def iter_book(self, size_bytes):
+        """逐段產生一本約 size_bytes（UTF-8）的書"""
+        rng = self.rng
+        headings = self._headings()
+
+        # 開頭的目錄：先取出前 TOC_LINES 個篇、章標題，正文再依序使用
+        lookahead, toc = [], []
+        while len(toc) < TOC_LINES:
+            level, line = next(headings)
+            lookahead.append((level, line))
+            if level in ("part", "chapter"):
+                toc.append(line)
+        yield "目 錄\n" + "\n".join(toc) + "\n\n"
+        yield "前言\n" + self._paragraph() + "\n\n"
+
+        written = 0
+        page = 0
+        for _, line in itertools.chain(lookahead, headings):
+            if written >= size_bytes:
+                break
+            parts = [line]
+            for _ in range(rng.randint(*PARAGRAPHS_PER_BLOCK)):
+                parts.append(self._paragraph())
+                page += len(parts[-1])
+                if page >= PAGE_CHARS:
+                    parts.append("\f")
+                    page = 0
+            block = "\n\n".join(parts) + "\n\n"
+            written += len(block.encode('utf-8'))
+            yield block
+
+    def book_text(self, size_bytes):
+        return "".join(self.iter_book(size_bytes))
+
+    def write_book(self, path, size_bytes):
+        with open(path, 'w', encoding='utf-8') as f:
+            for piece in self.iter_book(size_bytes):
+                f.write(piece)
+        return Path(path)
+
+    def write_epub(self, path, size_bytes, chapter_bytes=20000):
+        """產生 ePub：每章一個 xhtml（湊滿 chapter_bytes 就寫入），OPF 的 spine 依序排列，另附 toc.xhtml"""
+        manifest, spine, toc = [], [], []
+
+        def write_chapter(zf, text):
+            i = len(manifest) + 1
+            name = f"chapter{i:04d}.xhtml"
+            title = text.strip().split("\n", 1)[0][:30]
+            paragraphs = "".join(f"<p>{p}</p>" for p in text.split("\n\n") if p.strip())
+            zf.writestr(f"OEBPS/{name}", (
+                '<?xml version="1.0" encoding="utf-8"?><html xmlns="http://www.w3.org/1999/xhtml">'
+                f'<head><title>{title}</title></head><body><h2>{title}</h2>{paragraphs}</body></html>'))
+            manifest.append(f'<item id="c{i}" href="{name}" media-type="application/xhtml+xml"/>')
+            spine.append(f'<itemref idref="c{i}"/>')
+            toc.append(f'<li><a href="{name}">{title}</a></li>')
+
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+            zf.writestr("META-INF/container.xml", (
+                '<?xml version="1.0"?><container version="1.0" '
+                'xmlns="urn:oasis:names:tc:opendocument:xmlns:container"><rootfiles>'
+                '<rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+                '</rootfiles></container>'))
+
+            current, length = [], 0
+            for block in self.iter_book(size_bytes):
+                current.append(block)
+                length += len(block.encode('utf-8'))
+                if length >= chapter_bytes:
+                    write_chapter(zf, "".join(current))
+                    current, length = [], 0
+            if current:
+                write_chapter(zf, "".join(current))
+
+            zf.writestr("OEBPS/toc.xhtml", f'<html><body><ol>{"".join(toc)}</ol></body></html>')
+            zf.writestr("OEBPS/content.opf", (
+                '<?xml version="1.0" encoding="utf-8"?><package version="3.0">'
+                f'<manifest>{"".join(manifest)}</manifest><spine>{"".join(spine)}</spine></package>'))
+        return Path(path)
+
+
+def main():
+    args = sys.argv[1:]
+
+    def option(flag, default):
+        return args[args.index(flag) + 1] if flag in args else default
+
+    size = parse_size(option("--size", "1MB"))
+    out_dir = Path(option("--out", "synth"))
+    count = int(option("--count", "1"))
+    seed = int(option("--seed", "0"))
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    corpus = SyntheticCorpus(seed=seed)
+    print(f"🔧 素材句子: {len(corpus.sentences):,}")
+    for i in range(1, count + 1):
+        if "--epub" in args:
+            path = corpus.write_epub(out_dir / f"synth_{i:02d}.epub", size)
+        else:
+            path = corpus.write_book(out_dir / f"synth_{i:02d}.txt", size)
+        print(f"  ✅ {path}（{path.stat().st_size / (1 << 20):,.1f} MB）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+"""knowledge-base 的模組都是平放的腳本，測試時把上一層加入匯入路徑"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,17 @@
+"""chunk_store：ChunkView.to_dict 還原成與 rag_chunks.json 相同的分塊"""
+import json
+import os
+
+from chunk_store import ChunkStore
+
+KB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_current_chunks_round_trip():
+    with open(os.path.join(KB_DIR, "rag_chunks.json"), encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+    store = ChunkStore.from_chunks(chunks)
+    assert len(store) == len(chunks)
+    for view, chunk in zip(store, chunks):
+        assert view.to_dict() == chunk, chunk["id"]
+    assert store.get(chunks[-1]["id"]).tokens == chunks[-1]["tokens"]
@@ -0,0 +1,84 @@
+"""chunk_stream：追加、位移索引與指紋"""
+import json
+
+from chunk_stream import (append_chunks, append_items, build_offsets, iter_chunks, load_offsets,
+                          offsets_path, read_header)
+
+
+def _chunk(i, source="甲書", category="八字"):
+    return {"id": f"{category}_{source}_{i}", "category": category, "source": source,
+            "content": f"第{i}段 甲子\"引號\" \\ 反斜線 {{大括號}} [方括號]"}
+
+
+def _write(path, chunks):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"version": "1.0", "total_chunks": len(chunks), "chunks": chunks},
+                  f, ensure_ascii=False, indent=2)
+
+
+def test_stream_matches_json_load(tmp_path):
+    path = tmp_path / "rag_chunks.json"
+    chunks = [_chunk(i, source="甲書" if i % 2 else "乙書") for i in range(20)]
+    _write(path, chunks)
+    assert list(iter_chunks(path, use_offsets=False)) == chunks
+    build_offsets(path)
+    assert list(iter_chunks(path, source="乙書")) == [c for c in chunks if c["source"] == "乙書"]
+
+
+def test_append_matches_full_dump(tmp_path):
+    path, expected = tmp_path / "rag_chunks.json", tmp_path / "expected.json"
+    old, new = [_chunk(i) for i in range(5)], [_chunk(i, source="乙書") for i in range(3)]
+    _write(path, old)
+    build_offsets(path)
+
+    def bump_total(header):
+        header["total_chunks"] += len(new)
+    append_chunks(path, new, update_header=bump_total)
+    _write(expected, old + new)
+    assert path.read_bytes() == expected.read_bytes()
+    assert list(iter_chunks(path)) == old + new
+
+
+def test_append_with_longer_header_shifts_offsets(tmp_path):
+    """檔頭變長時檔案整份重寫，原有分塊的位移也要跟著平移"""
+    path = tmp_path / "rag_chunks.json"
+    old, new = [_chunk(i) for i in range(5)], [_chunk(i, source="乙書") for i in range(3)]
+    _write(path, old)
+    build_offsets(path)
+
+    def bump_total(header):
+        header["total_chunks"] = 123456
+    append_chunks(path, new, update_header=bump_total)
+
+    assert read_header(path, "chunks")[0]["total_chunks"] == 123456
+    index = load_offsets(path, rebuild=False)
+    assert index is not None
+    assert list(iter_chunks(path, source="甲書")) == old
+    assert list(iter_chunks(path, source="乙書")) == new
+    # 追加後的位移索引與整份重新掃描的結果相同
+    assert index["entries"] == build_offsets(path)["entries"]
+
+
+def test_append_items_to_empty_array(tmp_path):
+    path = tmp_path / "index.json"
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"version": "1.0", "entries": []}, f, ensure_ascii=False, indent=2)
+    items = [{"source": "甲書", "title": "序"}]
+    append_items(path, "entries", items)
+    with open(path, 'r', encoding='utf-8') as f:
+        assert json.load(f)["entries"] == items
+
+
+def test_offsets_rejected_after_same_size_edit(tmp_path):
+    """中段改寫而檔案大小不變時，位移索引視為過期"""
+    path = tmp_path / "rag_chunks.json"
+    chunks = [_chunk(i) for i in range(2000)]
+    _write(path, chunks)
+    build_offsets(path)
+    data = path.read_bytes()
+    middle = data.index("第1000段".encode('utf-8'))
+    path.write_bytes(data[:middle] + "第1001段".encode('utf-8') + data[middle + len("第1000段".encode('utf-8')):])
+
+    assert load_offsets(path, rebuild=False) is None
+    assert offsets_path(path).exists()
+    assert [c["content"][:6] for c in iter_chunks(path)][1000] == "第1001段"
@@ -0,0 +1,117 @@
+"""generations：發佈 → 驗證 → 清理、匯出到扁平目錄與讀取端租約"""
+import json
+
+import generations
+from generations import (LiveGeneration, begin_generation, collect_garbage, current_generation,
+                         export_generation, leased_generations, list_generations, publish, resolve, verify)
+
+
+def _seed(kb_dir):
+    (kb_dir / "rag_chunks.json").write_text('{"chunks": []}', encoding='utf-8')
+    (kb_dir / "index.json").write_text('{"entries": []}', encoding='utf-8')
+    (kb_dir / "八字").mkdir()
+    (kb_dir / "八字" / "子平真詮_001.md").write_text("# 論十干", encoding='utf-8')
+    (kb_dir / "process_books_v2.py").write_text("", encoding='utf-8')
+
+
+def _build(kb_dir, files=None, remove=()):
+    staging = begin_generation(kb_dir)
+    for rel, text in (files or {}).items():
+        (staging / rel).parent.mkdir(parents=True, exist_ok=True)
+        (staging / rel).write_text(text, encoding='utf-8')
+    for rel in remove:
+        (staging / rel).unlink()
+    return publish(staging, kb_dir)
+
+
+def test_publish_verify_gc(tmp_path):
+    _seed(tmp_path)
+    first = _build(tmp_path)
+    assert current_generation(tmp_path) == first.name and resolve(tmp_path) == first
+    assert verify(first) == []
+    manifest = json.loads((first / "generation.json").read_text(encoding='utf-8'))
+    assert sorted(manifest["files"]) == ["index.json", "rag_chunks.json", "八字/子平真詮_001.md"]
+
+    (first / "index.json").write_text('{"entries": [1]}', encoding='utf-8')
+    assert verify(first) == ["index.json"]
+
+    built = [_build(tmp_path, {"rag_chunks.json": f'{{"chunks": [{i}]}}'}).name for i in range(5)]
+    assert list_generations(tmp_path) == built[-3:]
+    assert current_generation(tmp_path) == built[-1]
+    assert not (tmp_path / "generations" / first.name).exists()
+
+
+def test_gc_keeps_leased_generation(tmp_path):
+    _seed(tmp_path)
+    _build(tmp_path)
+    with LiveGeneration(lambda path: path, tmp_path, interval=60) as live:
+        pinned = live.generation
+        for i in range(4):
+            _build(tmp_path, {"rag_chunks.json": f'{{"chunks": [{i}]}}'})
+        assert pinned in leased_generations(tmp_path)
+        assert pinned in list_generations(tmp_path)
+        assert live.poll() and live.get() == resolve(tmp_path)
+    collect_garbage(tmp_path)
+    assert pinned not in list_generations(tmp_path)
+
+
+def test_live_generation_loads_the_leased_generation(tmp_path, monkeypatch):
+    """取得租約與載入之間若發佈了新世代，租約、世代 id 與載入的資料仍指向同一個世代"""
+    _seed(tmp_path)
+    _build(tmp_path)
+    acquire = generations.acquire_lease
+
+    def acquire_then_publish(kb_dir, generation):
+        lease = acquire(kb_dir, generation)
+        _build(kb_dir, {"rag_chunks.json": '{"chunks": [1]}'})
+        return lease
+
+    monkeypatch.setattr(generations, "acquire_lease", acquire_then_publish)
+    live = LiveGeneration(lambda path: path, tmp_path)
+    monkeypatch.setattr(generations, "acquire_lease", acquire)
+    assert live.get().name == live.generation
+    assert live.lease.name.startswith(live.generation + ".")
+    assert live.generation != current_generation(tmp_path)
+    live.close()
+
+
+def test_export_replaces_and_removes_dropped_artifacts(tmp_path):
+    _seed(tmp_path)
+    export_generation(_build(tmp_path), tmp_path)
+    generation = _build(tmp_path, {"八字/子平真詮_002.md": "# 論陰陽生剋", "紫微/斗數全書_001.md": "# 太微賦"},
+                        remove=["八字/子平真詮_001.md"])
+    export_generation(generation, tmp_path)
+    assert (tmp_path / "八字" / "子平真詮_002.md").read_text(encoding='utf-8') == "# 論陰陽生剋"
+    assert not (tmp_path / "八字" / "子平真詮_001.md").exists()
+    assert (tmp_path / "process_books_v2.py").exists()
+
+    generation = _build(tmp_path, remove=["紫微/斗數全書_001.md"])
+    assert export_generation(generation, tmp_path) == 1
+    assert not (tmp_path / "紫微").exists()
+    assert export_generation(generation, tmp_path) == 0
+
+
+def test_export_only_removes_previously_exported_files(tmp_path):
+    """扁平目錄中不是由匯出產生的檔案（手動放的筆記、其他工具的輸出）不因不在新世代而被刪除"""
+    _seed(tmp_path)
+    export_generation(_build(tmp_path), tmp_path)
+    (tmp_path / "notes.txt").write_text("待校對", encoding='utf-8')
+    (tmp_path / "紫微").mkdir()
+    (tmp_path / "紫微" / "草稿.md").write_text("# 未發佈", encoding='utf-8')
+
+    generation = _build(tmp_path, remove=["八字/子平真詮_001.md"])
+    assert export_generation(generation, tmp_path) == 1
+    assert not (tmp_path / "八字").exists()
+    assert (tmp_path / "notes.txt").exists() and (tmp_path / "紫微" / "草稿.md").exists()
+    assert json.loads((tmp_path / ".exported.json").read_text(encoding='utf-8'))["files"] == \
+        ["index.json", "rag_chunks.json"]
+
+
+def test_text_store_not_seeded(tmp_path):
+    """壓縮文字只在 --compress 時重建，新世代不沿用上一版"""
+    _seed(tmp_path)
+    (tmp_path / "chunk_text.idx.json").write_text('{"ids": []}', encoding='utf-8')
+    first = _build(tmp_path, {"chunk_text.bin": ""})
+    assert (first / "chunk_text.bin").exists() and not (first / "chunk_text.idx.json").exists()
+    second = _build(tmp_path, {"rag_chunks.json": '{"chunks": [1]}'})
+    assert not (second / "chunk_text.bin").exists()
@@ -0,0 +1,26 @@
+"""ingest：逐行讀取、邊讀邊評分與切章節，結果與讀入全文後處理相同"""
+from ingest import SourceFile, iter_clean_lines, read_source
+from ocr_quality import PageScorer, score_book
+from process_books_v2 import smart_split, split_sections
+from synth_corpus import SyntheticCorpus
+
+
+def test_streamed_lines_match_whole_text(tmp_path):
+    path = SyntheticCorpus(seed=3).write_book(tmp_path / "synth.txt", 200_000)
+    text, _ = read_source(path)
+    scorer = PageScorer()
+    # 小視窗：行、頁與章節都會跨視窗
+    with SourceFile(path, window_bytes=4096) as source:
+        lines = [scorer.feed(line) for line in iter_clean_lines(source)]
+    assert "".join(lines) == text
+    assert scorer.report() == score_book(text)
+    sections = split_sections(lines)
+    assert len(sections) >= 3 and sections == smart_split(text, "synth")
+
+
+def test_lookahead_skips_table_of_contents():
+    """下一行也是標題、目前內容又很少時視為目錄，不開新章節"""
+    body = "甲子日主，" * 30
+    lines = iter(["第一章 論用神", "第二章 論格局", "", "第一章 論用神", body, "第二章 論格局", body])
+    sections = split_sections(lines)
+    assert [s["title"] for s in sections] == ["論用神", "論格局"]
@@ -0,0 +1,44 @@
+"""phrase_index：後綴陣列／LCP 的建立、存檔與載入"""
+import json
+
+from phrase_index import PhraseIndex, build_lcp, build_suffix_array
+
+TEXTS = ["傷官見官，為禍百端。甲子日生", "論傷官：傷官見官為禍百端", "正印逢財，貪財壞印"]
+
+
+def _write(kb_dir, texts):
+    chunks = [{"id": f"c{i}", "category": "八字", "source": f"書{i}", "text": t} for i, t in enumerate(texts)]
+    with open(kb_dir / "rag_chunks.json", 'w', encoding='utf-8') as f:
+        json.dump({"version": "1.0", "chunks": chunks}, f, ensure_ascii=False)
+    return chunks
+
+
+def test_suffix_array_and_lcp_match_naive():
+    text = "甲子乙丑甲子丙寅\x00甲子乙\x00"
+    sa = build_suffix_array(text)
+    assert list(sa) == sorted(range(len(text)), key=lambda i: text[i:])
+    lcp = build_lcp(text, sa)
+    for r in range(1, len(sa)):
+        a, b = text[sa[r - 1]:], text[sa[r]:]
+        h = 0
+        while h < min(len(a), len(b)) and a[h] == b[h] and a[h] != "\x00":
+            h += 1
+        assert lcp[r] == h
+
+
+def test_load_round_trip(tmp_path):
+    _write(tmp_path, TEXTS)
+    built = PhraseIndex.load(tmp_path)
+    loaded = PhraseIndex.load(tmp_path)
+    assert loaded.sa == built.sa and loaded.lcp == built.lcp
+    assert [hit["chunk"]["id"] for hit in loaded.find("傷官見官為禍百端")] == ["c0", "c1"]
+
+
+def test_load_rebuilds_after_same_length_edit(tmp_path):
+    """語料長度不變但內容改了，快取的後綴陣列不可沿用"""
+    _write(tmp_path, TEXTS)
+    PhraseIndex.load(tmp_path)
+    _write(tmp_path, [TEXTS[0], "論傷官：傷官見官為福百端", TEXTS[2]])
+    index = PhraseIndex.load(tmp_path)
+    assert list(index.sa) == list(build_suffix_array(index.text))
+    assert [hit["chunk"]["id"] for hit in index.find("傷官見官為禍百端")] == ["c0"]
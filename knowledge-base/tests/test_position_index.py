@@ -0,0 +1,42 @@
+"""position_index：varint 編碼、倒排表的存檔與載入"""
+import json
+
+from position_index import (PositionIndex, decode_varints, encode_varint, save_position_index, scan_search,
+                            text_occurrences)
+
+CHUNKS = [
+    {"id": "c0", "category": "八字", "text": "傷官見官，為禍百端。七殺偏官，傷官傷盡", "keywords": ["傷官", "七殺"]},
+    {"id": "c1", "category": "紫微", "text": "前言" * 150 + "七殺坐命，化祿入命宮。" * 30, "keywords": ["七殺", "命宮"]},
+    {"id": "c2", "category": "八字", "text": "甲子乙丑，正印印綬，偏官七煞", "keywords": ["正印"], "prior": 0.5},
+]
+
+
+def test_varint_round_trip():
+    values = [0, 1, 127, 128, 255, 300, 16383, 16384, 1 << 21, (1 << 35) + 7]
+    out = bytearray()
+    for value in values:
+        encode_varint(value, out)
+    assert decode_varints(bytes(out)) == values
+    assert decode_varints(memoryview(bytes(out))) == values
+    # 每 7 位元一個位元組，最後一個位元組的最高位元為 0
+    for value, size in ((127, 1), (128, 2), (16383, 2), (16384, 3)):
+        encoded = bytearray()
+        encode_varint(value, encoded)
+        assert len(encoded) == size and encoded[-1] < 0x80
+
+
+def test_postings_round_trip(tmp_path):
+    with open(tmp_path / "rag_chunks.json", 'w', encoding='utf-8') as f:
+        json.dump({"chunks": CHUNKS}, f, ensure_ascii=False)
+    save_position_index(CHUNKS, tmp_path)
+    index = PositionIndex.load(tmp_path)
+    assert index.meta["source"] is not None
+
+    for keyword in ("傷官", "七殺", "命宮", "正印", "化祿"):
+        expected = {idx: text_occurrences(chunk["text"], keyword) for idx, chunk in enumerate(CHUNKS)}
+        assert index.occurrences(keyword) == {idx: occ for idx, occ in expected.items() if occ}, keyword
+    # 同一分塊多次出現，以及超過一個位元組的位移（第一個七殺在第 300 字）
+    assert [start for start, _ in index.postings("傷官")[0]] == [0, 15]
+    assert [start for start, _ in index.postings("七殺")[1]] == [300 + 11 * i for i in range(30)]
+    for keywords, category in ((["七殺", "傷官"], None), (["七殺"], "八字"), (["正印", "七殺"], None)):
+        assert index.search(keywords, category) == scan_search(CHUNKS, keywords, category)
@@ -0,0 +1,47 @@
+"""rebuild：分塊文字改變後重算欄位並重建所有產物"""
+import json
+
+from chunk_ids import content_uid
+from rebuild import rebuild_outputs
+from synonyms import chunk_concepts
+from text_store import TextStore
+from tokens import count_tokens
+
+CHUNKS = [
+    {"id": "c0", "source": "甲書", "chapter": "一", "title": "論七殺", "category": "八字",
+     "text": "七殺偏官，制之為權。", "keywords": ["七殺"]},
+    {"id": "c1", "source": "甲書", "chapter": "二", "title": "論印", "category": "八字",
+     "text": "印綬逢財，" * 40, "keywords": ["印綬"]},
+]
+
+
+def _stale_chunks():
+    """上一版的欄位：文字已被截短（如切掉版權頁），concepts／prior／tokens／uid 還是舊的"""
+    return [dict(chunk, concepts=[], prior=0.1, tokens=9999, uid="stale") for chunk in CHUNKS]
+
+
+def test_rebuild_recomputes_fields_and_writes_outputs(tmp_path):
+    chunks = _stale_chunks()
+    paths, changes = rebuild_outputs(chunks, tmp_path)
+    saved = json.loads((tmp_path / "rag_chunks.json").read_text(encoding='utf-8'))["chunks"]
+    assert saved == chunks
+    for chunk in saved:
+        assert chunk["tokens"] == count_tokens(chunk["text"])
+        assert chunk["concepts"] == chunk_concepts(chunk)
+        assert chunk["uid"] == content_uid(chunk)
+        assert chunk["prior"] != 0.1
+    assert changes["added"] == [chunk["uid"] for chunk in saved]
+    assert "hierarchy" not in paths and "text_store" not in paths
+    for name in ("rag_chunks.offsets.json", "snippet_index.json", "chapter_index.json", "gua_index.json",
+                 "ziwei_index.json", "quotation_links.json", "position_index.bin", "synonyms.json"):
+        assert (tmp_path / name).exists(), name
+
+
+def test_existing_text_store_is_rebuilt(tmp_path):
+    """目錄裡已有壓縮文字時一併重寫，不留下與 rag_chunks.json 對不上的舊版"""
+    rebuild_outputs(_stale_chunks(), tmp_path, compress=True)
+    chunks = _stale_chunks()
+    chunks[1]["text"] = "印綬逢財。"
+    paths, _ = rebuild_outputs(chunks, tmp_path, quotations=False)
+    assert "text_store" in paths
+    assert TextStore.load(tmp_path).get("c1") == "印綬逢財。"
@@ -0,0 +1,47 @@
+"""retrieval：依分塊類別的概念 id、概念命中分，各查詢路徑的結果一致，以及章節索引的 df"""
+from chapter_index import build_chapter_index
+from retrieval import CONCEPT_BONUS, KEYWORD_BONUS, Retriever
+from synonyms import assign_concepts
+from topk import TopKSearch
+
+CHUNKS = assign_concepts([
+    {"id": "z0", "category": "紫微", "text": "此星主肅殺，入命宮者性剛。", "keywords": ["七殺", "命宮"]},
+    {"id": "z1", "category": "紫微", "text": "七殺朝斗，爵祿榮昌。", "keywords": ["命宮"]},
+    {"id": "b0", "category": "八字", "text": "偏官有制，化為權星。", "keywords": ["偏官"]},
+    {"id": "b1", "category": "八字", "text": "身強殺淺，喜行殺地。", "keywords": ["七殺"]},
+])
+
+
+def test_category_concepts_apply_at_query_time():
+    retriever = Retriever(CHUNKS)
+    # 紫微的七杀是星曜七殺星：z0 以 keywords 的七殺標成七殺星，只有概念命中分
+    assert [c["id"] for c in retriever.search(["七杀"], "紫微")] == ["z0", "z1"]
+    assert retriever.chunk_score(0, ["七杀"]) == retriever.finalize(0, CONCEPT_BONUS)
+    # 八字的七杀是十神：偏官的分塊以概念命中，紫微分塊的七殺星不算
+    assert {c["id"] for c in retriever.search(["七杀"], "八字")} == {"b0", "b1"}
+    assert retriever.chunk_score(2, ["七杀"]) == retriever.finalize(2, CONCEPT_BONUS)
+    assert retriever.concepts(["七杀"]) == {"八字": ["七殺"], "紫微": ["七殺星"]}
+
+
+def test_literal_hits_outrank_concept_hits():
+    retriever = Retriever(CHUNKS)
+    # b1 的 keywords 有七殺，b0 只有概念（偏官 → 七殺）；兩塊文字都沒有七殺
+    assert retriever.chunk_score(3, ["七殺"]) == retriever.finalize(3, KEYWORD_BONUS)
+    assert retriever.chunk_score(2, ["七殺"]) == retriever.finalize(2, CONCEPT_BONUS)
+    assert retriever.score_bound(["偏官"]) >= max(retriever.chunk_score(idx, ["偏官"]) for idx in range(len(CHUNKS)))
+
+
+def test_query_paths_agree():
+    retriever = Retriever(CHUNKS)
+    queries = [(["七杀"], None, 3), (["七殺", "命宮"], "紫微", 2), (["偏官"], None, 4), (["七煞", "權"], "八字", 2)]
+    expected = [retriever.search(*query) for query in queries]
+    assert retriever.batch_search(queries) == expected
+    engine = TopKSearch(retriever)
+    assert [engine.search(*query) for query in queries] == expected
+
+
+def test_chapter_df_counts_scored_chunks():
+    retriever = Retriever(CHUNKS)
+    index = build_chapter_index(CHUNKS)
+    for term, df in zip(index["vocabulary"], index["df"]):
+        assert df == sum(1 for idx in range(len(CHUNKS)) if retriever.chunk_score(idx, [term]) > 0), term
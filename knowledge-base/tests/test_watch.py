@@ -0,0 +1,106 @@
+"""watch：單本書拼接回世代的輸出與 process_books_v2.py 全量重建相同"""
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import process_books_v2
+import watch
+from chapter_index import chapter_vocabulary
+from generations import resolve
+from synth_corpus import SyntheticCorpus
+
+KB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMPARED = ("rag_chunks.json", "snippet_index.json", "chapter_index.json", "index.json")
+TARGET = "合成八字1"
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    """合成來源目錄（八字兩本、紫微一本），process_books_v2 改讀這裡"""
+    source_dir = tmp_path / "src"
+    corpus = SyntheticCorpus(seed=1)
+    books = {}
+    for category, count in (("八字", 2), ("紫微", 1)):
+        (source_dir / category).mkdir(parents=True)
+        books[category] = {}
+        for i in range(count):
+            name = f"合成{category}{i + 1}"
+            corpus.write_book(source_dir / category / f"{name}.txt", 40000)
+            books[category][name] = {"file": f"{category}/{name}.txt", "author": "不詳", "dynasty": "清",
+                                     "quality": 3 + i}
+    monkeypatch.setattr(process_books_v2, "BOOKS", books)
+    monkeypatch.setattr(process_books_v2, "SOURCE_DIR", source_dir)
+    monkeypatch.setattr(sys, "argv", ["process_books_v2.py"])
+    return source_dir, books
+
+
+def _full_build(kb_dir, monkeypatch):
+    kb_dir.mkdir()
+    monkeypatch.setattr(process_books_v2, "OUTPUT_DIR", kb_dir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        process_books_v2.main()
+
+
+def _load(kb_dir, name):
+    return json.loads((resolve(kb_dir) / name).read_text(encoding='utf-8'))
+
+
+def _markdown(kb_dir):
+    generation = resolve(kb_dir)
+    return sorted(str(path.relative_to(generation)) for path in generation.rglob("*.md"))
+
+
+@pytest.mark.parametrize("addition, same_vocabulary", [
+    # 插在章節中間的一段：該章的分塊改變，術語表不變，其他書的引用句與章節摘要沿用上一版
+    ("傷官見官，為禍百端。", True),
+    # 新的一章：之後的章節編號全部位移。天同出現在合成紫微1的文字中，但被每章 20 個 keywords 的上限擠掉，
+    # 不在術語表；成為 keywords 後，未重建的紫微分塊的引用句與章節摘要也要重新掃描
+    ("第九十九章 補遺\n\n" + "天同守命，性情溫和，一生少災。" * 8, False),
+])
+def test_splice_matches_full_rebuild(library, tmp_path, monkeypatch, addition, same_vocabulary):
+    source_dir, books = library
+    spliced, full = tmp_path / "watch", tmp_path / "full"
+    _full_build(spliced, monkeypatch)
+    before = _load(spliced, "rag_chunks.json")["chunks"]
+    if not same_vocabulary:
+        assert not any("天同" in chunk["keywords"] for chunk in before)
+        assert any("天同" in chunk["text"] for chunk in before if chunk["source"] != TARGET)
+
+    # 插在書的中段
+    target = source_dir / "八字" / f"{TARGET}.txt"
+    text = target.read_text(encoding='utf-8')
+    middle = text.index("\n\n", len(text) // 2)
+    target.write_text(text[:middle] + f"\n\n{addition}" + text[middle:], encoding='utf-8')
+
+    daemon = watch.WatchDaemon(spliced, watch.source_table(books, {}, source_dir=source_dir), export=False, quiet=True)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        report = daemon.rebuild([target], pool)
+    assert report["books"] == [TARGET]
+    after = _load(spliced, "rag_chunks.json")["chunks"]
+    assert (chapter_vocabulary(after) == chapter_vocabulary(before)) == same_vocabulary
+    assert any(addition.split("\n")[-1][:8] in chunk["text"] for chunk in after)
+
+    _full_build(full, monkeypatch)
+    for name in COMPARED:
+        assert _load(spliced, name) == _load(full, name), name
+    assert _markdown(spliced) == _markdown(full)
+
+
+def test_keywords_independent_of_hash_seed():
+    """watch 的 worker 與全量重建在不同行程中取 keywords：超過 20 個術語時取到的不能隨雜湊種子改變"""
+    text = "天干地支，甲乙丙丁戊己庚辛壬癸，子丑寅卯辰巳午未申酉戌亥，陰陽五行，金木水火土，食神傷官。"
+    script = f"import json, process_books_v2; print(json.dumps(process_books_v2.extract_keywords({text!r})))"
+    results = {
+        subprocess.run([sys.executable, "-c", script], cwd=KB_DIR, capture_output=True, text=True, check=True,
+                       env={**os.environ, "PYTHONHASHSEED": seed}).stdout
+        for seed in ("1", "2", "3")
+    }
+    assert len(results) == 1
+    assert len(json.loads(results.pop())) == 20
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+分塊文字的字典壓縮儲存
+以整個語料訓練一份共用字典，每個分塊各自對字典壓縮，之間互不依賴；
+位移表記錄每塊在 chunk_text.bin 中的位置，可單獨解壓任一分塊。
+讀取端以有上限的 LRU 快取熱門分塊
+
+有安裝 zstandard 時使用 zstd 字典；沒有時退回 zlib（raw deflate）的預設字典（上限 32 KB），
+字典由語料中出現最頻繁的 2-4 字片段組成
+
+用法：
+    python text_store.py            # 建立 chunk_text.*，並報告壓縮率與解壓速度
+"""
+import json
+import time
+import zlib
+import random
+from collections import Counter, OrderedDict
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+KB_DIR = Path(__file__).resolve().parent
+
+ZSTD_DICT_SIZE = 112640    # zstd 預設字典大小（110 KB）
+ZSTD_LEVEL = 19
+ZLIB_DICT_SIZE = 32768     # deflate 視窗大小，預設字典只有最後 32 KB 有效
+ZLIB_LEVEL = 9
+DEFAULT_CACHE_SIZE = 256
+
+
+class ZstdCodec:
+    name = "zstd"
+
+    def __init__(self, dictionary):
+        data = zstandard.ZstdCompressionDict(dictionary)
+        self.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=data)
+        self.decompressor = zstandard.ZstdDecompressor(dict_data=data)
+
+    @staticmethod
+    def train(texts):
+        samples = [text.encode('utf-8') for text in texts]
+        return zstandard.train_dictionary(ZSTD_DICT_SIZE, samples).as_bytes()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def decompress(self, blob):
+        return self.decompressor.decompress(blob)
+
+
+class ZlibCodec:
+    name = "zlib"
+
+    def __init__(self, dictionary):
+        self.dictionary = dictionary
+
+    @staticmethod
+    def train(texts, sample_every=2, min_count=3):
+        """以最常出現的 2-4 字片段組成字典（出現次數 × 長度越大越靠近結尾，距離越近編碼越短）"""
+        counts = Counter()
+        for text in texts[::sample_every]:
+            text = text.replace("\n", "")
+            for n in (2, 3, 4):
+                counts.update(text[i:i + n] for i in range(len(text) - n + 1))
+        ranked = sorted(((count * len(s), s) for s, count in counts.items() if count >= min_count),
+                        reverse=True)
+        chosen, total = [], 0
+        for _, s in ranked:
+            size = len(s.encode('utf-8'))
+            if total + size > ZLIB_DICT_SIZE:
+                continue
+            chosen.append(s)
+            total += size
+        return "".join(reversed(chosen)).encode('utf-8')
+
+    def compress(self, data):
+        compressor = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, -15, 9,
+                                      zlib.Z_DEFAULT_STRATEGY, self.dictionary)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, blob):
+        return zlib.decompressobj(-15, zdict=self.dictionary).decompress(blob)
+
+
+def default_codec():
+    return ZstdCodec if zstandard is not None else ZlibCodec
+
+
+def _codec_class(name):
+    if name == "zstd":
+        if zstandard is None:
+            raise ImportError("chunk_text.bin 以 zstd 壓縮，需要安裝 zstandard（pip install zstandard）")
+        return ZstdCodec
+    return ZlibCodec
+
+
+def build_text_store(chunks, codec_class=None):
+    """訓練字典並逐塊壓縮，回傳 (字典, 壓縮資料, 位移索引)"""
+    codec_class = codec_class or default_codec()
+    texts = [chunk["text"] for chunk in chunks]
+    dictionary = codec_class.train(texts)
+    codec = codec_class(dictionary)
+
+    blobs = [codec.compress(text.encode('utf-8')) for text in texts]
+    offsets = [0]
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    index = {
+        "version": "1.0",
+        "codec": codec_class.name,
+        "dictionary_bytes": len(dictionary),
+        "raw_bytes": sum(len(text.encode('utf-8')) for text in texts),
+        "ids": [chunk["id"] for chunk in chunks],
+        "offsets": offsets,
+    }
+    return dictionary, b"".join(blobs), index
+
+
+def save_text_store(chunks, output_dir, codec_class=None):
+    """寫入 chunk_text.dict、chunk_text.bin、chunk_text.idx.json"""
+    dictionary, data, index = build_text_store(chunks, codec_class)
+    output_dir = Path(output_dir)
+    (output_dir / "chunk_text.dict").write_bytes(dictionary)
+    (output_dir / "chunk_text.bin").write_bytes(data)
+    index_path = output_dir / "chunk_text.idx.json"
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+    return index_path, index
+
+
+class TextStore:
+    """讀取壓縮的分塊文字；最近用過的 cache_size 塊保留在 LRU 快取"""
+
+    def __init__(self, index, dictionary, data, cache_size=DEFAULT_CACHE_SIZE):
+        self.codec = _codec_class(index["codec"])(dictionary)
+        self.data = data
+        self.offsets = index["offsets"]
+        self.id_to_idx = {chunk_id: idx for idx, chunk_id in enumerate(index["ids"])}
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.hits = self.misses = 0
+
+    @classmethod
+    def load(cls, kb_dir=KB_DIR, cache_size=DEFAULT_CACHE_SIZE):
+        kb_dir = Path(kb_dir)
+        with open(kb_dir / "chunk_text.idx.json", 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        return cls(index, (kb_dir / "chunk_text.dict").read_bytes(),
+                   (kb_dir / "chunk_text.bin").read_bytes(), cache_size)
+
+    def decode(self, idx):
+        """直接解壓第 idx 塊（不經快取）"""
+        blob = self.data[self.offsets[idx]:self.offsets[idx + 1]]
+        return self.codec.decompress(blob).decode('utf-8')
+
+    def get(self, chunk_id):
+        """依分塊 id 取得文字"""
+        text = self.cache.get(chunk_id)
+        if text is not None:
+            self.hits += 1
+            self.cache.move_to_end(chunk_id)
+            return text
+        self.misses += 1
+        text = self.decode(self.id_to_idx[chunk_id])
+        self.cache[chunk_id] = text
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return text
+
+    def __len__(self):
+        return len(self.id_to_idx)
+
+
+def report(chunks, store, index):
+    """壓縮率、逐塊解壓速度與 LRU 命中率"""
+    raw = index["raw_bytes"]
+    compressed = index["offsets"][-1] + index["dictionary_bytes"]
+
+    # 對照組：同一個 codec 不用字典逐塊壓縮
+    if index["codec"] == "zstd":
+        plain = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        no_dict = sum(len(plain.compress(c["text"].encode('utf-8'))) for c in chunks)
+    else:
+        no_dict = sum(len(ZlibCodec(b"").compress(c["text"].encode('utf-8'))) for c in chunks)
+
+    t0 = time.perf_counter()
+    for idx in range(len(store)):
+        store.decode(idx)
+    elapsed = time.perf_counter() - t0
+
+    # 模擬熱門分塊集中的存取（80% 的請求落在 10% 的分塊）
+    rng = random.Random(3)
+    ids = [c["id"] for c in chunks]
+    hot = ids[:max(1, len(ids) // 10)]
+    for _ in range(20000):
+        store.get(rng.choice(hot) if rng.random() < 0.8 else rng.choice(ids))
+
+    print(f"   - 編碼: {index['codec']}（字典 {index['dictionary_bytes'] / 1024:.1f} KB）")
+    print(f"   - 原文: {raw / (1 << 20):.2f} MB → 壓縮後 {compressed / (1 << 20):.2f} MB"
+          f"（{raw / compressed:.2f}×；不用字典 {raw / no_dict:.2f}×）")
+    print(f"   - 逐塊解壓: {raw / elapsed / (1 << 20):.1f} MB/s，每塊 {elapsed / len(store) * 1e6:.1f} µs")
+    print(f"   - LRU（{store.cache_size} 塊）命中率: {store.hits / (store.hits + store.misses):.0%}")
+
+
+def main():
+    with open(KB_DIR / "rag_chunks.json", 'r', encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+
+    t0 = time.perf_counter()
+    index_path, index = save_text_store(chunks, KB_DIR)
+    print(f"✅ 分塊文字壓縮完成（{time.perf_counter() - t0:.1f} 秒）")
+    report(chunks, TextStore.load(KB_DIR), index)
+    print(f"📄 位移索引: {index_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+分塊與句子的 token 數估計
+組 prompt 時以 token 預算取代分塊數上限，需要事先知道每個分塊、每個句子大約多少 token。
+不依賴特定模型的分詞器：漢字與全形標點各算 1 個 token，連續的英數字每 4 個字元算 1 個，
+其他符號各算 1 個，空白不計。rag.ts 的 countTokens 使用同一套規則
+
+用法：
+    python tokens.py            # 為 rag_chunks.json 補上 tokens 並重建引用句索引
+"""
+import re
+import json
+from pathlib import Path
+
+KB_DIR = Path(__file__).resolve().parent
+
+# 英數字連續片段、空白、其他單一字元
+TOKEN_RE = re.compile(r"[A-Za-z0-9]+|\s+|.", re.S)
+ASCII_CHARS_PER_TOKEN = 4
+
+
+def count_tokens(text):
+    """估計 text 的 token 數"""
+    tokens = 0
+    for match in TOKEN_RE.finditer(text):
+        piece = match.group()
+        first = piece[0]
+        if first.isspace():
+            continue
+        if first.isascii() and first.isalnum():
+            tokens += -(-len(piece) // ASCII_CHARS_PER_TOKEN)
+        else:
+            tokens += 1
+    return tokens
+
+
+def assign_tokens(chunks):
+    """為每個分塊加上 tokens 欄位"""
+    for chunk in chunks:
+        chunk["tokens"] = count_tokens(chunk["text"])
+    return chunks
+
+
+def main():
+    from chunk_stream import build_offsets
+    from chunk_ids import save_changes
+    from snippets import save_snippet_index
+
+    chunks_path = KB_DIR / "rag_chunks.json"
+    with open(chunks_path, 'r', encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+    assign_tokens(chunks)
+    with open(chunks_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "version": "1.0",
+            "total_chunks": len(chunks),
+            "chunks": chunks
+        }, f, ensure_ascii=False, indent=2)
+    build_offsets(chunks_path)
+    # tokens 屬於中繼資料，下游只需更新欄位
+    save_changes(chunks, KB_DIR)
+    # 引用句索引記錄每個句子的 token 數
+    snippet_index_path, _ = save_snippet_index(chunks, KB_DIR)
+
+    total = sum(chunk["tokens"] for chunk in chunks)
+    counts = sorted(chunk["tokens"] for chunk in chunks)
+    print(f"✅ token 數估計完成（{len(chunks)} 個分塊，共 {total:,} tokens）")
+    print(f"   - 每塊 最小 {counts[0]}  中位數 {counts[len(counts) // 2]}  最大 {counts[-1]}")
+    print(f"📄 RAG 分塊: {chunks_path}")
+    print(f"📄 引用句索引: {snippet_index_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+前 k 名查詢（MaxScore／WAND）：以每個術語的分數上限跳過不可能進榜的分塊
+甲、子這類常見術語幾乎出現在整個八字分類，逐塊計分後再取前幾名等於掃描全部分塊。
+這裡為每個術語建立依分塊順序排列的倒排表（分塊 → 單詞分數 term_score），
+並記錄該術語在每個分類中的最高分 × prior（分數上限）。
+
+查詢時依上限由低到高排列各術語，累積上限不超過目前第 limit 名分數的術語是「非必要」的：
+只出現在這些術語中的分塊不可能進榜，所以只沿著其餘（必要）術語的倒排表逐塊前進，
+非必要術語改以二分搜尋查分數，加總途中上限已不足時就放棄該分塊。第 limit 名分數越高，
+必要術語越少、跳過的分塊越多；結果（含同分時較前面的分塊優先）與 Retriever.search 相同。
+search_wand 改以 WAND 逐塊找樞紐：計分的分塊更少，但每步都要重新排序倒排表，在 Python 中反而較慢
+
+倒排表在第一次查到該術語時建立並快取（一次掃描全文），之後的查詢直接使用
+
+用法：
+    python topk.py --bench                # 與逐塊計分比較計分分塊數與延遲（1×、10×、100× 語料）
+    python topk.py --bench --scale 10     # 只測 10× 語料
+"""
+import sys
+import time
+import heapq
+import random
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+
+from retrieval import Retriever, term_score
+
+KB_DIR = Path(__file__).resolve().parent
+
+# 上限加上的相對餘裕：(Σ 單詞分數) × prior 與 Σ(單詞分數 × prior) 的浮點誤差
+BOUND_EPS = 1e-9
+EMPTY = (array('I'), array('B'), 0.0)
+
+
+class TopKSearch:
+    """以術語倒排表與分數上限做前 k 名查詢；評分與 Retriever.search 相同"""
+
+    def __init__(self, retriever):
+        self.retriever = retriever
+        self.categories = [chunk["category"] for chunk in retriever.chunks]
+        # keywords 含某詞的分塊（keywords 命中分）、concepts 含某概念 id 的分塊（概念命中分）
+        self.tagged, self.concept_tagged = {}, {}
+        for idx, (keyword_set, concept_set) in enumerate(zip(retriever.keyword_sets, retriever.concept_sets)):
+            for term in keyword_set:
+                self.tagged.setdefault(term, []).append(idx)
+            for concept in concept_set:
+                self.concept_tagged.setdefault(concept, []).append(idx)
+        # 術語 → {分類（None 為不限）: (分塊 array, 單詞分數 array, 最高分 × prior)}
+        self.lists = {}
+        self.scored = 0
+
+    @classmethod
+    def load(cls, kb_dir=KB_DIR):
+        return cls(Retriever.load(kb_dir))
+
+    def postings(self, term, category=None):
+        """術語在某分類的倒排表（第一次查到時掃描全文建立）"""
+        lists = self.lists.get(term)
+        if lists is None:
+            lists = self.lists[term] = self._build(term)
+        return lists.get(category, EMPTY)
+
+    def warm(self, terms):
+        """預先建立一批術語的倒排表"""
+        for term in terms:
+            self.postings(term)
+
+    def _build(self, term):
+        retriever = self.retriever
+        chunks, priors = retriever.chunks, retriever.priors
+        # 同一寫法在不同分類可能指不同概念，依分塊類別取概念 id
+        concepts = {category: retriever.concept_of(term, category) for category in retriever.categories}
+        candidates = set(self.tagged.get(term, ()))
+        for concept in set(concepts.values()):
+            candidates.update(self.concept_tagged.get(concept, ()))
+        candidates.update(idx for idx, chunk in enumerate(chunks) if term in chunk["text"])
+
+        lists = {None: (array('I'), array('B'), [0.0])}
+        for idx in sorted(candidates):
+            category = self.categories[idx]
+            score = term_score(chunks[idx]["text"], retriever.keyword_sets[idx], term, concepts[category],
+                               retriever.concept_sets[idx])
+            if not score:
+                continue
+            if category not in lists:
+                lists[category] = (array('I'), array('B'), [0.0])
+            impact = score * priors[idx]
+            for key in (None, category):
+                ids, scores, upper = lists[key]
+                ids.append(idx)
+                scores.append(score)
+                upper[0] = max(upper[0], impact)
+        return {key: (ids, scores, upper[0]) for key, (ids, scores, upper) in lists.items()}
+
+    def search(self, keywords, category=None, limit=5, scored=False):
+        """MaxScore 查詢，結果與 Retriever.search 相同；scored=True 時回傳 (分塊編號, 分數)"""
+        priors = self.retriever.priors
+        lists = [entry for entry in (self.postings(kw, category) for kw in keywords) if entry[0]]
+        # 依上限由低到高；prefix[i] 為前 i+1 個術語的累積上限
+        lists.sort(key=lambda entry: entry[2])
+        prefix, total = [], 0.0
+        for _, _, upper in lists:
+            total += upper * (1 + BOUND_EPS)
+            prefix.append(total)
+
+        n = len(lists)
+        pointers = [0] * n
+        heap = []
+        threshold = 0.0
+        first = 0          # lists[first:] 為必要術語
+        while first < n:
+            # 下一個候選：必要術語倒排表目前位置中最小的分塊
+            candidate = None
+            for i in range(first, n):
+                ids, p = lists[i][0], pointers[i]
+                if p < len(ids) and (candidate is None or ids[p] < candidate):
+                    candidate = ids[p]
+            if candidate is None:
+                break
+
+            self.scored += 1
+            prior = priors[candidate]
+            score = 0
+            for i in range(first, n):
+                ids, scores, _ = lists[i]
+                p = pointers[i]
+                if p < len(ids) and ids[p] == candidate:
+                    score += scores[p]
+                    pointers[i] = p + 1
+            pruned = False
+            for i in range(first - 1, -1, -1):
+                # 剩下的非必要術語全拿滿也到不了第 limit 名
+                if score * prior + prefix[i] <= threshold:
+                    pruned = True
+                    break
+                ids, scores, _ = lists[i]
+                p = pointers[i] = bisect_left(ids, candidate, pointers[i])
+                if p < len(ids) and ids[p] == candidate:
+                    score += scores[p]
+            if pruned:
+                continue
+
+            score *= prior
+            # 候選依分塊順序出現，同分時榜上較前面的分塊優先，所以須嚴格大於第 limit 名
+            if score <= threshold:
+                continue
+            item = (score, -candidate)
+            if len(heap) < limit:
+                heapq.heappush(heap, item)
+            else:
+                heapq.heapreplace(heap, item)
+            if len(heap) == limit:
+                threshold = heap[0][0]
+                while first < n and prefix[first] <= threshold:
+                    first += 1
+        ranked = sorted(heap, reverse=True)
+        if scored:
+            return [(-neg_idx, score) for score, neg_idx in ranked]
+        chunks = self.retriever.chunks
+        return [chunks[-neg_idx] for _, neg_idx in ranked]
+
+
+    def search_wand(self, keywords, category=None, limit=5):
+        """WAND 查詢：各倒排表依目前位置排序，累積上限首次超過第 limit 名分數的位置為樞紐，
+        樞紐之前的分塊只出現在累積上限不足的術語中，直接跳過；結果與 Retriever.search 相同"""
+        priors = self.retriever.priors
+        lists = [entry for entry in (self.postings(kw, category) for kw in keywords) if entry[0]]
+        uppers = [upper * (1 + BOUND_EPS) for _, _, upper in lists]
+        pointers = [0] * len(lists)
+        active = list(range(len(lists)))
+        heap = []
+        threshold = 0.0
+        while active:
+            active.sort(key=lambda i: lists[i][0][pointers[i]])
+            total, pivot = 0.0, None
+            for j, i in enumerate(active):
+                total += uppers[i]
+                if total > threshold:
+                    pivot = j
+                    break
+            if pivot is None:
+                break
+            pivot_doc = lists[active[pivot]][0][pointers[active[pivot]]]
+
+            if lists[active[0]][0][pointers[active[0]]] == pivot_doc:
+                # 樞紐之前的倒排表都已停在樞紐分塊上：完整計分
+                self.scored += 1
+                score = 0
+                for i in active:
+                    ids, scores, _ = lists[i]
+                    p = pointers[i]
+                    if ids[p] != pivot_doc:
+                        break
+                    score += scores[p]
+                    pointers[i] = p + 1
+                score *= priors[pivot_doc]
+                # 候選依分塊順序出現，同分時榜上較前面的分塊優先，所以須嚴格大於第 limit 名
+                if score > threshold:
+                    item = (score, -pivot_doc)
+                    if len(heap) < limit:
+                        heapq.heappush(heap, item)
+                    else:
+                        heapq.heapreplace(heap, item)
+                    if len(heap) == limit:
+                        threshold = heap[0][0]
+            else:
+                # 把樞紐之前的一個倒排表直接跳到樞紐分塊
+                i = active[0]
+                pointers[i] = bisect_left(lists[i][0], pivot_doc, pointers[i])
+            active = [i for i in active if pointers[i] < len(lists[i][0])]
+        chunks = self.retriever.chunks
+        return [chunks[-neg_idx] for _, neg_idx in sorted(heap, reverse=True)]
+
+
+def _replicate(chunks, scale):
+    """scale 份語料（id 加上 _rN，文字與 keywords 共用同一個物件）"""
+    if scale == 1:
+        return chunks
+    return [dict(chunk, id=f"{chunk['id']}_r{rep}") if rep else chunk
+            for rep in range(scale) for chunk in chunks]
+
+
+def benchmark(scales=(1, 10, 100), queries=30, seed=7):
+    """逐塊計分、MaxScore、WAND：計分分塊數、每筆延遲與結果一致性"""
+    from retrieval import _sample_queries
+
+    base = Retriever.load().chunks
+    sample = _sample_queries(base, queries, random.Random(seed))
+    for scale in scales:
+        retriever = Retriever(_replicate(base, scale))
+        search = TopKSearch(retriever)
+        t0 = time.perf_counter()
+        search.warm({kw for keywords, _, _ in sample for kw in keywords})
+        build = time.perf_counter() - t0
+        postings = sum(len(lists[None][0]) for lists in search.lists.values())
+
+        print(f"📊 {scale}× 語料（{len(retriever.chunks):,} 個分塊），{queries} 筆查詢")
+        print(f"   - 倒排表: {len(search.lists)} 個術語、{postings:,} 項，建立 {build:.1f} 秒")
+        results = {}
+        for label, fn, counter in (
+                ("逐塊計分", lambda q: retriever.search(*q), "visited"),
+                ("MaxScore", lambda q: search.search(*q), "scored"),
+                ("WAND", lambda q: search.search_wand(*q), "scored")):
+            owner = search if counter == "scored" else retriever
+            setattr(owner, counter, 0)
+            t0 = time.perf_counter()
+            results[label] = [[c["id"] for c in fn(q)] for q in sample]
+            elapsed = time.perf_counter() - t0
+            print(f"   - {label:<14} 每筆 {elapsed / queries * 1000:8.2f} ms"
+                  f"  計分 {getattr(owner, counter) / queries:9,.0f} 塊")
+        same = all(result == results["逐塊計分"] for result in results.values())
+        print(f"   - 結果{'一致' if same else '不一致'}")
+
+
+def main():
+    if "--bench" in sys.argv:
+        scales = (int(sys.argv[sys.argv.index("--scale") + 1]),) if "--scale" in sys.argv else (1, 10, 100)
+        benchmark(scales)
+        return
+    print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+紫微星曜 × 宮位 × 四化 共現索引
+從紫微四化、紫微探源的分塊中，記錄在相鄰句子內共同出現的
+（星曜, 宮位）與（星曜, 四化）組合，命盤檢索只需做倒排表交集
+"""
+import re
+import json
+from pathlib import Path
+
+from aho_corasick import AhoCorasick
+
+KB_DIR = Path(__file__).resolve().parent
+
+# 紫微類書籍
+ZIWEI_BOOKS = {"紫微四化", "紫微探源"}
+
+# 共現視窗：同一句及其後 (SENTENCE_WINDOW - 1) 句
+SENTENCE_WINDOW = 2
+
+MAIN_STARS = [
+    "紫微", "天機", "太陽", "武曲", "天同", "廉貞", "天府",
+    "太陰", "貪狼", "巨門", "天相", "天梁", "七殺", "破軍",
+]
+
+MINOR_STARS = [
+    "文昌", "文曲", "左輔", "右弼", "天魁", "天鉞",
+    "祿存", "天馬", "擎羊", "陀羅", "火星", "鈴星",
+]
+
+SI_HUA = ["化祿", "化權", "化科", "化忌"]
+
+# 宮位名稱與 src/lib/ziwei/constants.ts 的 GONG_NAMES 一致
+PALACES = {
+    "命宮": ["命宮"],
+    "兄弟": ["兄弟宮", "兄弟"],
+    "夫妻": ["夫妻宮", "夫妻"],
+    "子女": ["子女宮", "子女"],
+    "財帛": ["財帛宮", "財帛"],
+    "疾厄": ["疾厄宮", "疾厄"],
+    "遷移": ["遷移宮", "遷移"],
+    "交友": ["交友宮", "奴僕宮", "僕役宮", "奴僕", "僕役"],
+    "官祿": ["官祿宮", "事業宮", "官祿"],
+    "田宅": ["田宅宮", "田宅"],
+    "福德": ["福德宮", "福德"],
+    "父母": ["父母宮", "父母"],
+}
+
+# 含星名但不是星曜的詞，只用來遮蔽
+MASKED_TERMS = ["紫微斗數", "紫微垂象", "太陽系", "太陽曆", "太陰曆"]
+
+SENTENCE_END_RE = re.compile(r"[。！？；]")
+
+
+def build_matcher():
+    """建立 詞 → (類型, 正規化名稱) 的匹配器"""
+    patterns = {}
+    for star in MAIN_STARS + MINOR_STARS:
+        patterns[star] = ("star", star)
+    for hua in SI_HUA:
+        patterns[hua] = ("hua", hua)
+    for palace, aliases in PALACES.items():
+        for alias in aliases:
+            patterns[alias] = ("palace", palace)
+    for term in MASKED_TERMS:
+        patterns[term] = None
+    return AhoCorasick(patterns)
+
+
+def sentence_bounds(text):
+    """回傳每個句子的結束位置（遞增）"""
+    ends = [m.end() for m in SENTENCE_END_RE.finditer(text)]
+    if not ends or ends[-1] < len(text):
+        ends.append(len(text))
+    return ends
+
+
+def chunk_pairs(text, matcher, window=SENTENCE_WINDOW):
+    """找出單一分塊中的共現組合，回傳 ({(星, 宮): 次數}, {(星, 化): 次數})"""
+    ends = sentence_bounds(text)
+    sentences = [{"star": set(), "hua": set(), "palace": set()} for _ in ends]
+
+    # 匹配結果依位置遞增，句子索引只需單向推進
+    sid = 0
+    for start, _, (kind, name) in matcher.find(text):
+        while start >= ends[sid]:
+            sid += 1
+        sentences[sid][kind].add(name)
+
+    star_palace, star_hua = {}, {}
+    for i, sentence in enumerate(sentences):
+        if not sentence["star"]:
+            continue
+        span = sentences[i:i + window]
+        palaces = set().union(*(s["palace"] for s in span))
+        huas = set().union(*(s["hua"] for s in span))
+        for star in sentence["star"]:
+            for palace in palaces:
+                star_palace[(star, palace)] = star_palace.get((star, palace), 0) + 1
+            for hua in huas:
+                star_hua[(star, hua)] = star_hua.get((star, hua), 0) + 1
+    return star_palace, star_hua
+
+
+def _postings(hits):
+    """{鍵: [(次數, id)]} → {「星|宮」: [id]}，次數高者優先"""
+    return {
+        f"{a}|{b}": [cid for _, cid in sorted(ids, key=lambda h: -h[0])]
+        for (a, b), ids in sorted(hits.items())
+    }
+
+
+def build_ziwei_index(chunks, window=SENTENCE_WINDOW):
+    """建立共現索引，每個分塊只以自動機掃描一次"""
+    matcher = build_matcher()
+    star_palace_hits, star_hua_hits = {}, {}
+    pairs_by_chunk = {}
+
+    for chunk in chunks:
+        if chunk.get("source") not in ZIWEI_BOOKS:
+            continue
+        star_palace, star_hua = chunk_pairs(chunk["text"], matcher, window)
+        if not star_palace and not star_hua:
+            continue
+        pairs_by_chunk[chunk["id"]] = {
+            "star_palace": [f"{s}|{p}" for s, p in sorted(star_palace)],
+            "star_hua": [f"{s}|{h}" for s, h in sorted(star_hua)],
+        }
+        for key, count in star_palace.items():
+            star_palace_hits.setdefault(key, []).append((count, chunk["id"]))
+        for key, count in star_hua.items():
+            star_hua_hits.setdefault(key, []).append((count, chunk["id"]))
+
+    return {
+        "version": "1.0",
+        "window": window,
+        "total_indexed_chunks": len(pairs_by_chunk),
+        "star_palace": _postings(star_palace_hits),
+        "star_hua": _postings(star_hua_hits),
+        "chunk_pairs": pairs_by_chunk,
+    }
+
+
+def save_ziwei_index(chunks, output_dir):
+    """建立並儲存 ziwei_index.json"""
+    index = build_ziwei_index(chunks)
+    index_path = Path(output_dir) / "ziwei_index.json"
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    return index_path, index
+
+
+def main():
+    chunks_path = KB_DIR / "rag_chunks.json"
+    with open(chunks_path, 'r', encoding='utf-8') as f:
+        chunks = json.load(f)["chunks"]
+
+    index_path, index = save_ziwei_index(chunks, KB_DIR)
+
+    print(f"✅ 紫微共現索引完成")
+    print(f"   - 索引分塊: {index['total_indexed_chunks']}")
+    print(f"   - 星曜×宮位組合: {len(index['star_palace'])}")
+    print(f"   - 星曜×四化組合: {len(index['star_hua'])}")
+    print(f"📄 索引檔案: {index_path}")
+
+
+if __name__ == "__main__":
+    main()
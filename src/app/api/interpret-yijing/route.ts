@@ -1,6 +1,6 @@
 import { NextRequest, NextResponse } from 'next/server';
 import Anthropic from '@anthropic-ai/sdk';
-import { searchChunks, formatChunksForPrompt } from '@/lib/rag';
+import { searchChunks, searchByGua, packContext } from '@/lib/rag';
 
 // 初始化 Claude
 const anthropic = new Anthropic({
@@ -106,8 +106,18 @@ export async function POST(request: NextRequest) {
     if (dongYao && dongYao.length > 0) {
       keywords.push('動爻', '爻辭');
     }
-    const chunks = searchChunks(keywords, '易經', 5); // 增加到5筆
-    const ragContent = formatChunksForPrompt(chunks);
+    // 先由卦爻索引直接取本卦（動爻優先）與變卦段落，不足再用關鍵字補齊
+    const guaChunks = [
+      ...searchByGua(benGua.number, dongYao || [], 3),
+      ...(bianGua ? searchByGua(bianGua.number, [], 2) : []),
+    ];
+    const seen = new Set(guaChunks.map(c => c.id));
+    const chunks = [
+      ...guaChunks,
+      ...searchChunks(keywords, '易經', 5).filter(c => !seen.has(c.id)),
+    ].slice(0, 5); // 增加到5筆
+    // 依 token 預算選出命中卦名、爻辭的段落，prompt 長度固定
+    const ragContent = packContext(chunks, keywords, 1000);
 
     // 組織卦象資訊
     const guaInfo = formatGuaInfo(yaos, benGua, bianGua, dongYao);
@@ -4,6 +4,14 @@
  */
 
 import ragData from '../../knowledge-base/rag_chunks.json';
+import guaData from '../../knowledge-base/gua_index.json';
+import ziweiData from '../../knowledge-base/ziwei_index.json';
+import hierarchyData from '../../knowledge-base/hierarchy.json';
+import quotationData from '../../knowledge-base/quotation_links.json';
+import chapterData from '../../knowledge-base/chapter_index.json';
+import snippetData from '../../knowledge-base/snippet_index.json';
+import synonymData from '../../knowledge-base/synonyms.json';
+import rerankData from '../../knowledge-base/rerank_model.json';
 
 interface RagChunk {
   id: string;
@@ -13,18 +21,496 @@ interface RagChunk {
   title: string;
   category: string;
   keywords: string[];
+  concepts?: string[];  // 涉及的概念 id（同義詞、簡體、生肖併成正規名稱），由 synonyms.py 產生
+  ocr_quality?: number; // OCR 品質分數（0-1），由 ocr_quality.py 產生
+  prior?: number;       // 靜態排序先驗（前言、卦名、OCR 與書籍品質、長度），由 rank_prior.py 產生
+  uid?: string;         // 內容定址的穩定 id（書名 + 文字雜湊），由 chunk_ids.py 產生
+  tokens?: number;      // 估計 token 數，由 tokens.py 產生
 }
 
+// 單一關鍵字的最高分：keywords 命中 5（只有概念相同時 3）、開頭 100 字 4、「X卦」6、出現次數最多 3（與 retrieval.py 一致）
+const TERM_SCORE_MAX = 18;
+const KEYWORD_BONUS = 5;
+const CONCEPT_BONUS = 3;
+const GUA_BONUS = 6;
+
 interface RagDatabase {
   version: string;
   total_chunks: number;
   chunks: RagChunk[];
 }
 
+interface GuaIndexEntry {
+  name: string;
+  short: string;
+  chunks: string[];                // 討論整卦的分塊（依提及次數排序）
+  lines: Record<string, string[]>; // 爻位（1-6）→ 分塊
+}
+
+interface GuaIndex {
+  version: string;
+  total_tagged_chunks: number;
+  hexagrams: Record<string, GuaIndexEntry>;
+}
+
+interface ZiweiIndex {
+  version: string;
+  window: number;
+  total_indexed_chunks: number;
+  star_palace: Record<string, string[]>; // 「星|宮」→ 分塊
+  star_hua: Record<string, string[]>;    // 「星|化」→ 分塊
+}
+
+interface HierarchyNode {
+  level: string;               // book / part / chapter / section / subsection / item / chunk ...
+  parent: string | null;
+  prev: string | null;
+  next: string | null;
+  label?: string;
+  title?: string;
+  children?: string[];         // 下層章節
+  chunks?: string[];           // 本節自己的分塊
+  span?: [number, number];     // 其下所有分塊在 order 中的區間
+  pos?: number;                // 分塊在 order 中的位置
+}
+
+interface HierarchyIndex {
+  version: string;
+  books: string[];
+  order: string[];             // 所有分塊的閱讀順序
+  nodes: Record<string, HierarchyNode>;
+}
+
+interface QuotationPassage {
+  text: string;                // 正規化後的引文開頭
+  length: number;
+  primary: string;             // 原典分塊（朝代最早的著作）
+  chunks: string[];            // 出現此引文的所有分塊
+}
+
+interface QuotationLinks {
+  version: string;
+  min_length: number;
+  total_passages: number;
+  passages: QuotationPassage[];
+  primary_of: Record<string, string[]>; // 引用分塊 → 原典分塊
+}
+
+interface ChapterSummary {
+  id: string;                    // 章節條目 id（分塊 id 去掉 _chunk_xxx）
+  category: string;
+  prior: number;                 // 章節內最高的 prior
+  chunks: string[];              // 章節內的分塊（閱讀順序）
+  terms: Record<string, number>; // 術語 → 章節內分塊的最高單詞分數
+}
+
+interface ChapterIndex {
+  version: string;
+  vocabulary: string[];
+  df: number[];                  // 術語表每個詞有分數的分塊數（順序同 vocabulary），重排序的 idf 用
+  chapters: ChapterSummary[];
+}
+
+interface SnippetEntry {
+  ends: number[];                  // 每句的結束位置（遞增，與 snippets.sentence_ends 相同）
+  tokens: number[];                // 每句的估計 token 數
+  terms: Record<string, number[]>; // 術語 → 句子編號
+}
+
+interface SnippetIndex {
+  version: string;
+  vocabulary_size: number;
+  chunks: Record<string, SnippetEntry>;
+}
+
+interface SynonymTable {
+  version: string;
+  concept_of: Record<string, string>; // 寫法 → 概念 id
+  category_concepts?: Record<string, Record<string, string>>; // 類別 → 在該類別改指其他概念的寫法（紫微的七殺 → 七殺星）
+}
+
+interface RerankModel {
+  version: string;
+  features: string[];                    // 特徵順序（與 rerank.py 的 FEATURES 相同）
+  mean: number[];                        // 標準化用的平均與標準差
+  std: number[];
+  weights: number[];                     // 邏輯迴歸權重
+  bias: number;
+  max_positions: number;                 // 每個關鍵字取前幾個出現位置計算距離
+  source_quality: Record<string, number>; // 書名 → metadata.quality
+}
+
+// 放進 prompt 的分塊文字上限
+const PROMPT_MAX_CHARS = 800;
+
+// 依 token 預算選段（與 context_pack.py 相同）：每個出處約 200 tokens，單一段落最多 160 tokens
+const CONTEXT_TOKENS_PER_SOURCE = 200;
+const PASSAGE_MAX_TOKENS = 160;
+const REPEAT_VALUE = 0.25;      // 已涵蓋的關鍵字再次出現時的價值
+const LEAD_VALUE = 0.5;         // 沒有命中任何關鍵字時以開頭句子代替的段落價值
+const REDUNDANT_OVERLAP = 0.5;  // 與已選文字的二元組重疊比例達此值即視為重複
+const PROMPT_HEADER = '【古書參考】\n';
+
+// 兩段式排序（與 rerank.py 相同）：第一段關鍵字分數取前 100 名，第二段以特徵 × 訓練好的權重重排。
+// 章節剪枝要和第 100 名比較，每筆查詢約計分 290 個分塊（取前 5 名時約 155 個）；
+// 候選減為 50 名時重排序的 MRR@10 由 0.249 降到 0.207，所以保留 100 名（見 knowledge-base/README.md）
+const RERANK_CANDIDATES = 100;
+
 const db = ragData as RagDatabase;
+const guaIndex = guaData as GuaIndex;
+const ziweiIndex = ziweiData as ZiweiIndex;
+const hierarchy = hierarchyData as unknown as HierarchyIndex;
+const quotations = quotationData as QuotationLinks;
+const chapterIndex = chapterData as unknown as ChapterIndex;
+const snippetIndex = snippetData as unknown as SnippetIndex;
+const synonymTable = synonymData as SynonymTable;
+const conceptOf = new Map(Object.entries(synonymTable.concept_of));
+const categoryConcepts = new Map(
+  Object.entries(synonymTable.category_concepts || {}).map(([category, forms]) => [category, new Map(Object.entries(forms))])
+);
+const rerankModel = rerankData as RerankModel;
+// 概念 id → 全文中的寫法（兩字以上；單字的干支、生肖太常見，取句時不比對）
+const conceptForms = new Map<string, string[]>();
+for (const [form, concept] of conceptOf) {
+  if ([...form].length < 2) continue;
+  if (!conceptForms.has(concept)) conceptForms.set(concept, []);
+  (conceptForms.get(concept) as string[]).push(form);
+}
+const chunkById = new Map(db.chunks.map(c => [c.id, c]));
+// 分塊在 rag_chunks.json 的原順序（同分時較前者優先）
+const chunkOrder = new Map(db.chunks.map((c, i) => [c.id, i]));
+const categories = [...new Set(db.chunks.map(c => c.category))];
+// 每個分塊的 keywords 與 concepts（keywords 命中分、概念命中分與重排序特徵用）
+const chunkKeywords = new Map(db.chunks.map(c => [c.id, new Set(c.keywords || [])]));
+const chunkConcepts = new Map(db.chunks.map(c => [c.id, new Set(c.concepts || [])]));
+// 分數上限用：所有分塊的 keywords、concepts 與語料中出現在「卦」前面的字
+const keywordVocabulary = new Set(db.chunks.flatMap(c => c.keywords || []));
+const conceptVocabulary = new Set(db.chunks.flatMap(c => c.concepts || []));
+const guaPrefixChars = new Set(db.chunks.flatMap(c => [...c.text.matchAll(/([\s\S])卦/gu)].map(m => m[1])));
+
+/**
+ * 寫法 → 概念 id（與 synonyms.concept_of 相同）：同一寫法在不同類別可能指不同概念（紫微的七殺 → 七殺星）
+ */
+function conceptFor(term: string, category?: string): string | undefined {
+  return (category && categoryConcepts.get(category)?.get(term)) || conceptOf.get(term);
+}
+
+/**
+ * 各分類中每個關鍵字的概念 id；指定 category 時只有該分類
+ */
+function conceptsByCategory(keywords: string[], category?: string): Map<string, (string | undefined)[]> {
+  return new Map((category ? [category] : categories).map(c => [c, keywords.map(k => conceptFor(k, c))]));
+}
+
+/**
+ * 詞所屬概念在全文中比對的寫法（與 synonyms.text_forms 相同）：指定類別時依該類別的概念，
+ * 紫微的七殺含七殺星等寫法、偏官則不含；不指定時七殺星含各類別改指它的寫法
+ */
+function textForms(term: string, category?: string): string[] {
+  const concept = conceptFor(term, category);
+  if (concept === undefined) return [term];
+  const overrides = category ? categoryConcepts.get(category) : undefined;
+  const forms = [term];
+  for (const form of conceptForms.get(concept) || []) {
+    if (!forms.includes(form) && (overrides?.get(form) ?? concept) === concept) forms.push(form);
+  }
+  for (const table of category ? [overrides] : [...categoryConcepts.values()]) {
+    for (const [form, value] of table || []) {
+      if (value === concept && !forms.includes(form)) forms.push(form);
+    }
+  }
+  return forms;
+}
+
+/**
+ * 一組關鍵字在任何分塊可能得到的最高分
+ */
+function scoreBound(keywords: string[]): number {
+  let bound = 0;
+  for (const keyword of keywords) {
+    bound += TERM_SCORE_MAX;
+    if (!keywordVocabulary.has(keyword)) {
+      // 不在任何分塊 keywords 中時最多拿到概念命中分
+      const conceptual = categories.some(c => conceptVocabulary.has(conceptFor(keyword, c) ?? ''));
+      bound -= conceptual ? KEYWORD_BONUS - CONCEPT_BONUS : KEYWORD_BONUS;
+    }
+    if (!guaPrefixChars.has([...keyword].pop() ?? '')) bound -= GUA_BONUS;
+  }
+  return bound;
+}
+
+// 章節摘要的倒排表：術語 → [章節編號, 章節內最高單詞分數]
+const chapterVocabulary = new Set(chapterIndex.vocabulary);
+const chapterPostings = new Map<string, [number, number][]>();
+chapterIndex.chapters.forEach((chapter, ci) => {
+  for (const [term, score] of Object.entries(chapter.terms)) {
+    if (!chapterPostings.has(term)) chapterPostings.set(term, []);
+    (chapterPostings.get(term) as [number, number][]).push([ci, score]);
+  }
+});
+
+/**
+ * 粗篩：各章節的分數上限（術語表內的詞查倒排表，其餘詞以 scoreBound 估計），由高到低
+ */
+function chapterBounds(keywords: string[], category?: string): { ci: number; bound: number }[] {
+  const oovBound = scoreBound(keywords.filter(k => !chapterVocabulary.has(k)));
+  const totals = new Map<number, number>();
+  for (const keyword of keywords) {
+    for (const [ci, score] of chapterPostings.get(keyword) || []) {
+      totals.set(ci, (totals.get(ci) || 0) + score);
+    }
+  }
+
+  const candidates = oovBound > 0 ? chapterIndex.chapters.map((_, ci) => ci) : [...totals.keys()];
+  return candidates
+    .filter(ci => !category || chapterIndex.chapters[ci].category === category)
+    .map(ci => ({ ci, bound: ((totals.get(ci) || 0) + oovBound) * chapterIndex.chapters[ci].prior }))
+    .sort((a, b) => b.bound - a.bound || a.ci - b.ci);
+}
+
+/**
+ * 單一分塊的關鍵字分數（未乘 prior）
+ * @param concepts 各分類中每個關鍵字的概念 id（conceptsByCategory）
+ */
+function keywordScore(chunk: RagChunk, keywords: string[], concepts: Map<string, (string | undefined)[]>): number {
+  let score = 0;
+  const tags = chunkKeywords.get(chunk.id) as Set<string>;
+  const chunkConceptSet = chunkConcepts.get(chunk.id) as Set<string>;
+  const categoryConceptIds = concepts.get(chunk.category) || [];
+  const chunkText = chunk.text;
+  const textLower = chunkText.toLowerCase();
+  
+  keywords.forEach((keyword, i) => {
+    const kwLower = keyword.toLowerCase();
+    const concept = categoryConceptIds[i];
+    
+    // 關鍵字在 keywords 陣列中；只有概念相同（如 偏官 → 七殺）時加分較少
+    if (tags.has(keyword)) {
+      score += KEYWORD_BONUS;
+    } else if (concept !== undefined && chunkConceptSet.has(concept)) {
+      score += CONCEPT_BONUS;
+    }
+    
+    // 關鍵字出現在文本開頭 100 字內（更相關）
+    if (chunkText.slice(0, 100).includes(keyword)) {
+      score += 4;
+    }
+    
+    // 關鍵字 + "卦" 出現（如 "乾卦"）
+    if (chunkText.includes(keyword + '卦')) {
+      score += 6;
+    }
+    
+    // 文本中包含關鍵字
+    if (textLower.includes(kwLower)) {
+      // 計算出現次數，多次出現更相關
+      const count = (chunkText.match(new RegExp(keyword, 'g')) || []).length;
+      score += Math.min(count, 3); // 最多加 3 分
+    }
+  });
+  return score;
+}
+
+/**
+ * 第一段：關鍵字分數 × prior 的前 limit 名（同分時原順序較前的優先）
+ */
+function firstPassChunks(
+  keywords: string[],
+  category: string | undefined,
+  limit: number
+): { chunk: RagChunk; score: number; pos: number }[] {
+  const top: { chunk: RagChunk; score: number; pos: number }[] = [];
+  const concepts = conceptsByCategory(keywords, category);
+
+  // 先以章節摘要排出各章的分數上限，再依上限由高到低對章節內的分塊計分；
+  // 前言、OCR 品質、卦名等與查詢無關的調整已合併在 prior
+  for (const { ci, bound } of chapterBounds(keywords, category)) {
+    // 章節上限已低於第 limit 名時，之後的章節都不可能進榜
+    if (top.length === limit && bound < top[limit - 1].score) break;
+
+    for (const id of chapterIndex.chapters[ci].chunks) {
+      const chunk = chunkById.get(id);
+      if (!chunk) continue;
+      const score = keywordScore(chunk, keywords, concepts) * (chunk.prior ?? 1);
+      if (score <= 0) continue;
+
+      // 依分數插入前 limit 名；同分時原順序較前的優先
+      const pos = chunkOrder.get(chunk.id) as number;
+      let i = top.length;
+      while (i > 0 && (top[i - 1].score < score || (top[i - 1].score === score && top[i - 1].pos > pos))) i--;
+      if (i < limit) {
+        top.splice(i, 0, { chunk, score, pos });
+        if (top.length > limit) top.pop();
+      }
+    }
+  }
+
+  return top;
+}
+
+/**
+ * 分塊的 keywords 含該詞，或 concepts 含該詞在分塊類別的概念 id
+ */
+function isTagged(chunk: RagChunk, term: string): boolean {
+  if ((chunkKeywords.get(chunk.id) as Set<string>).has(term)) return true;
+  const concept = conceptFor(term, chunk.category);
+  return concept !== undefined && (chunkConcepts.get(chunk.id) as Set<string>).has(concept);
+}
+
+// 重排序特徵用：每個詞在第一段有分數的分塊數（術語表的詞建置時算好，其餘詞第一次查到時掃描）
+const termDocFreq = new Map(chapterIndex.vocabulary.map((term, i) => [term, chapterIndex.df[i]]));
+
+/**
+ * log(分塊數 ÷ (1 + 第一段有分數的分塊數))：文中出現，或 keywords 含該詞、concepts 含其概念
+ */
+function termIdf(term: string): number {
+  let df = termDocFreq.get(term);
+  if (df === undefined) {
+    df = 0;
+    for (const chunk of db.chunks) {
+      if ((term && chunk.text.includes(term)) || isTagged(chunk, term)) df++;
+    }
+    termDocFreq.set(term, df);
+  }
+  return Math.log(db.chunks.length / (1 + df));
+}
+
+/**
+ * 兩個已排序位置列表的最近距離
+ */
+function minDistance(a: number[], b: number[]): number {
+  let i = 0;
+  let j = 0;
+  let best = Infinity;
+  while (i < a.length && j < b.length) {
+    best = Math.min(best, Math.abs(a[i] - b[j]));
+    if (a[i] < b[j]) i++;
+    else j++;
+  }
+  return best;
+}
+
+/**
+ * 涵蓋每個列表至少一個位置的最短視窗長度
+ */
+function minWindow(lists: number[][]): number {
+  const events = lists.flatMap((positions, k) => positions.map(pos => [pos, k]))
+    .sort((x, y) => x[0] - y[0] || x[1] - y[1]);
+  const counts = new Array(lists.length).fill(0);
+  let covered = 0;
+  let best = Infinity;
+  let left = 0;
+  for (const [pos, k] of events) {
+    if (counts[k]++ === 0) covered++;
+    while (covered === lists.length) {
+      const [start, lk] = events[left++];
+      best = Math.min(best, pos - start);
+      if (--counts[lk] === 0) covered--;
+    }
+  }
+  return best;
+}
+
+/**
+ * 候選的特徵列（順序同 rerank_model.json 的 features）
+ */
+function rerankFeatures(
+  chunk: RagChunk,
+  base: number,
+  keywords: string[],
+  terms: string[],
+  idfs: number[],
+  category?: string
+): number[] {
+  const text = chunk.text;
+  const length = Math.max(text.length, 1);
+  const idfTotal = idfs.reduce((sum, idf) => sum + idf, 0) || 1;
+  const baseBound = keywords.length * TERM_SCORE_MAX;
+  const n = terms.length || 1;
+  const hits: number[][] = [];
+  let tf = 0, tagged = 0, head = 0, gua = 0, first = length;
+  let idfHits = 0, idfTf = 0, idfTagged = 0;
+
+  terms.forEach((term, i) => {
+    const idf = idfs[i];
+    if (isTagged(chunk, term)) {
+      tagged++;
+      idfTagged += idf;
+    }
+    if (!term) return;
+    // 所有出現位置（含重疊）；距離只取前 max_positions 個
+    const positions: number[] = [];
+    let count = 0;
+    for (let pos = text.indexOf(term); pos !== -1; pos = text.indexOf(term, pos + 1)) {
+      if (count < rerankModel.max_positions) positions.push(pos);
+      count++;
+    }
+    if (count === 0) return;
+    hits.push(positions);
+    const logCount = Math.log1p(count);
+    tf += logCount;
+    idfHits += idf;
+    idfTf += idf * logCount;
+    if (positions[0] + term.length <= 100) head++;
+    if (text.includes(term + '卦')) gua++;
+    first = Math.min(first, positions[0]);
+  });
+
+  let proximity = 0;
+  let window = 0;
+  if (hits.length >= 2) {
+    let closeness = 0;
+    let pairs = 0;
+    for (let a = 0; a < hits.length; a++) {
+      for (let b = a + 1; b < hits.length; b++) {
+        closeness += 1 / (1 + minDistance(hits[a], hits[b]) / 10);
+        pairs++;
+      }
+    }
+    proximity = closeness / pairs;
+    window = 1 / (1 + minWindow(hits) / 50);
+  }
+
+  return [
+    baseBound ? base / baseBound : 0,
+    hits.length / n, tf / n, tagged / n,
+    idfHits / idfTotal, idfTf / idfTotal, idfTagged / idfTotal,
+    head / n, gua / n,
+    hits.length ? 1 - first / length : 0,
+    proximity, window,
+    !category || chunk.category === category ? 1 : 0,
+    chunk.prior ?? 1,
+    chunk.ocr_quality ?? 1,
+    (rerankModel.source_quality[chunk.source] ?? 5) / 5,
+    Math.log(length) / Math.log(1000),
+  ];
+}
+
+/**
+ * 第二段：候選的特徵標準化後乘上權重重新排序（同分時保留第一段的順序）
+ */
+function rerankCandidates(
+  candidates: { chunk: RagChunk; score: number }[],
+  keywords: string[],
+  category?: string
+): RagChunk[] {
+  const terms = [...new Set(keywords)];
+  const idfs = terms.map(termIdf);
+  const { mean, std, weights, bias } = rerankModel;
+  return candidates
+    .map(({ chunk, score }, i) => {
+      const row = rerankFeatures(chunk, score, keywords, terms, idfs, category);
+      let z = bias;
+      row.forEach((x, f) => { z += (x - mean[f]) / std[f] * weights[f]; });
+      return { chunk, z, i };
+    })
+    .sort((a, b) => b.z - a.z || a.i - b.i)
+    .map(item => item.chunk);
+}
 
 /**
- * 根據關鍵字搜尋相關的古書段落
+ * 根據關鍵字搜尋相關的古書段落：第一段關鍵字分數取前 100 名候選，
+ * 第二段以詞頻、位置、關鍵字距離、idf、prior 與品質等特徵重新排序（權重由 rerank.py 訓練）
  * @param keywords 搜尋關鍵字陣列
  * @param category 限定分類（八字/紫微/易經）
  * @param limit 返回數量上限
@@ -35,65 +521,145 @@ export function searchChunks(
   category?: '八字' | '紫微' | '易經',
   limit: number = 5
 ): RagChunk[] {
-  // 過濾分類
-  let chunks = db.chunks;
-  if (category) {
-    chunks = chunks.filter(c => c.category === category);
-  }
-
-  // 計算每個 chunk 的匹配分數
-  const scored = chunks.map(chunk => {
-    let score = 0;
-    const chunkKeywords = new Set(chunk.keywords || []);
-    const chunkText = chunk.text;
-    const textLower = chunkText.toLowerCase();
-    
-    for (const keyword of keywords) {
-      const kwLower = keyword.toLowerCase();
-      
-      // 關鍵字在 keywords 陣列中
-      if (chunkKeywords.has(keyword)) {
-        score += 5;
-      }
-      
-      // 關鍵字出現在文本開頭 100 字內（更相關）
-      if (chunkText.slice(0, 100).includes(keyword)) {
-        score += 4;
-      }
-      
-      // 關鍵字 + "卦" 出現（如 "乾卦"）
-      if (chunkText.includes(keyword + '卦')) {
-        score += 6;
-      }
-      
-      // 文本中包含關鍵字
-      if (textLower.includes(kwLower)) {
-        // 計算出現次數，多次出現更相關
-        const count = (chunkText.match(new RegExp(keyword, 'g')) || []).length;
-        score += Math.min(count, 3); // 最多加 3 分
-      }
-    }
-    
-    // 降低「前言」類內容的權重
-    if (chunk.title === '前言' || chunk.chapter?.includes('前言')) {
-      score = Math.floor(score * 0.5);
+  const candidates = firstPassChunks(keywords, category, Math.max(limit, RERANK_CANDIDATES));
+  return rerankCandidates(candidates, keywords, category).slice(0, limit);
+}
+
+/**
+ * 依卦序與動爻直接查詢卦爻索引，不掃描全文
+ * @param guaNumber 卦序（1-64）
+ * @param dongYao 動爻位置（1-6）
+ * @param limit 返回數量上限
+ * @returns 討論該卦（動爻優先）的古書段落
+ */
+export function searchByGua(
+  guaNumber: number,
+  dongYao: number[] = [],
+  limit: number = 5
+): RagChunk[] {
+  const entry = guaIndex.hexagrams[String(guaNumber)];
+  if (!entry) return [];
+
+  const ids = new Set<string>();
+  for (const position of dongYao) {
+    for (const id of entry.lines[String(position)] || []) ids.add(id);
+  }
+  for (const id of entry.chunks) ids.add(id);
+
+  const results: RagChunk[] = [];
+  for (const id of ids) {
+    const chunk = chunkById.get(id);
+    if (chunk) results.push(chunk);
+    if (results.length >= limit) break;
+  }
+  return results;
+}
+
+/**
+ * 依命盤的（主星, 宮位）與（星曜, 四化）組合查詢共現索引
+ * 命中越多組合的段落排序越前，不掃描全文
+ */
+export function searchZiweiChart(chart: any, limit: number = 5): RagChunk[] {
+  const postings: string[][] = [];
+
+  for (const gong of chart.gongs || []) {
+    for (const star of gong.mainStars || []) {
+      const ids = ziweiIndex.star_palace[`${star.name}|${gong.name}`];
+      if (ids) postings.push(ids);
     }
-    
-    // 提高有具體卦名的內容權重
-    const guaPattern = /[乾坤震巽坎離艮兌]卦/;
-    if (guaPattern.test(chunkText.slice(0, 200))) {
-      score += 2;
+  }
+
+  const huaNames: Record<string, string> = { lu: '化祿', quan: '化權', ke: '化科', ji: '化忌' };
+  for (const [key, hua] of Object.entries(huaNames)) {
+    const star = chart.siHua?.[key]?.star;
+    const ids = star && ziweiIndex.star_hua[`${star}|${hua}`];
+    if (ids) postings.push(ids);
+  }
+
+  // 累計每個分塊命中的組合數（倒排表交集的計數版本）
+  const hits = new Map<string, number>();
+  for (const ids of postings) {
+    for (const id of ids) hits.set(id, (hits.get(id) || 0) + 1);
+  }
+
+  return [...hits.entries()]
+    .sort((a, b) => b[1] - a[1])
+    .slice(0, limit)
+    .map(([id]) => chunkById.get(id))
+    .filter((c): c is RagChunk => !!c);
+}
+
+/**
+ * 取出命中分塊前後各 radius 塊（同一本書內，依閱讀順序），不必重新掃描排序
+ */
+export function expandNeighbors(chunkId: string, radius: number = 1): RagChunk[] {
+  const node = hierarchy.nodes[chunkId];
+  if (!node || node.pos === undefined) return [];
+
+  let bookId = chunkId;
+  while (hierarchy.nodes[bookId].parent) bookId = hierarchy.nodes[bookId].parent as string;
+  const [start, end] = hierarchy.nodes[bookId].span as [number, number];
+
+  return hierarchy.order
+    .slice(Math.max(start, node.pos - radius), Math.min(end, node.pos + radius + 1))
+    .map(id => chunkById.get(id))
+    .filter((c): c is RagChunk => !!c);
+}
+
+/**
+ * 取出整節（或整章、整篇）的分塊
+ * @param nodeId 章節節點 id；傳入分塊 id 時取其所屬的節
+ */
+export function sectionChunks(nodeId: string): RagChunk[] {
+  let node = hierarchy.nodes[nodeId];
+  if (node?.level === 'chunk') node = hierarchy.nodes[node.parent as string];
+  if (!node?.span) return [];
+
+  return hierarchy.order
+    .slice(node.span[0], node.span[1])
+    .map(id => chunkById.get(id))
+    .filter((c): c is RagChunk => !!c);
+}
+
+/**
+ * 依章節合併命中：同一節（或指定層級的同一祖先）只保留排序最前的分塊
+ */
+export function collapseBySection(chunks: RagChunk[], level?: string): RagChunk[] {
+  const seen = new Set<string>();
+  return chunks.filter(chunk => {
+    const node = hierarchy.nodes[chunk.id];
+    if (!node) return true;
+
+    let group = node.parent as string;
+    if (level) {
+      for (let id = node.parent; id; id = hierarchy.nodes[id].parent) {
+        if (hierarchy.nodes[id].level === level) {
+          group = id;
+          break;
+        }
+      }
     }
-    
-    return { chunk, score };
+    if (seen.has(group)) return false;
+    seen.add(group);
+    return true;
   });
+}
 
-  // 排序並返回前 N 個
-  return scored
-    .filter(s => s.score > 0)
-    .sort((a, b) => b.score - a.score)
-    .slice(0, limit)
-    .map(s => s.chunk);
+/**
+ * 引文優先採用原典：結果中同時有引用分塊與其原典分塊時，以原典取代引用分塊的名次
+ */
+export function preferPrimarySource(chunks: RagChunk[]): RagChunk[] {
+  const ids = new Set(chunks.map(c => c.id));
+  const seen = new Set<string>();
+  const result: RagChunk[] = [];
+  for (const chunk of chunks) {
+    const primary = (quotations.primary_of[chunk.id] || []).find(id => ids.has(id));
+    const chosen = (primary && chunkById.get(primary)) || chunk;
+    if (seen.has(chosen.id)) continue;
+    seen.add(chosen.id);
+    result.push(chosen);
+  }
+  return result;
 }
 
 /**
@@ -160,17 +726,213 @@ export function extractZiweiKeywords(chart: any): string[] {
   return [...new Set(keywords)]; // 去重
 }
 
+/**
+ * 每個句子的結束位置（與 snippets.sentence_ends 相同：句尾標點含緊接的結束引號，最後不足一句的部分也算一句）
+ */
+function sentenceEnds(text: string): number[] {
+  const ends = [...text.matchAll(/[。！？；][」』]?/g)].map(m => (m.index as number) + m[0].length);
+  if (ends.length === 0 || ends[ends.length - 1] < text.length) ends.push(text.length);
+  return ends;
+}
+
+/**
+ * 分塊的句子與每句 token 數：取自 snippet_index.json；索引沒有這個分塊，
+ * 或與分塊不符（最後的結束位置不是文字長度、各句 token 加總不等於 chunk.tokens）時當場切句計算
+ */
+function sentencesOf(chunk: RagChunk): { sentences: string[]; tokens: number[] } {
+  const text = chunk.text;
+  const entry = snippetIndex.chunks[chunk.id];
+  const indexed = entry !== undefined && entry.ends[entry.ends.length - 1] === text.length &&
+    (chunk.tokens === undefined || entry.tokens.reduce((sum, n) => sum + n, 0) === chunk.tokens);
+  const ends = indexed ? entry.ends : sentenceEnds(text);
+  const sentences = ends.map((end, i) => text.slice(i ? ends[i - 1] : 0, end));
+  return { sentences, tokens: indexed ? entry.tokens : sentences.map(countTokens) };
+}
+
+/**
+ * 只保留命中關鍵字（含同義寫法，依分塊的分類）的句子（依原順序，不相鄰處以「……」相接），
+ * 總長不超過 maxChars；沒有命中時退回開頭 maxChars 字
+ */
+export function focusText(chunk: RagChunk, keywords: string[], maxChars: number = PROMPT_MAX_CHARS): string {
+  const text = chunk.text;
+  const terms = [...new Set(keywords.flatMap(k => textForms(k, chunk.category)))];
+  const { sentences } = sentencesOf(chunk);
+  const parts: string[] = [];
+  let length = 0;
+  let last = -2;
+  for (let i = 0; i < sentences.length; i++) {
+    if (!terms.some(k => sentences[i].includes(k))) continue;
+    const sentence = sentences[i].replace(/\n/g, '').trim();
+    if (!sentence) continue;
+    const piece = parts.length === 0 || i === last + 1 ? sentence : '……' + sentence;
+    if (length + piece.length > maxChars) {
+      if (parts.length === 0) parts.push(piece.slice(0, maxChars));
+      break;
+    }
+    parts.push(piece);
+    length += piece.length;
+    last = i;
+  }
+  return parts.length ? parts.join('') : text.slice(0, maxChars);
+}
+
+/**
+ * 估計 token 數（與 tokens.py 相同）：漢字與標點各 1 個，連續英數字每 4 字元 1 個，空白不計
+ */
+export function countTokens(text: string): number {
+  let tokens = 0;
+  for (const piece of text.match(/[A-Za-z0-9]+|\s+|[\s\S]/gu) || []) {
+    if (/^\s/.test(piece)) continue;
+    tokens += /^[A-Za-z0-9]/.test(piece) ? Math.ceil(piece.length / 4) : 1;
+  }
+  return tokens;
+}
+
+interface Passage {
+  rank: number;
+  chunk: RagChunk;
+  first: number;
+  last: number;
+  text: string;
+  tokens: number;
+  terms: Set<string>;
+  lead: boolean;
+  bigrams: Set<string>;
+}
+
+function bigrams(text: string): Set<string> {
+  const chars = [...text.replace(/[^\p{L}\p{N}]+/gu, '')];
+  const grams = new Set<string>();
+  for (let i = 0; i + 1 < chars.length; i++) grams.add(chars[i] + chars[i + 1]);
+  return grams;
+}
+
+function sourceLine(chunk: RagChunk): string {
+  return `📚 《${chunk.source}》${chunk.chapter}〈${chunk.title}〉`;
+}
+
+/**
+ * 分塊中的候選段落：連續命中關鍵字的句子，每段最多 PASSAGE_MAX_TOKENS（沒有命中時取開頭幾句）
+ */
+function passagesOf(chunk: RagChunk, rank: number, keywords: string[]): Passage[] {
+  const { sentences, tokens } = sentencesOf(chunk);
+  const forms = keywords.map(k => textForms(k, chunk.category));
+  const terms = sentences.map(s => new Set(keywords.filter((_, i) => forms[i].some(f => s.includes(f)))));
+  let hit = sentences.map((_, i) => i).filter(i => terms[i].size > 0);
+  const lead = hit.length === 0;
+  if (lead) hit = sentences.map((_, i) => i);
+
+  const passages: Passage[] = [];
+  const make = (run: number[], text: string, count: number): Passage => ({
+    rank, chunk, first: run[0], last: run[run.length - 1], text, tokens: count, lead,
+    terms: new Set(run.flatMap(i => [...terms[i]])), bigrams: bigrams(text),
+  });
+  let run: number[] = [];
+  let runTokens = 0;
+  const flush = () => {
+    const text = run.map(i => sentences[i].replace(/\n/g, '').trim()).join('');
+    if (run.length && text) passages.push(make(run, text, runTokens));
+    run = [];
+    runTokens = 0;
+  };
+  for (const i of hit) {
+    if (run.length && (i !== run[run.length - 1] + 1 || runTokens + tokens[i] > PASSAGE_MAX_TOKENS)) {
+      flush();
+      if (lead) break;
+    }
+    if (tokens[i] > PASSAGE_MAX_TOKENS) {
+      // 超長的句子：截斷到上限
+      let cut = sentences[i].replace(/\n/g, '').trim();
+      while (cut && countTokens(cut) > PASSAGE_MAX_TOKENS) {
+        cut = cut.slice(0, Math.floor(cut.length * PASSAGE_MAX_TOKENS / countTokens(cut)));
+      }
+      passages.push(make([i], cut, countTokens(cut)));
+      if (lead) break;
+      continue;
+    }
+    run.push(i);
+    runTokens += tokens[i];
+  }
+  flush();
+  return lead ? passages.slice(0, 1) : passages;
+}
+
+/**
+ * 在 token 預算內選出價值最高、不重複的段落組成 prompt（貪婪背包）
+ * 每一步選「價值 ÷ token 數」最高且放得進剩餘預算者；價值 = 排名權重 ×（新涵蓋關鍵字 + 已涵蓋 × 0.25），
+ * 第一次選到某分塊時出處標題也算進成本；與已選文字二元組重疊過半的段落（跨書引文、重複口訣）捨棄
+ * @param chunks 依排名排列的候選分塊
+ */
+export function packContext(chunks: RagChunk[], keywords: string[], tokenBudget: number): string {
+  let candidates = chunks.flatMap((chunk, rank) => passagesOf(chunk, rank, keywords));
+  const headerTokens = new Map(chunks.map(c => [c, countTokens(sourceLine(c))]));
+  const separatorTokens = countTokens('……');
+  let remaining = tokenBudget - countTokens(PROMPT_HEADER);
+  const covered = new Set<string>();
+  const seen = new Set<string>();
+  const used = new Set<RagChunk>();
+  const selected: Passage[] = [];
+
+  while (candidates.length) {
+    let best: Passage | undefined;
+    let bestRatio = 0;
+    let bestCost = 0;
+    for (const p of candidates) {
+      const cost = p.tokens + (used.has(p.chunk) ? separatorTokens : headerTokens.get(p.chunk) as number);
+      if (cost > remaining) continue;
+      let value = LEAD_VALUE;
+      if (!p.lead) {
+        const fresh = [...p.terms].filter(t => !covered.has(t)).length;
+        value = fresh + REPEAT_VALUE * (p.terms.size - fresh);
+      }
+      const ratio = value / (1 + p.rank) / Math.max(cost, 1);
+      if (ratio > bestRatio) {
+        best = p;
+        bestRatio = ratio;
+        bestCost = cost;
+      }
+    }
+    if (!best) break;
+    const chosen = best;
+    selected.push(chosen);
+    remaining -= bestCost;
+    used.add(chosen.chunk);
+    chosen.terms.forEach(t => covered.add(t));
+    chosen.bigrams.forEach(g => seen.add(g));
+    // 與已選文字大幅重疊的段落不再考慮
+    candidates = candidates.filter(p => p !== chosen && (p.bigrams.size === 0 ||
+      [...p.bigrams].filter(g => seen.has(g)).length / p.bigrams.size < REDUNDANT_OVERLAP));
+  }
+  if (selected.length === 0) return '';
+
+  // 依分塊排名、段落位置輸出；同一分塊不相鄰的段落以「……」相接
+  selected.sort((a, b) => a.rank - b.rank || a.first - b.first);
+  const lines: string[] = [PROMPT_HEADER];
+  for (let i = 0; i < selected.length; ) {
+    const chunk = selected[i].chunk;
+    let text = '';
+    let last = -2;
+    for (; i < selected.length && selected[i].chunk === chunk; i++) {
+      text += (text === '' || selected[i].first === last + 1 ? '' : '……') + selected[i].text;
+      last = selected[i].last;
+    }
+    lines.push(sourceLine(chunk), text, '');
+  }
+  return lines.join('\n');
+}
+
 /**
  * 格式化檢索結果為 prompt 文字
+ * @param keywords 有傳入時只放命中關鍵字的句子，否則放分塊開頭
  */
-export function formatChunksForPrompt(chunks: RagChunk[]): string {
+export function formatChunksForPrompt(chunks: RagChunk[], keywords?: string[]): string {
   if (chunks.length === 0) return '';
   
   const lines: string[] = ['【古書參考】\n'];
   
   for (const chunk of chunks) {
-    lines.push(`📚 《${chunk.source}》${chunk.chapter}〈${chunk.title}〉`);
-    lines.push(chunk.text.slice(0, 800)); // 限制長度
+    lines.push(sourceLine(chunk));
+    lines.push(keywords ? focusText(chunk, keywords) : chunk.text.slice(0, PROMPT_MAX_CHARS)); // 限制長度
     lines.push('');
   }
   
@@ -179,19 +941,34 @@ export function formatChunksForPrompt(chunks: RagChunk[]): string {
 
 /**
  * 為八字解析獲取相關古書內容
+ * @param tokenBudget 古書參考的 token 上限（預設每個出處約 200 tokens）
  */
-export function getRelevantBaziContent(baziResult: any, limit: number = 3): string {
+export function getRelevantBaziContent(
+  baziResult: any,
+  limit: number = 3,
+  tokenBudget: number = limit * CONTEXT_TOKENS_PER_SOURCE
+): string {
   const keywords = extractBaziKeywords(baziResult);
-  const chunks = searchChunks(keywords, '八字', limit);
-  return formatChunksForPrompt(chunks);
+  // 多取一些再依章節合併、引文改用原典，避免同一節或同一段引文佔滿名額；再依 token 預算選段
+  const chunks = preferPrimarySource(collapseBySection(searchChunks(keywords, '八字', limit * 3)));
+  return packContext(chunks, keywords, tokenBudget);
 }
 
 /**
  * 為紫微解析獲取相關古書內容
+ * @param tokenBudget 古書參考的 token 上限（預設每個出處約 200 tokens）
  */
-export function getRelevantZiweiContent(chart: any, limit: number = 3): string {
+export function getRelevantZiweiContent(
+  chart: any,
+  limit: number = 3,
+  tokenBudget: number = limit * CONTEXT_TOKENS_PER_SOURCE
+): string {
   const keywords = extractZiweiKeywords(chart);
-  const chunks = searchChunks(keywords, '紫微', limit);
-  return formatChunksForPrompt(chunks);
+  let chunks = preferPrimarySource(collapseBySection(searchZiweiChart(chart, limit * 3)));
+  if (chunks.length === 0) {
+    // 命盤組合在共現索引中皆無命中時，退回關鍵字搜尋
+    chunks = preferPrimarySource(collapseBySection(searchChunks(keywords, '紫微', limit * 3)));
+  }
+  return packContext(chunks, keywords, tokenBudget);
 }
 // force deploy Wed Feb 18 20:47:00 CST 2026